@@ -0,0 +1,198 @@
+import os
+import json
+import asyncio
+import time
+import base64
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Callable, Dict, Optional, Tuple
+
+from fastapi import Request, Response
+from starlette.concurrency import run_in_threadpool
+from sqlalchemy import text
+
+from api.database import async_engine
+
+# (status_code, headers, etag, body); headers keep e.g. content-type and X-Next-Cursor
+CachedResponse = Tuple[int, Dict[str, str], str, bytes]
+
+CACHE_BACKEND = os.getenv("API_CACHE_BACKEND", "memory")  # memory | redis | none
+CACHE_TTL = int(os.getenv("API_CACHE_TTL", "300"))
+CACHE_MAX_ENTRIES = int(os.getenv("API_CACHE_MAX_ENTRIES", "1024"))
+# How long clients may reuse a response before revalidating with If-None-Match
+CLIENT_MAX_AGE = int(os.getenv("API_CACHE_CLIENT_MAX_AGE", "60"))
+# How often the warehouse version stamp is re-read from Postgres
+VERSION_CHECK_SECONDS = float(os.getenv("API_CACHE_VERSION_CHECK_SECONDS", "5"))
+REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379/0")
+
+CACHED_PREFIX = "/api/"
+
+VERSION_SQL = text("select version from analytics.warehouse_version where id = 1")
+
+
+class MemoryCache:
+    """In-process TTL + LRU cache. Each uvicorn worker keeps its own."""
+
+    def __init__(self, max_entries: int, ttl: int) -> None:
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._items: "OrderedDict[str, Tuple[float, CachedResponse]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[CachedResponse]:
+        with self._lock:
+            item = self._items.get(key)
+            if item is None:
+                return None
+            expires_at, value = item
+            if expires_at < time.monotonic():
+                del self._items[key]
+                return None
+            self._items.move_to_end(key)
+            return value
+
+    def set(self, key: str, value: CachedResponse) -> None:
+        with self._lock:
+            self._items[key] = (time.monotonic() + self.ttl, value)
+            self._items.move_to_end(key)
+            while len(self._items) > self.max_entries:
+                self._items.popitem(last=False)
+
+
+class RedisCache:
+    """Shared cache across workers/hosts. Redis handles TTL and (with an
+    allkeys-lru maxmemory policy) eviction."""
+
+    def __init__(self, url: str, ttl: int, prefix: str = "med_api:") -> None:
+        try:
+            import redis
+        except ImportError as e:
+            raise RuntimeError("API_CACHE_BACKEND=redis requires the 'redis' package (pip install redis)") from e
+        self._client = redis.Redis.from_url(url)
+        self.ttl = ttl
+        self.prefix = prefix
+
+    def get(self, key: str) -> Optional[CachedResponse]:
+        raw = self._client.get(self.prefix + key)
+        if raw is None:
+            return None
+        d = json.loads(raw)
+        return d["status"], d["headers"], d["etag"], base64.b64decode(d["body"])
+
+    def set(self, key: str, value: CachedResponse) -> None:
+        status, headers, etag, body = value
+        raw = json.dumps({
+            "status": status,
+            "headers": headers,
+            "etag": etag,
+            "body": base64.b64encode(body).decode("ascii"),
+        })
+        self._client.set(self.prefix + key, raw, ex=self.ttl)
+
+
+class WarehouseVersion:
+    """
+    Reads analytics.warehouse_version (bumped by the pipeline after each dbt
+    run) at most every `check_seconds`. The version is part of every cache
+    key, so a bump makes all older entries unreachable.
+    """
+
+    def __init__(self, check_seconds: float) -> None:
+        self.check_seconds = check_seconds
+        self._version = "0"
+        self._checked_at = float("-inf")
+        self._lock = asyncio.Lock()
+
+    async def current(self) -> str:
+        if time.monotonic() - self._checked_at < self.check_seconds:
+            return self._version
+        async with self._lock:
+            if time.monotonic() - self._checked_at < self.check_seconds:
+                return self._version
+            try:
+                async with async_engine.connect() as conn:
+                    v = (await conn.execute(VERSION_SQL)).scalar()
+                self._version = str(v) if v is not None else "0"
+            except Exception:
+                # table not created yet (pipeline never ran) or DB hiccup:
+                # keep the last known version rather than failing requests
+                pass
+            self._checked_at = time.monotonic()
+            return self._version
+
+
+def make_cache():
+    if CACHE_BACKEND == "none":
+        return None
+    if CACHE_BACKEND == "redis":
+        return RedisCache(REDIS_URL, CACHE_TTL)
+    if CACHE_BACKEND == "memory":
+        return MemoryCache(CACHE_MAX_ENTRIES, CACHE_TTL)
+    raise ValueError(f"Unknown API_CACHE_BACKEND: {CACHE_BACKEND} (expected memory, redis or none)")
+
+
+def cache_key(version: str, request: Request) -> str:
+    query = "&".join(sorted(f"{k}={v}" for k, v in request.query_params.multi_items()))
+    raw = f"{version}|{request.url.path}|{query}"
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+def etag_matches(request: Request, etag: str) -> bool:
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    if header.strip() == "*":
+        return True
+    tags = [t.strip().removeprefix("W/") for t in header.split(",")]
+    return etag in tags
+
+
+def cache_headers(etag: str) -> dict:
+    return {"ETag": etag, "Cache-Control": f"public, max-age={CLIENT_MAX_AGE}"}
+
+
+def response_cache_middleware(excluded_prefixes: Tuple[str, ...] = ()) -> Callable:
+    """
+    HTTP middleware caching successful GET responses under /api/, keyed by
+    warehouse version + path + sorted query string. Adds ETag and
+    Cache-Control and answers a matching If-None-Match with 304.
+    """
+    cache = make_cache()
+    version = WarehouseVersion(VERSION_CHECK_SECONDS)
+
+    async def middleware(request: Request, call_next):
+        path = request.url.path
+        if (
+            cache is None
+            or request.method != "GET"
+            or not path.startswith(CACHED_PREFIX)
+            or path.startswith(excluded_prefixes)
+        ):
+            return await call_next(request)
+
+        key = cache_key(await version.current(), request)
+        hit = await run_in_threadpool(cache.get, key)
+        if hit is not None:
+            status, headers, etag, body = hit
+            if etag_matches(request, etag):
+                return Response(status_code=304, headers=cache_headers(etag))
+            headers = {**headers, **cache_headers(etag), "X-Cache": "HIT"}
+            return Response(content=body, status_code=status, headers=headers)
+
+        response = await call_next(request)
+        if response.status_code != 200:
+            return response
+
+        body = b"".join([chunk async for chunk in response.body_iterator])
+        etag = '"' + hashlib.sha256(body).hexdigest()[:32] + '"'
+        # content-length is recomputed by Response from the body
+        headers = {k: v for k, v in response.headers.items() if k.lower() != "content-length"}
+        await run_in_threadpool(cache.set, key, (response.status_code, headers, etag, body))
+
+        if etag_matches(request, etag):
+            return Response(status_code=304, headers=cache_headers(etag))
+        headers = {**headers, **cache_headers(etag), "X-Cache": "MISS"}
+        return Response(content=body, status_code=response.status_code, headers=headers)
+
+    return middleware
@@ -0,0 +1,176 @@
+import io
+import csv
+import json
+from typing import Any, AsyncIterator, Dict, List, Optional, Sequence
+
+from sqlalchemy import text
+
+from api.database import async_engine
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # parquet exports are unavailable without pyarrow
+    pa = None
+    pq = None
+
+ANALYTICS_SCHEMA = "analytics"
+
+# Rows fetched per round trip from the server-side cursor; also the Parquet
+# row group size, so memory stays bounded by one chunk.
+EXPORT_CHUNK_ROWS = 10_000
+
+MEDIA_TYPES = {
+    "parquet": "application/vnd.apache.parquet",
+    "ndjson": "application/x-ndjson",
+    "csv": "text/csv",
+}
+
+# Filters are bound the same way as the report endpoints: channel_name and
+# date_key bounds, each optional.
+_FILTERS = """
+    where (cast(:channel as text) is null or c.channel_name = cast(:channel as text))
+      and (cast(:date_from as int) is null or f.date_key >= cast(:date_from as int))
+      and (cast(:date_to as int) is null or f.date_key <= cast(:date_to as int))
+"""
+
+DATASETS: Dict[str, Dict[str, Any]] = {
+    "fct_messages": {
+        "columns": [
+            ("message_id", "int64"),
+            ("channel_name", "string"),
+            ("date_key", "int32"),
+            ("message_timestamp", "timestamp"),
+            ("message_text", "string"),
+            ("message_length", "int64"),
+            ("view_count", "int64"),
+            ("forward_count", "int64"),
+            ("has_image", "bool"),
+        ],
+        "sql": text(f"""
+            select
+                f.message_id, c.channel_name, f.date_key, f.message_timestamp, f.message_text,
+                f.message_length, f.view_count, f.forward_count, f.has_image
+            from {ANALYTICS_SCHEMA}.fct_messages f
+            join {ANALYTICS_SCHEMA}.dim_channels c on f.channel_key = c.channel_key
+            {_FILTERS}
+        """),
+    },
+    "fct_image_detections": {
+        "columns": [
+            ("message_id", "int64"),
+            ("channel_name", "string"),
+            ("date_key", "int32"),
+            ("detected_objects", "string"),
+            ("confidence_score", "float64"),
+            ("image_category", "string"),
+            ("image_path", "string"),
+            ("view_count", "int64"),
+        ],
+        "sql": text(f"""
+            select
+                f.message_id, c.channel_name, f.date_key, f.detected_objects, f.confidence_score,
+                f.image_category, f.image_path, f.view_count
+            from {ANALYTICS_SCHEMA}.fct_image_detections f
+            join {ANALYTICS_SCHEMA}.dim_channels c on f.channel_key = c.channel_key
+            {_FILTERS}
+        """),
+    },
+}
+
+
+def parquet_schema(columns: Sequence[tuple]):
+    types = {
+        "int64": pa.int64(),
+        "int32": pa.int32(),
+        "float64": pa.float64(),
+        "bool": pa.bool_(),
+        "string": pa.string(),
+        "timestamp": pa.timestamp("us"),
+    }
+    return pa.schema([(name, types[t]) for name, t in columns])
+
+
+class _ChunkSink(io.RawIOBase):
+    """Write-only file that ParquetWriter fills and the response drains."""
+
+    def __init__(self) -> None:
+        super().__init__()
+        self._parts: List[bytes] = []
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, b) -> int:
+        self._parts.append(bytes(b))
+        return len(b)
+
+    def drain(self) -> bytes:
+        data = b"".join(self._parts)
+        self._parts = []
+        return data
+
+
+async def _iter_partitions(sql, params: Dict[str, Any], statement_timeout_ms: int) -> AsyncIterator[List[tuple]]:
+    """
+    Stream the query through an asyncpg server-side cursor on a dedicated
+    connection, EXPORT_CHUNK_ROWS rows at a time.
+    """
+    async with async_engine.connect() as conn:
+        # an export may legitimately run longer than the API's default timeout
+        await conn.execute(
+            text("select set_config('statement_timeout', :v, true)"),
+            {"v": str(statement_timeout_ms)},
+        )
+        result = await conn.stream(sql.execution_options(yield_per=EXPORT_CHUNK_ROWS), params)
+        async for rows in result.partitions(EXPORT_CHUNK_ROWS):
+            yield rows
+
+
+async def stream_export(
+    dataset: str,
+    fmt: str,
+    params: Dict[str, Optional[Any]],
+    statement_timeout_ms: int = 0,
+) -> AsyncIterator[bytes]:
+    spec = DATASETS[dataset]
+    names = [name for name, _ in spec["columns"]]
+    partitions = _iter_partitions(spec["sql"], params, statement_timeout_ms)
+
+    if fmt == "ndjson":
+        async for rows in partitions:
+            yield "".join(
+                json.dumps(dict(zip(names, r)), ensure_ascii=False, default=str) + "\n" for r in rows
+            ).encode("utf-8")
+
+    elif fmt == "csv":
+        buf = io.StringIO()
+        writer = csv.writer(buf)
+        writer.writerow(names)
+        yield buf.getvalue().encode("utf-8")
+        async for rows in partitions:
+            buf.seek(0)
+            buf.truncate()
+            writer.writerows(rows)
+            yield buf.getvalue().encode("utf-8")
+
+    elif fmt == "parquet":
+        schema = parquet_schema(spec["columns"])
+        sink = _ChunkSink()
+        writer = pq.ParquetWriter(sink, schema, compression="zstd")
+        try:
+            async for rows in partitions:
+                columns = list(zip(*rows))
+                table = pa.Table.from_arrays(
+                    [pa.array(col, type=field.type) for col, field in zip(columns, schema)],
+                    schema=schema,
+                )
+                writer.write_table(table, row_group_size=EXPORT_CHUNK_ROWS)
+                yield sink.drain()
+        finally:
+            writer.close()
+        # footer
+        yield sink.drain()
+
+    else:
+        raise ValueError(f"Unknown export format: {fmt}")
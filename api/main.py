@@ -1,8 +1,18 @@
-from fastapi import FastAPI, Depends, HTTPException, Query
-from sqlalchemy.orm import Session
+import os
+import json
+import base64
+from datetime import date
+from typing import Literal, Optional
+
+from fastapi import FastAPI, Depends, HTTPException, Query, Response
+from fastapi.responses import StreamingResponse
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import text
 
-from api.database import get_db
+from api.cache import response_cache_middleware
+from api.database import get_async_db
+from api.export import MEDIA_TYPES, pa, stream_export
+from api.metrics import install_db_events, metrics_middleware, metrics_response
 from api.schemas import TopProduct, ChannelActivityPoint, MessageResult, VisualContentStat
 
 app = FastAPI(
@@ -13,66 +23,223 @@ app = FastAPI(
 
 ANALYTICS_SCHEMA = "analytics"
 
+# Marts only change when the pipeline's dbt run finishes, so responses are
+# cached until analytics.warehouse_version is bumped (see api/cache.py).
+# Exports are streamed and can be arbitrarily large, so they bypass the cache.
+app.middleware("http")(response_cache_middleware(excluded_prefixes=("/api/export",)))
+
+# Added last so it is outermost: latency includes cache hits. DB time comes
+# from SQLAlchemy cursor events on the async engine.
+install_db_events()
+app.middleware("http")(metrics_middleware())
+
+# 0 disables the timeout for exports; the regular endpoints keep DB_STATEMENT_TIMEOUT_MS
+EXPORT_STATEMENT_TIMEOUT_MS = int(os.getenv("API_EXPORT_STATEMENT_TIMEOUT_MS", "0"))
+
+# Queries are built once at import so every call sends the same SQL string and
+# asyncpg reuses its prepared statement. Optional filters are written as
+# `cast(:p as type) is null or ...` instead of being spliced in per request.
+TOP_PRODUCTS_SQL = text(f"""
+    select t.term, sum(t.term_count)::int as count
+    from {ANALYTICS_SCHEMA}.agg_term_daily t
+    where (cast(:channel as text) is null
+           or t.channel_key in (
+               select channel_key from {ANALYTICS_SCHEMA}.dim_channels
+               where channel_name = cast(:channel as text)))
+      and (cast(:date_from as int) is null or t.date_key >= cast(:date_from as int))
+      and (cast(:date_to as int) is null or t.date_key <= cast(:date_to as int))
+    group by t.term
+    order by count desc, t.term
+    limit :limit
+""")
+
+# Served from the daily rollup; week/month buckets start on the period's first day
+CHANNEL_ACTIVITY_SQL = text(f"""
+    select
+        date_trunc(cast(:granularity as text), a.full_date)::date::text as date,
+        sum(a.posts)::int as posts,
+        sum(a.views)::bigint as views,
+        sum(a.forwards)::bigint as forwards,
+        sum(a.image_posts)::int as image_posts
+    from {ANALYTICS_SCHEMA}.agg_channel_activity_daily a
+    join {ANALYTICS_SCHEMA}.dim_channels c on a.channel_key = c.channel_key
+    where c.channel_name = :channel_name
+      and (cast(:date_from as int) is null or a.date_key >= cast(:date_from as int))
+      and (cast(:date_to as int) is null or a.date_key <= cast(:date_to as int))
+    group by 1
+    order by 1
+""")
+
+SEARCH_MESSAGES_SQL = text(f"""
+    with q as (
+        select websearch_to_tsquery('simple', :query) as tsq
+    ),
+    hits as (
+        select
+            m.message_id,
+            m.channel_key,
+            coalesce(m.message_timestamp, '-infinity'::timestamp) as ts,
+            m.message_text,
+            m.view_count,
+            m.forward_count,
+            m.has_image,
+            (ts_rank_cd(m.search_vector, q.tsq) + word_similarity(:query, m.message_text))::float8 as rank
+        from {ANALYTICS_SCHEMA}.fct_messages m
+        cross join q
+        where m.search_vector @@ q.tsq
+           or m.message_text ilike :pattern
+    )
+    select
+        h.message_id,
+        c.channel_name,
+        h.ts::text as message_timestamp,
+        h.message_text,
+        h.view_count,
+        h.forward_count,
+        h.has_image,
+        h.rank,
+        h.channel_key
+    from hits h
+    join {ANALYTICS_SCHEMA}.dim_channels c on h.channel_key = c.channel_key
+    where cast(:after_rank as float8) is null
+       or (h.rank, h.ts, h.channel_key, h.message_id)
+          < (cast(:after_rank as float8), cast(cast(:after_ts as text) as timestamp),
+             cast(:after_key as text), cast(:after_id as bigint))
+    order by h.rank desc, h.ts desc, h.channel_key desc, h.message_id desc
+    limit :limit
+""")
+
+# One row per channel x image_category (category is null for channels with
+# no image posts in the window); totals come from the activity rollup.
+VISUAL_CONTENT_SQL = text(f"""
+    with posts as (
+        select channel_key, sum(posts)::int as total_posts
+        from {ANALYTICS_SCHEMA}.agg_channel_activity_daily
+        where (cast(:date_from as int) is null or date_key >= cast(:date_from as int))
+          and (cast(:date_to as int) is null or date_key <= cast(:date_to as int))
+        group by channel_key
+    ),
+    images as (
+        select channel_key, image_category, sum(image_posts)::int as image_posts, sum(views)::bigint as views
+        from {ANALYTICS_SCHEMA}.agg_visual_content_daily
+        where (cast(:date_from as int) is null or date_key >= cast(:date_from as int))
+          and (cast(:date_to as int) is null or date_key <= cast(:date_to as int))
+        group by channel_key, image_category
+    )
+    select c.channel_name, p.total_posts, i.image_category, i.image_posts, i.views
+    from posts p
+    join {ANALYTICS_SCHEMA}.dim_channels c on p.channel_key = c.channel_key
+    left join images i on i.channel_key = p.channel_key
+    order by c.channel_name, i.image_posts desc nulls last, i.image_category
+""")
+
+
+@app.get("/metrics", include_in_schema=False)
+def metrics():
+    return metrics_response()
+
+
 @app.get("/api/reports/top-products", response_model=list[TopProduct])
-def top_products(limit: int = Query(10, ge=1, le=100), db: Session = Depends(get_db)):
-    # Simple tokenization: split on whitespace and count (demo-friendly).
-    # For production you’d use better NLP/tokenization.
-    q = text(f"""
-        with tokens as (
-            select unnest(regexp_split_to_array(lower(message_text), '\\s+')) as term
-            from {ANALYTICS_SCHEMA}.fct_messages
-            where message_text is not null and message_text <> ''
-        )
-        select term, count(*)::int as count
-        from tokens
-        where length(term) >= 3
-        group by term
-        order by count desc
-        limit :limit
-    """)
-    rows = db.execute(q, {"limit": limit}).fetchall()
+async def top_products(
+    limit: int = Query(10, ge=1, le=100),
+    channel: Optional[str] = Query(None, description="Restrict to one channel"),
+    date_from: Optional[date] = Query(None, description="Inclusive start date (YYYY-MM-DD)"),
+    date_to: Optional[date] = Query(None, description="Inclusive end date (YYYY-MM-DD)"),
+    db: AsyncSession = Depends(get_async_db),
+):
+    # Terms are tokenized and counted per day/channel by the agg_term_daily
+    # mart (stopwords removed); here we only sum over the requested window.
+    if date_from is not None and date_to is not None and date_from > date_to:
+        raise HTTPException(status_code=400, detail="date_from must be on or before date_to")
+
+    params = {
+        "limit": limit,
+        "channel": channel.lower().strip() if channel is not None else None,
+        "date_from": int(date_from.strftime("%Y%m%d")) if date_from is not None else None,
+        "date_to": int(date_to.strftime("%Y%m%d")) if date_to is not None else None,
+    }
+    rows = (await db.execute(TOP_PRODUCTS_SQL, params)).fetchall()
     return [{"term": r[0], "count": r[1]} for r in rows]
 
 
 @app.get("/api/channels/{channel_name}/activity", response_model=list[ChannelActivityPoint])
-def channel_activity(channel_name: str, db: Session = Depends(get_db)):
-    q = text(f"""
-        select d.full_date::text as date, count(*)::int as posts
-        from {ANALYTICS_SCHEMA}.fct_messages m
-        join {ANALYTICS_SCHEMA}.dim_channels c on m.channel_key = c.channel_key
-        join {ANALYTICS_SCHEMA}.dim_dates d on m.date_key = d.date_key
-        where c.channel_name = :channel_name
-        group by d.full_date
-        order by d.full_date
-    """)
-    rows = db.execute(q, {"channel_name": channel_name.lower().strip()}).fetchall()
+async def channel_activity(
+    channel_name: str,
+    granularity: Literal["day", "week", "month"] = Query("day"),
+    date_from: Optional[date] = Query(None, description="Inclusive start date (YYYY-MM-DD)"),
+    date_to: Optional[date] = Query(None, description="Inclusive end date (YYYY-MM-DD)"),
+    db: AsyncSession = Depends(get_async_db),
+):
+    if date_from is not None and date_to is not None and date_from > date_to:
+        raise HTTPException(status_code=400, detail="date_from must be on or before date_to")
+
+    params = {
+        "channel_name": channel_name.lower().strip(),
+        "granularity": granularity,
+        "date_from": int(date_from.strftime("%Y%m%d")) if date_from is not None else None,
+        "date_to": int(date_to.strftime("%Y%m%d")) if date_to is not None else None,
+    }
+    rows = (await db.execute(CHANNEL_ACTIVITY_SQL, params)).fetchall()
     if not rows:
         raise HTTPException(status_code=404, detail="Channel not found or no activity.")
-    return [{"date": r[0], "posts": r[1]} for r in rows]
+    return [
+        {
+            "date": r[0],
+            "posts": r[1],
+            "views": r[2],
+            "forwards": r[3],
+            "image_posts": r[4],
+            "avg_views": round(r[2] / r[1], 2) if r[1] else 0.0,
+            "forward_rate": round(r[3] / r[2], 4) if r[2] else 0.0,
+            "pct_with_images": round(100.0 * r[4] / r[1], 2) if r[1] else 0.0,
+        }
+        for r in rows
+    ]
+
+
+def _encode_cursor(rank: float, ts: str, channel_key: str, message_id: int) -> str:
+    payload = json.dumps([rank, ts, channel_key, message_id])
+    return base64.urlsafe_b64encode(payload.encode("utf-8")).decode("ascii")
+
+
+def _decode_cursor(cursor: str) -> tuple:
+    try:
+        rank, ts, channel_key, message_id = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+        return float(rank), str(ts), str(channel_key), int(message_id)
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid cursor.")
 
 
 @app.get("/api/search/messages", response_model=list[MessageResult])
-def search_messages(
+async def search_messages(
+    response: Response,
     query: str = Query(..., min_length=2),
     limit: int = Query(20, ge=1, le=200),
-    db: Session = Depends(get_db)
+    cursor: Optional[str] = Query(None, description="Opaque cursor from the previous page's X-Next-Cursor header"),
+    db: AsyncSession = Depends(get_async_db)
 ):
-    q = text(f"""
-        select
-            m.message_id,
-            c.channel_name,
-            m.message_timestamp::text as message_timestamp,
-            m.message_text,
-            m.view_count,
-            m.forward_count,
-            m.has_image
-        from {ANALYTICS_SCHEMA}.fct_messages m
-        join {ANALYTICS_SCHEMA}.dim_channels c on m.channel_key = c.channel_key
-        where lower(m.message_text) like lower(:pattern)
-        order by m.message_timestamp desc
-        limit :limit
-    """)
-    rows = db.execute(q, {"pattern": f"%{query}%", "limit": limit}).fetchall()
+    # Full-text match on the search_vector GIN index, OR'd with a substring
+    # match served by the pg_trgm index (partial words, Amharic fragments).
+    # Ranked by ts_rank_cd + trigram word similarity; pages are keyset-based
+    # on (rank, timestamp, channel_key, message_id) instead of OFFSET.
+    after = _decode_cursor(cursor) if cursor else None
+    rows = (await db.execute(
+        SEARCH_MESSAGES_SQL,
+        {
+            "query": query,
+            "pattern": f"%{query}%",
+            "limit": limit,
+            "after_rank": after[0] if after else None,
+            "after_ts": after[1] if after else None,
+            "after_key": after[2] if after else None,
+            "after_id": after[3] if after else None,
+        },
+    )).fetchall()
+
+    if len(rows) == limit:
+        last = rows[-1]
+        response.headers["X-Next-Cursor"] = _encode_cursor(last[7], last[2], last[8], last[0])
+
     return [
         {
             "message_id": r[0],
@@ -82,33 +249,75 @@ def search_messages(
             "view_count": r[4],
             "forward_count": r[5],
             "has_image": r[6],
+            "rank": r[7],
         }
         for r in rows
     ]
 
 
 @app.get("/api/reports/visual-content", response_model=list[VisualContentStat])
-def visual_content(db: Session = Depends(get_db)):
-    q = text(f"""
-        select
-            c.channel_name,
-            count(d.message_id)::int as image_posts,
-            count(m.message_id)::int as total_posts,
-            round(100.0*count(d.message_id)/nullif(count(m.message_id),0),2)::float as pct_with_images
-        from {ANALYTICS_SCHEMA}.fct_messages m
-        join {ANALYTICS_SCHEMA}.dim_channels c on m.channel_key=c.channel_key
-        left join {ANALYTICS_SCHEMA}.fct_image_detections d
-          on d.message_id=m.message_id and d.channel_key=m.channel_key
-        group by c.channel_name
-        order by pct_with_images desc
-    """)
-    rows = db.execute(q).fetchall()
-    return [
-        {
-            "channel_name": r[0],
-            "image_posts": r[1],
-            "total_posts": r[2],
-            "pct_with_images": r[3],
-        }
-        for r in rows
-    ]
+async def visual_content(
+    date_from: Optional[date] = Query(None, description="Inclusive start date (YYYY-MM-DD)"),
+    date_to: Optional[date] = Query(None, description="Inclusive end date (YYYY-MM-DD)"),
+    db: AsyncSession = Depends(get_async_db),
+):
+    if date_from is not None and date_to is not None and date_from > date_to:
+        raise HTTPException(status_code=400, detail="date_from must be on or before date_to")
+
+    params = {
+        "date_from": int(date_from.strftime("%Y%m%d")) if date_from is not None else None,
+        "date_to": int(date_to.strftime("%Y%m%d")) if date_to is not None else None,
+    }
+    rows = (await db.execute(VISUAL_CONTENT_SQL, params)).fetchall()
+
+    stats: dict = {}
+    for channel_name, total_posts, category, image_posts, views in rows:
+        stat = stats.setdefault(
+            channel_name,
+            {"channel_name": channel_name, "image_posts": 0, "total_posts": total_posts, "categories": []},
+        )
+        if category is None:
+            continue
+        stat["image_posts"] += image_posts
+        stat["categories"].append(
+            {
+                "image_category": category,
+                "image_posts": image_posts,
+                "avg_views": round(views / image_posts, 2) if image_posts else 0.0,
+            }
+        )
+
+    for stat in stats.values():
+        stat["pct_with_images"] = round(100.0 * stat["image_posts"] / stat["total_posts"], 2) if stat["total_posts"] else 0.0
+        for cat in stat["categories"]:
+            cat["pct_of_images"] = round(100.0 * cat["image_posts"] / stat["image_posts"], 2)
+
+    return sorted(stats.values(), key=lambda s: s["pct_with_images"], reverse=True)
+
+
+@app.get("/api/export/{dataset}")
+async def export_dataset(
+    dataset: Literal["fct_messages", "fct_image_detections"],
+    format: Literal["parquet", "ndjson", "csv"] = Query("ndjson"),
+    channel: Optional[str] = Query(None, description="Restrict to one channel"),
+    date_from: Optional[date] = Query(None, description="Inclusive start date (YYYY-MM-DD)"),
+    date_to: Optional[date] = Query(None, description="Inclusive end date (YYYY-MM-DD)"),
+):
+    # Streams the whole extract from a server-side cursor in fixed-size
+    # chunks, so memory does not grow with the result size.
+    if date_from is not None and date_to is not None and date_from > date_to:
+        raise HTTPException(status_code=400, detail="date_from must be on or before date_to")
+    if format == "parquet" and pa is None:
+        raise HTTPException(status_code=501, detail="Parquet export requires pyarrow on the API server.")
+
+    params = {
+        "channel": channel.lower().strip() if channel is not None else None,
+        "date_from": int(date_from.strftime("%Y%m%d")) if date_from is not None else None,
+        "date_to": int(date_to.strftime("%Y%m%d")) if date_to is not None else None,
+    }
+    filename = f"{dataset}.{format}"
+    return StreamingResponse(
+        stream_export(dataset, format, params, EXPORT_STATEMENT_TIMEOUT_MS),
+        media_type=MEDIA_TYPES[format],
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+    )
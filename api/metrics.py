@@ -0,0 +1,187 @@
+import os
+import time
+import logging
+from contextvars import ContextVar
+from typing import Callable, Optional
+
+from fastapi import Request, Response
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    REGISTRY,
+    CollectorRegistry,
+    Counter,
+    Histogram,
+    generate_latest,
+)
+from prometheus_client.core import GaugeMetricFamily
+from sqlalchemy import event
+from starlette.routing import Match
+
+from api.database import async_engine
+
+# Statements slower than this get an EXPLAIN (ANALYZE, BUFFERS) logged.
+# Unset/0 disables it: ANALYZE runs the statement a second time.
+SLOW_QUERY_MS = float(os.getenv("API_SLOW_QUERY_MS", "0"))
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+REQUEST_SECONDS = Histogram(
+    "api_request_duration_seconds",
+    "End-to-end request latency per route.",
+    ["method", "route", "status"],
+    buckets=LATENCY_BUCKETS,
+)
+DB_SECONDS = Histogram(
+    "api_request_db_seconds",
+    "Time spent in Postgres statements per request.",
+    ["route"],
+    buckets=LATENCY_BUCKETS,
+)
+APP_SECONDS = Histogram(
+    "api_request_app_seconds",
+    "Time outside the database per request (validation, serialization, Python).",
+    ["route"],
+    buckets=LATENCY_BUCKETS,
+)
+DB_STATEMENTS = Counter(
+    "api_db_statements_total",
+    "Statements executed, per route.",
+    ["route"],
+)
+SLOW_QUERIES = Counter(
+    "api_slow_queries_total",
+    "Statements slower than API_SLOW_QUERY_MS.",
+)
+
+slow_query_log = logging.getLogger("api.slow_query")
+
+
+class _DbTimer:
+    __slots__ = ("seconds", "statements")
+
+    def __init__(self) -> None:
+        self.seconds = 0.0
+        self.statements = 0
+
+
+# Set per request by the middleware. SQLAlchemy runs the async engine's
+# cursor events in a greenlet that shares the request task's context.
+_db_timer: ContextVar[Optional[_DbTimer]] = ContextVar("api_db_timer", default=None)
+
+
+class PoolCollector:
+    """Connection pool gauges for the async engine, read at scrape time."""
+
+    def collect(self):
+        pool = async_engine.pool
+        size = GaugeMetricFamily("api_db_pool_size", "Configured pool size.")
+        size.add_metric([], pool.size())
+        checked_out = GaugeMetricFamily("api_db_pool_checked_out", "Connections currently in use.")
+        checked_out.add_metric([], pool.checkedout())
+        idle = GaugeMetricFamily("api_db_pool_checked_in", "Idle connections in the pool.")
+        idle.add_metric([], pool.checkedin())
+        overflow = GaugeMetricFamily("api_db_pool_overflow", "Connections opened beyond pool_size (negative: unused capacity).")
+        overflow.add_metric([], pool.overflow())
+        return [size, checked_out, idle, overflow]
+
+
+def _explain(conn, statement: str, parameters) -> str:
+    # fresh DBAPI cursor: bypasses SQLAlchemy events, so no recursion
+    cursor = conn.connection.dbapi_connection.cursor()
+    try:
+        cursor.execute(f"EXPLAIN (ANALYZE, BUFFERS) {statement}", parameters)
+        return "\n".join(r[0] for r in cursor.fetchall())
+    finally:
+        cursor.close()
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("query_start", []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - conn.info["query_start"].pop()
+    timer = _db_timer.get()
+    if timer is not None:
+        timer.seconds += elapsed
+        timer.statements += 1
+
+    if SLOW_QUERY_MS and elapsed * 1000 >= SLOW_QUERY_MS:
+        SLOW_QUERIES.inc()
+        if statement.lstrip().lower().startswith(("select", "with")):
+            try:
+                plan = _explain(conn, statement, parameters)
+            except Exception as e:
+                plan = f"(EXPLAIN failed: {e})"
+            slow_query_log.warning(
+                "slow query %.1f ms\n%s\nparams=%r\n%s", elapsed * 1000, statement, parameters, plan
+            )
+        else:
+            slow_query_log.warning("slow statement %.1f ms\n%s", elapsed * 1000, statement)
+
+
+def _handle_error(exception_context):
+    # failed statements never reach after_cursor_execute
+    conn = exception_context.connection
+    if conn is not None and conn.info.get("query_start"):
+        conn.info["query_start"].pop()
+
+
+def install_db_events() -> None:
+    event.listen(async_engine.sync_engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(async_engine.sync_engine, "after_cursor_execute", _after_cursor_execute)
+    event.listen(async_engine.sync_engine, "handle_error", _handle_error)
+
+
+def route_label(request: Request) -> str:
+    route = request.scope.get("route")
+    if route is None:
+        # answered before routing (e.g. a response-cache hit): match it ourselves
+        for r in request.app.router.routes:
+            if r.matches(request.scope)[0] == Match.FULL:
+                route = r
+                break
+    return getattr(route, "path", "unmatched")
+
+
+def metrics_middleware() -> Callable:
+    """
+    Times every request, split into DB time (summed from cursor events) and
+    the rest. Routes are labelled by their template (/api/channels/{channel_name}/activity),
+    not the raw path, to keep label cardinality bounded.
+    """
+
+    async def middleware(request: Request, call_next):
+        timer = _DbTimer()
+        token = _db_timer.set(timer)
+        started = time.perf_counter()
+        status = 500
+        try:
+            response = await call_next(request)
+            status = response.status_code
+            return response
+        finally:
+            elapsed = time.perf_counter() - started
+            _db_timer.reset(token)
+            label = route_label(request)
+            REQUEST_SECONDS.labels(request.method, label, str(status)).observe(elapsed)
+            DB_SECONDS.labels(label).observe(timer.seconds)
+            APP_SECONDS.labels(label).observe(max(elapsed - timer.seconds, 0.0))
+            if timer.statements:
+                DB_STATEMENTS.labels(label).inc(timer.statements)
+
+    return middleware
+
+
+def metrics_response() -> Response:
+    registry = REGISTRY
+    if os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+        # several uvicorn workers: aggregate their files instead of this process only
+        from prometheus_client import multiprocess
+
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    return Response(generate_latest(registry), media_type=CONTENT_TYPE_LATEST)
+
+
+REGISTRY.register(PoolCollector())
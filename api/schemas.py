@@ -8,6 +8,12 @@ class TopProduct(BaseModel):
 class ChannelActivityPoint(BaseModel):
     date: str
     posts: int
+    views: Optional[int] = None
+    forwards: Optional[int] = None
+    image_posts: Optional[int] = None
+    avg_views: Optional[float] = None
+    forward_rate: Optional[float] = None
+    pct_with_images: Optional[float] = None
 
 class MessageResult(BaseModel):
     message_id: int
@@ -17,9 +23,17 @@ class MessageResult(BaseModel):
     view_count: int
     forward_count: int
     has_image: bool
+    rank: Optional[float] = None
+
+class VisualCategoryStat(BaseModel):
+    image_category: str
+    image_posts: int
+    pct_of_images: float
+    avg_views: float
 
 class VisualContentStat(BaseModel):
     channel_name: str
     image_posts: int
     total_posts: int
     pct_with_images: float
+    categories: List[VisualCategoryStat] = []
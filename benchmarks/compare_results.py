@@ -0,0 +1,95 @@
+# benchmarks/compare_results.py
+#
+# Side-by-side of two run_benchmarks.py result files. Steps compare wall
+# seconds, API endpoints p50/p95 latency; positive deltas are slower.
+#
+#   python benchmarks/compare_results.py old.json new.json --fail-above 10
+
+import sys
+import json
+import argparse
+from typing import Any, Dict, List, Optional, Tuple
+
+# (metric, label) compared for each kind of result
+STEP_METRICS = [("seconds", "s")]
+API_METRICS = [("p50_ms", "p50 ms"), ("p95_ms", "p95 ms")]
+
+
+def load(path: str) -> Dict[str, Any]:
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def metrics_for(name: str) -> List[Tuple[str, str]]:
+    return API_METRICS if name.startswith("api:") else STEP_METRICS
+
+
+def delta_pct(old: Optional[float], new: Optional[float]) -> Optional[float]:
+    if old is None or new is None or old == 0:
+        return None
+    return (new - old) / old * 100
+
+
+def compare(old: Dict[str, Any], new: Dict[str, Any]) -> List[Dict[str, Any]]:
+    rows = []
+    names = list(old["results"]) + [n for n in new["results"] if n not in old["results"]]
+    for name in names:
+        o = old["results"].get(name, {})
+        n = new["results"].get(name, {})
+        for metric, label in metrics_for(name):
+            rows.append({
+                "name": name,
+                "metric": label,
+                "old": o.get(metric),
+                "new": n.get(metric),
+                "delta_pct": delta_pct(o.get(metric), n.get(metric)),
+            })
+    return rows
+
+
+def _fmt(value: Optional[float]) -> str:
+    return "-" if value is None else f"{value:,.2f}"
+
+
+def print_table(rows: List[Dict[str, Any]]) -> None:
+    width = max(len(r["name"]) for r in rows) if rows else 10
+    print(f"{'':<{width}}  {'metric':<7} {'old':>12} {'new':>12} {'delta':>9}")
+    for r in rows:
+        delta = "-" if r["delta_pct"] is None else f"{r['delta_pct']:+.1f}%"
+        print(f"{r['name']:<{width}}  {r['metric']:<7} {_fmt(r['old']):>12} {_fmt(r['new']):>12} {delta:>9}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Compare two benchmark result files")
+    parser.add_argument("old", help="Baseline results JSON")
+    parser.add_argument("new", help="Results JSON to compare against the baseline")
+    parser.add_argument(
+        "--fail-above",
+        type=float,
+        default=None,
+        help="Exit 1 if any metric is this many percent slower than the baseline",
+    )
+    args = parser.parse_args()
+
+    old, new = load(args.old), load(args.new)
+    for label, report in (("old", old), ("new", new)):
+        meta = report["meta"]
+        dataset = meta.get("dataset", {})
+        print(f"{label}: {meta.get('git_commit')} {meta.get('started_utc')} "
+              f"messages={dataset.get('messages')} {meta.get('label') or ''}".rstrip())
+    if old["meta"].get("dataset", {}).get("messages") != new["meta"].get("dataset", {}).get("messages"):
+        print("warning: the runs used different dataset sizes")
+    print()
+
+    rows = compare(old, new)
+    print_table(rows)
+
+    if args.fail_above is not None:
+        regressions = [r for r in rows if r["delta_pct"] is not None and r["delta_pct"] > args.fail_above]
+        if regressions:
+            print(f"\n{len(regressions)} metric(s) regressed by more than {args.fail_above:g}%")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
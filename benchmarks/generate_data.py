@@ -0,0 +1,284 @@
+# benchmarks/generate_data.py
+#
+# Synthetic data lake for the benchmarks, in the same layout the scraper and
+# yolo_detect produce:
+#
+#   <out>/raw/telegram_messages/YYYY-MM-DD/<channel>.ndjson  (+ _manifest.json)
+#   <out>/raw/images/<channel>/<message_id>.jpg
+#   <out>/yolo_detections.csv, <out>/yolo_objects.csv
+#   <out>/_bench.json                                         (what was generated)
+#
+# Output is deterministic for a given --seed, scale and --end-date. Rows are streamed to
+# disk, so memory stays flat at 10M messages.
+#
+#   python benchmarks/generate_data.py --messages 1m --out bench_data/1m
+
+import os
+import sys
+import csv
+import json
+import random
+import argparse
+from datetime import date, datetime, time, timedelta, timezone
+from pathlib import Path
+from typing import Any, Dict, List, Tuple
+
+REPO_ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(REPO_ROOT / "src"))
+
+from datalake import (  # noqa: E402
+    ChannelMessagesWriter,
+    ensure_dir,
+    telegram_images_dir,
+    telegram_messages_partition_dir,
+    write_manifest,
+)
+
+BENCH_META = "_bench.json"
+
+SCALES = {"k": 1_000, "m": 1_000_000}
+
+# Vocabulary roughly shaped like the real channels: product names, dosage,
+# prices and some Amharic, so the term/search models see realistic tokens.
+PRODUCTS = [
+    "paracetamol", "amoxicillin", "ibuprofen", "vitamin", "omeprazole", "metformin",
+    "cetirizine", "sunscreen", "moisturizer", "serum", "shampoo", "insulin",
+    "azithromycin", "ciprofloxacin", "diclofenac", "zinc", "calcium", "collagen",
+]
+WORDS = [
+    "available", "now", "new", "stock", "price", "delivery", "free", "original",
+    "tablets", "capsules", "cream", "syrup", "bottle", "pack", "order", "call",
+    "ዋጋ", "አዲስ", "ይደውሉ", "መድሃኒት", "ቅናሽ", "አለ",
+]
+UNITS = ["mg", "ml", "g"]
+
+# COCO classes the real model reports most often on these channels
+CLASSES = [(0, "person"), (39, "bottle"), (41, "cup"), (67, "cell phone"), (73, "book"), (75, "vase")]
+
+IMAGE_POOL_SIZE = 16
+IMAGE_SIZE = 320
+
+
+def parse_count(value: str) -> int:
+    """'10k' -> 10000, '1m' -> 1000000, '2500' -> 2500."""
+    v = value.strip().lower().replace("_", "")
+    if v and v[-1] in SCALES:
+        return int(float(v[:-1]) * SCALES[v[-1]])
+    return int(v)
+
+
+def classify(detected: set) -> str:
+    # same rules as yolo_detect.classify_image (not imported: it pulls in ultralytics)
+    has_person = "person" in detected
+    has_other = len(detected - {"person"}) > 0
+    if has_person and has_other:
+        return "promotional"
+    if not has_person and detected:
+        return "product_display"
+    if has_person:
+        return "lifestyle"
+    return "other"
+
+
+def message_text(rng: random.Random) -> str:
+    product = rng.choice(PRODUCTS)
+    parts = [product.capitalize(), f"{rng.choice([5, 10, 20, 100, 250, 500])}{rng.choice(UNITS)}"]
+    parts += rng.choices(WORDS, k=rng.randint(3, 14))
+    if rng.random() < 0.6:
+        parts.append(f"{rng.randint(50, 5000)} ETB")
+    if rng.random() < 0.3:
+        parts.append(rng.choice(PRODUCTS))
+    return " ".join(parts)
+
+
+def image_pool(rng: random.Random) -> List[bytes]:
+    """A handful of distinct JPEGs; image files are copies of these."""
+    import cv2
+    import numpy as np
+
+    np_rng = np.random.default_rng(rng.randint(0, 2**32 - 1))
+    pool = []
+    for _ in range(IMAGE_POOL_SIZE):
+        img = np_rng.integers(0, 256, (IMAGE_SIZE, IMAGE_SIZE, 3), dtype=np.uint8)
+        for _ in range(3):
+            x1, y1 = (int(v) for v in np_rng.integers(0, IMAGE_SIZE // 2, 2))
+            x2, y2 = x1 + int(np_rng.integers(20, IMAGE_SIZE // 2)), y1 + int(np_rng.integers(20, IMAGE_SIZE // 2))
+            color = tuple(int(c) for c in np_rng.integers(0, 256, 3))
+            cv2.rectangle(img, (x1, y1), (x2, y2), color, -1)
+        ok, buf = cv2.imencode(".jpg", img, [cv2.IMWRITE_JPEG_QUALITY, 80])
+        if not ok:
+            raise RuntimeError("cv2.imencode failed")
+        pool.append(buf.tobytes())
+    return pool
+
+
+def detection(rng: random.Random) -> Tuple[set, float, List[List[Any]]]:
+    boxes = []
+    for _ in range(rng.choices([0, 1, 2, 3, 4], weights=[10, 35, 30, 15, 10])[0]):
+        class_id, name = rng.choice(CLASSES)
+        x1, y1 = rng.uniform(0, 200), rng.uniform(0, 200)
+        boxes.append([
+            class_id, name, round(rng.uniform(0.25, 0.99), 3),
+            round(x1, 1), round(y1, 1), round(x1 + rng.uniform(20, 120), 1), round(y1 + rng.uniform(20, 120), 1),
+        ])
+    detected = {b[1] for b in boxes}
+    conf = max((b[2] for b in boxes), default=0.0)
+    return detected, conf, boxes
+
+
+def generate(
+    out: str,
+    messages: int,
+    channels: int,
+    days: int,
+    image_ratio: float,
+    max_images: int,
+    compression: str,
+    seed: int,
+    end: date,
+) -> Dict[str, Any]:
+    rng = random.Random(seed)
+    channel_names = [f"bench_channel_{i:03d}" for i in range(channels)]
+    dates = [end - timedelta(days=days - 1 - i) for i in range(days)]
+
+    pool = image_pool(rng) if max_images > 0 and image_ratio > 0 else []
+    next_id = {ch: 1 for ch in channel_names}
+    images_written = 0
+    photos = 0
+    detections = 0
+
+    ensure_dir(out)
+    det_path = os.path.join(out, "yolo_detections.csv")
+    obj_path = os.path.join(out, "yolo_objects.csv")
+    with open(det_path, "w", encoding="utf-8", newline="") as det_f, \
+            open(obj_path, "w", encoding="utf-8", newline="") as obj_f:
+        det_w = csv.writer(det_f)
+        obj_w = csv.writer(obj_f)
+        det_w.writerow(["message_id", "channel_name", "detected_objects", "confidence_score", "image_category", "image_path", "detection_id"])
+        obj_w.writerow(["message_id", "channel_name", "box_index", "class_id", "class_name", "confidence", "x1", "y1", "x2", "y2", "detection_id"])
+
+        cells = len(dates) * len(channel_names)
+        written = 0
+        for d_i, day in enumerate(dates):
+            date_str = day.isoformat()
+            ensure_dir(telegram_messages_partition_dir(out, date_str))
+            day_start = datetime.combine(day, time(0, 0), tzinfo=timezone.utc)
+            counts: Dict[str, int] = {}
+            for c_i, ch in enumerate(channel_names):
+                # spread messages evenly over (day, channel) cells
+                cell = d_i * len(channel_names) + c_i
+                n = messages * (cell + 1) // cells - written
+                written += n
+                image_dir = os.path.join(telegram_images_dir(out), ch)
+                if images_written < max_images:
+                    ensure_dir(image_dir)
+                offsets = sorted(rng.randrange(86_400) for _ in range(n))
+                with ChannelMessagesWriter(
+                    base_path=out, date_str=date_str, channel_name=ch, compression=compression
+                ) as writer:
+                    for offset in offsets:
+                        msg_id = next_id[ch]
+                        next_id[ch] += 1
+                        is_photo = rng.random() < image_ratio
+                        has_media = is_photo or rng.random() < 0.05
+                        image_path = os.path.join(image_dir, f"{msg_id}.jpg") if is_photo else None
+                        views = int(rng.paretovariate(1.5) * 200)
+                        writer.write({
+                            "message_id": msg_id,
+                            "channel_name": ch,
+                            "message_date": (day_start + timedelta(seconds=offset)).isoformat(),
+                            "message_text": message_text(rng),
+                            "has_media": has_media,
+                            "image_path": image_path,
+                            "views": views,
+                            "forwards": int(views * rng.uniform(0, 0.08)),
+                        })
+                        if not is_photo:
+                            continue
+                        photos += 1
+                        if images_written < max_images:
+                            with open(image_path, "wb") as f:
+                                f.write(pool[msg_id % len(pool)])
+                            images_written += 1
+                        detected, conf, boxes = detection(rng)
+                        detection_id = f"bench-{ch}-{msg_id}"
+                        det_w.writerow([
+                            msg_id, ch, ",".join(sorted(detected)), conf, classify(detected),
+                            image_path.replace("\\", "/"), detection_id,
+                        ])
+                        obj_w.writerows([[msg_id, ch, i, *b, detection_id] for i, b in enumerate(boxes)])
+                        detections += 1
+                counts[ch] = n
+            write_manifest(
+                base_path=out,
+                date_str=date_str,
+                channel_message_counts=counts,
+                extra={"format": "ndjson", "synthetic": True, "seed": seed},
+            )
+            print(f"{date_str}: {sum(counts.values())} messages ({written}/{messages})")
+
+    meta = {
+        "generated_utc": datetime.now(timezone.utc).isoformat(),
+        "seed": seed,
+        "messages": messages,
+        "channels": channel_names,
+        "date_from": dates[0].isoformat(),
+        "date_to": dates[-1].isoformat(),
+        "photos": photos,
+        "images_written": images_written,
+        "detections": detections,
+        "compression": compression,
+        # tokens the API benchmarks search for
+        "search_terms": PRODUCTS[:3],
+    }
+    with open(os.path.join(out, BENCH_META), "w", encoding="utf-8") as f:
+        json.dump(meta, f, ensure_ascii=False, indent=2)
+    return meta
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Generate a synthetic data lake for the benchmarks")
+    parser.add_argument("--messages", type=str, default="10k", help="Message count: 10k, 1m, 10m or a number (default: 10k)")
+    parser.add_argument("--out", type=str, default=None, help="Output base directory (default: bench_data/<messages>)")
+    parser.add_argument("--channels", type=int, default=20, help="Number of channels (default: 20)")
+    parser.add_argument("--days", type=int, default=30, help="Daily partitions, ending yesterday (default: 30)")
+    parser.add_argument("--image-ratio", type=float, default=0.3, help="Share of messages with a photo (default: 0.3)")
+    parser.add_argument(
+        "--max-images",
+        type=int,
+        default=20_000,
+        help="Cap on JPEG files written; photos past the cap keep their image_path and detections "
+             "but have no file, which only matters to yolo_detect (default: 20000)",
+    )
+    parser.add_argument("--compression", choices=["none", "gzip", "zstd"], default="none")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument(
+        "--end-date",
+        type=date.fromisoformat,
+        default=None,
+        help="Last partition (YYYY-MM-DD). Default: yesterday, so dbt's no-future-messages test passes",
+    )
+    args = parser.parse_args()
+
+    messages = parse_count(args.messages)
+    out = args.out or os.path.join("bench_data", args.messages.lower())
+    if os.path.exists(os.path.join(out, BENCH_META)):
+        raise SystemExit(f"{out} already holds generated data; remove it or pick another --out")
+
+    meta = generate(
+        out=out,
+        messages=messages,
+        channels=args.channels,
+        days=args.days,
+        image_ratio=args.image_ratio,
+        max_images=args.max_images,
+        compression=args.compression,
+        seed=args.seed,
+        end=args.end_date or date.today() - timedelta(days=1),
+    )
+    print(f"Wrote {meta['messages']} messages, {meta['detections']} detections, "
+          f"{meta['images_written']} images to {out}")
+
+
+if __name__ == "__main__":
+    main()
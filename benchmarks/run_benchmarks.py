@@ -0,0 +1,334 @@
+# benchmarks/run_benchmarks.py
+#
+# Times the warehouse end to end against a local Postgres, on data from
+# generate_data.py:
+#
+#   load_raw / load_raw_noop     load_raw_to_postgres into empty raw.telegram_messages, then again (ledger skip)
+#   load_yolo / load_yolo_noop   load_yolo_to_postgres the same way
+#   dbt_seed, dbt_build_full     dbt seed + dbt build --full-refresh
+#   dbt_build_incremental        dbt build with no new raw rows
+#   api:<name>                   each endpoint through FastAPI's TestClient (response cache off)
+#
+# The loads TRUNCATE the raw tables and dbt rebuilds the marts, so this must
+# point at a scratch database (DB_* from the environment / .env, as everywhere
+# else) and --confirm-db must name it.
+#
+#   python benchmarks/generate_data.py --messages 1m
+#   python benchmarks/run_benchmarks.py --data bench_data/1m --confirm-db med_bench
+#   python benchmarks/compare_results.py benchmarks/results/<old>.json benchmarks/results/<new>.json
+
+import os
+import sys
+import json
+import time
+import platform
+import argparse
+import statistics
+import subprocess
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional
+
+REPO_ROOT = Path(__file__).resolve().parents[1]
+SRC_DIR = REPO_ROOT / "src"
+DBT_DIR = REPO_ROOT / "medical_warehouse"
+RESULTS_DIR = REPO_ROOT / "benchmarks" / "results"
+
+for p in (SRC_DIR, REPO_ROOT):
+    if str(p) not in sys.path:
+        sys.path.insert(0, str(p))
+
+import psycopg2  # noqa: E402
+
+from generate_data import BENCH_META  # noqa: E402
+from instrumentation import peak_rss_bytes  # noqa: E402
+from warehouse_version import bump_warehouse_version, get_db_params  # noqa: E402
+
+STEPS = ["load_raw", "load_yolo", "dbt", "api"]
+RAW_TABLES = {
+    "load_raw": ["raw.telegram_messages"],
+    "load_yolo": ["raw.yolo_detections", "raw.yolo_objects"],
+}
+
+
+def _connect():
+    return psycopg2.connect(**get_db_params())
+
+
+def _execute(sql: str) -> None:
+    conn = _connect()
+    try:
+        with conn:
+            with conn.cursor() as cur:
+                cur.execute(sql)
+    finally:
+        conn.close()
+
+
+def _scalar(sql: str) -> Any:
+    conn = _connect()
+    try:
+        with conn.cursor() as cur:
+            cur.execute(sql)
+            return cur.fetchone()[0]
+    finally:
+        conn.close()
+
+
+def _timed(fn: Callable[[], Any]) -> float:
+    t0 = time.perf_counter()
+    fn()
+    return time.perf_counter() - t0
+
+
+def _step_result(seconds: float, rows: Optional[int] = None) -> Dict[str, Any]:
+    out: Dict[str, Any] = {"seconds": round(seconds, 3)}
+    if rows is not None:
+        out["rows"] = rows
+        out["rows_per_second"] = round(rows / seconds, 1) if seconds > 0 else None
+    return out
+
+
+def _git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=REPO_ROOT, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+# ---------- loaders ----------
+
+def bench_load(step: str, data: str, loader_args: List[str]) -> Dict[str, Dict[str, Any]]:
+    """Cold load into truncated tables, then a second run that the load ledger should skip."""
+    if step == "load_raw":
+        from load_raw_to_postgres import main as load
+    else:
+        from load_yolo_to_postgres import main as load
+
+    tables = RAW_TABLES[step]
+    _execute(f"TRUNCATE {', '.join(tables)}")
+    argv = ["--path", data, "--full-reload", *loader_args]
+    seconds = _timed(lambda: load(argv))
+    rows = _scalar(f"SELECT count(*) FROM {tables[0]}")
+    noop = _timed(lambda: load(["--path", data, *loader_args]))
+    return {step: _step_result(seconds, rows), f"{step}_noop": _step_result(noop)}
+
+
+# ---------- dbt ----------
+
+def _dbt(*args: str, threads: str) -> float:
+    from dbt.cli.main import dbtRunner
+
+    cli = [*args, "--project-dir", str(DBT_DIR), "--profiles-dir", str(DBT_DIR)]
+    if args[0] in ("build", "run", "seed", "test"):
+        cli += ["--threads", threads]
+    t0 = time.perf_counter()
+    res = dbtRunner().invoke(cli)
+    seconds = time.perf_counter() - t0
+    if not res.success:
+        raise RuntimeError(f"dbt {' '.join(args)} failed: {res.exception}")
+    return seconds
+
+
+def bench_dbt(threads: str) -> Dict[str, Dict[str, Any]]:
+    if not (DBT_DIR / "dbt_packages").exists():
+        _dbt("deps", threads=threads)
+    results = {
+        "dbt_seed": _step_result(_dbt("seed", threads=threads)),
+        "dbt_build_full": _step_result(_dbt("build", "--full-refresh", threads=threads)),
+        # no new raw rows: measures the incremental models' fixed cost
+        "dbt_build_incremental": _step_result(_dbt("build", threads=threads)),
+    }
+    conn = _connect()
+    try:
+        with conn:
+            with conn.cursor() as cur:
+                bump_warehouse_version(cur)
+    finally:
+        conn.close()
+    return results
+
+
+# ---------- API ----------
+
+def api_cases(meta: Dict[str, Any]) -> List[Dict[str, Any]]:
+    channel = meta["channels"][0]
+    date_from, date_to = meta["date_from"], meta["date_to"]
+    term = meta["search_terms"][0]
+    window = {"date_from": date_from, "date_to": date_to}
+    one_day = {"date_from": date_to, "date_to": date_to}
+    return [
+        {"name": "top_products", "path": "/api/reports/top-products", "params": {"limit": 10}},
+        {"name": "top_products_filtered", "path": "/api/reports/top-products",
+         "params": {"limit": 10, "channel": channel, **window}},
+        {"name": "channel_activity_day", "path": f"/api/channels/{channel}/activity", "params": {}},
+        {"name": "channel_activity_month", "path": f"/api/channels/{channel}/activity",
+         "params": {"granularity": "month"}},
+        {"name": "search_messages", "path": "/api/search/messages", "params": {"query": term, "limit": 20}},
+        {"name": "search_messages_page2", "path": "/api/search/messages",
+         "params": {"query": term, "limit": 20}, "next_page": True},
+        {"name": "visual_content", "path": "/api/reports/visual-content", "params": window},
+        # exports stream whole result sets: fewer repetitions, one day only
+        {"name": "export_messages_ndjson", "path": "/api/export/fct_messages",
+         "params": {"format": "ndjson", **one_day}, "repeat": 3},
+        {"name": "export_messages_parquet", "path": "/api/export/fct_messages",
+         "params": {"format": "parquet", **one_day}, "repeat": 3},
+        {"name": "export_detections_csv", "path": "/api/export/fct_image_detections",
+         "params": {"format": "csv", **one_day}, "repeat": 3},
+    ]
+
+
+def summarize_ms(samples: List[float]) -> Dict[str, Any]:
+    ms = sorted(s * 1000 for s in samples)
+    if len(ms) >= 2:
+        cuts = statistics.quantiles(ms, n=100, method="inclusive")
+        p50, p95 = cuts[49], cuts[94]
+    else:
+        p50 = p95 = ms[0]
+    return {
+        "n": len(ms),
+        "mean_ms": round(statistics.fmean(ms), 2),
+        "p50_ms": round(p50, 2),
+        "p95_ms": round(p95, 2),
+        "min_ms": round(ms[0], 2),
+        "max_ms": round(ms[-1], 2),
+    }
+
+
+def bench_api(meta: Dict[str, Any], repeat: int, warmup: int, use_cache: bool) -> Dict[str, Dict[str, Any]]:
+    # read by api.cache at import time
+    if not use_cache:
+        os.environ["API_CACHE_BACKEND"] = "none"
+    from fastapi.testclient import TestClient
+    from api.main import app
+
+    results: Dict[str, Dict[str, Any]] = {}
+    with TestClient(app) as client:
+        for case in api_cases(meta):
+            params = dict(case["params"])
+            if case.get("next_page"):
+                try:
+                    cursor = client.get(case["path"], params=params).headers.get("X-Next-Cursor")
+                except Exception:
+                    cursor = None
+                if not cursor:
+                    results[f"api:{case['name']}"] = {"error": "no next page"}
+                    continue
+                params["cursor"] = cursor
+
+            n = min(case.get("repeat", repeat), repeat)
+            samples: List[float] = []
+            size = 0
+            try:
+                for i in range(warmup + n):
+                    t0 = time.perf_counter()
+                    resp = client.get(case["path"], params=params)
+                    elapsed = time.perf_counter() - t0
+                    # a failed export stream still starts as a 200, so server errors are raised, not returned
+                    resp.raise_for_status()
+                    if i >= warmup:
+                        samples.append(elapsed)
+                        size = len(resp.content)
+            except Exception as e:
+                results[f"api:{case['name']}"] = {"error": f"{type(e).__name__}: {e}"[:300]}
+                print(f"{case['name']}: failed ({type(e).__name__})")
+                continue
+
+            stats = summarize_ms(samples)
+            results[f"api:{case['name']}"] = {"response_bytes": size, **stats}
+            print(f"{case['name']}: p50 {stats['p50_ms']} ms, p95 {stats['p95_ms']} ms")
+    return results
+
+
+# ---------- main ----------
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmark loaders, dbt and the API on generated data")
+    parser.add_argument("--data", type=str, required=True, help="Base directory written by generate_data.py")
+    parser.add_argument(
+        "--confirm-db",
+        type=str,
+        required=True,
+        help="Name of the database DB_* points at; raw tables are truncated and marts rebuilt there",
+    )
+    parser.add_argument("--steps", nargs="+", choices=STEPS, default=STEPS, help="Steps to run (default: all)")
+    parser.add_argument("--raw-mode", choices=["copy", "upsert"], default="copy", help="load_raw_to_postgres --mode")
+    parser.add_argument("--raw-workers", type=int, default=1, help="load_raw_to_postgres --workers")
+    parser.add_argument("--dbt-threads", type=str, default=os.getenv("DBT_THREADS", "4"))
+    parser.add_argument("--repeat", type=int, default=20, help="Timed requests per API endpoint (default: 20)")
+    parser.add_argument("--warmup", type=int, default=2, help="Untimed requests per API endpoint first (default: 2)")
+    parser.add_argument("--api-cache", action="store_true", help="Keep the API response cache on (default: off)")
+    parser.add_argument("--label", type=str, default=None, help="Free-form note stored with the results")
+    parser.add_argument("--out", type=str, default=None, help="Results file (default: benchmarks/results/<utc>_<messages>.json)")
+    args = parser.parse_args()
+
+    data = os.path.abspath(args.data)
+    meta_path = os.path.join(data, BENCH_META)
+    if not os.path.exists(meta_path):
+        raise SystemExit(f"{meta_path} not found. Run benchmarks/generate_data.py first.")
+    with open(meta_path, "r", encoding="utf-8") as f:
+        meta = json.load(f)
+
+    db_params = get_db_params()
+    if db_params["dbname"] != args.confirm_db:
+        raise SystemExit(
+            f"DB_NAME is {db_params['dbname']!r}, not {args.confirm_db!r}. "
+            "Point DB_* at a scratch database and pass its name to --confirm-db."
+        )
+    # dbt, the API and both loaders then agree on the target even without a .env
+    for key, param in (("DB_HOST", "host"), ("DB_PORT", "port"), ("DB_NAME", "dbname"),
+                       ("DB_USER", "user"), ("DB_PASSWORD", "password")):
+        os.environ[key] = str(db_params[param])
+    # the loaders and dbt use paths relative to the repo root
+    os.chdir(REPO_ROOT)
+    for script in ("create_raw_tables.sql", "create_yolo_tables.sql"):
+        _execute((REPO_ROOT / "scripts" / script).read_text(encoding="utf-8"))
+
+    started = datetime.now(timezone.utc)
+    results: Dict[str, Dict[str, Any]] = {}
+    if "load_raw" in args.steps:
+        results.update(bench_load(
+            "load_raw", data, ["--mode", args.raw_mode, "--workers", str(args.raw_workers)]
+        ))
+    if "load_yolo" in args.steps:
+        results.update(bench_load("load_yolo", data, []))
+    if "dbt" in args.steps:
+        results.update(bench_dbt(args.dbt_threads))
+    if "api" in args.steps:
+        results.update(bench_api(meta, args.repeat, args.warmup, args.api_cache))
+
+    report = {
+        "meta": {
+            "started_utc": started.isoformat(),
+            "label": args.label,
+            "git_commit": _git_commit(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "postgres": _scalar("SHOW server_version"),
+            "peak_rss_bytes": peak_rss_bytes(),
+            "options": {
+                "steps": args.steps,
+                "raw_mode": args.raw_mode,
+                "raw_workers": args.raw_workers,
+                "dbt_threads": args.dbt_threads,
+                "repeat": args.repeat,
+                "warmup": args.warmup,
+                "api_cache": args.api_cache,
+            },
+            "dataset": {k: v for k, v in meta.items() if k != "channels"} | {"channels": len(meta["channels"])},
+        },
+        "results": results,
+    }
+
+    out = Path(args.out) if args.out else RESULTS_DIR / f"{started:%Y%m%dT%H%M%SZ}_{meta['messages']}.json"
+    out.parent.mkdir(parents=True, exist_ok=True)
+    with open(out, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"Wrote {out}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,42 @@
+{{
+    config(
+        materialized='incremental',
+        unique_key=['channel_key', 'date_key'],
+        incremental_strategy='delete+insert',
+        indexes=[
+            {'columns': ['channel_key', 'date_key'], 'unique': True},
+        ],
+        post_hook="analyze {{ this }}"
+    )
+}}
+
+-- Daily rollup of agg_channel_activity_hourly; backs
+-- /api/channels/{channel_name}/activity, which re-buckets it into weeks or
+-- months at query time.
+
+with hourly as (
+    select h.*
+    from {{ ref('agg_channel_activity_hourly') }} h
+    {% if is_incremental() %}
+    where h.source_ingested_at > (select coalesce(max(source_ingested_at), '1900-01-01'::timestamp) from {{ this }})
+    {% endif %}
+),
+
+days as (
+    select distinct channel_key, date_key from hourly
+)
+
+select
+    h.channel_key,
+    h.date_key,
+    to_date(h.date_key::text, 'YYYYMMDD') as full_date,
+    sum(h.posts)::int as posts,
+    sum(h.views)::bigint as views,
+    sum(h.forwards)::bigint as forwards,
+    sum(h.image_posts)::int as image_posts,
+    max(h.source_ingested_at) as source_ingested_at
+from {{ ref('agg_channel_activity_hourly') }} h
+join days d
+  on h.channel_key = d.channel_key
+ and h.date_key = d.date_key
+group by h.channel_key, h.date_key
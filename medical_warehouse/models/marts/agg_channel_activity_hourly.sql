@@ -0,0 +1,48 @@
+{{
+    config(
+        materialized='incremental',
+        unique_key=['channel_key', 'date_key'],
+        incremental_strategy='delete+insert',
+        indexes=[
+            {'columns': ['channel_key', 'date_key', 'hour'], 'unique': True},
+        ],
+        post_hook="analyze {{ this }}"
+    )
+}}
+
+-- Posts and engagement per channel and hour. Incremental runs recompute the
+-- whole (channel_key, date_key) day for any message that is new or was
+-- re-loaded with fresh view/forward counts.
+
+with msgs as (
+    select
+        m.channel_key,
+        m.date_key,
+        extract(hour from m.message_timestamp)::int as hour,
+        m.view_count,
+        m.forward_count,
+        m.has_image,
+        m.ingested_at
+    from {{ ref('fct_messages') }} m
+    {% if is_incremental() %}
+    join (
+        select distinct channel_key, date_key
+        from {{ ref('fct_messages') }}
+        where ingested_at > (select coalesce(max(source_ingested_at), '1900-01-01'::timestamp) from {{ this }})
+    ) changed
+      on m.channel_key = changed.channel_key
+     and m.date_key = changed.date_key
+    {% endif %}
+)
+
+select
+    channel_key,
+    date_key,
+    coalesce(hour, 0) as hour,
+    count(*)::int as posts,
+    coalesce(sum(view_count), 0)::bigint as views,
+    coalesce(sum(forward_count), 0)::bigint as forwards,
+    count(*) filter (where has_image)::int as image_posts,
+    max(ingested_at) as source_ingested_at
+from msgs
+group by channel_key, date_key, coalesce(hour, 0)
@@ -0,0 +1,75 @@
+{{
+    config(
+        materialized='incremental',
+        unique_key=['date_key', 'channel_key'],
+        incremental_strategy='delete+insert',
+        indexes=[
+            {'columns': ['date_key']},
+            {'columns': ['channel_key', 'date_key']},
+            {'columns': ['term']},
+        ],
+        post_hook="analyze {{ this }}"
+    )
+}}
+
+-- Term counts per day and channel, so /api/reports/top-products only sums a
+-- small table instead of re-tokenizing every message. Incremental runs
+-- recompute whole (date_key, channel_key) slices touched by new or re-loaded
+-- messages; delete+insert on that key replaces the old counts.
+
+{% if is_incremental() %}
+with changed as (
+    select distinct date_key, channel_key
+    from {{ ref('fct_messages') }}
+    where ingested_at > (select coalesce(max(source_ingested_at), '1900-01-01'::timestamp) from {{ this }})
+),
+
+msgs as (
+    select m.date_key, m.channel_key, m.message_text, m.ingested_at
+    from {{ ref('fct_messages') }} m
+    join changed c
+      on m.date_key = c.date_key
+     and m.channel_key = c.channel_key
+    where m.message_text is not null and m.message_text <> ''
+),
+{% else %}
+with msgs as (
+    select date_key, channel_key, message_text, ingested_at
+    from {{ ref('fct_messages') }}
+    where message_text is not null and message_text <> ''
+),
+{% endif %}
+
+tokens as (
+    select
+        date_key,
+        channel_key,
+        ingested_at,
+        -- split on anything that is not a letter/digit; Ethiopic syllables
+        -- (U+1200-U+135A) are listed explicitly so the Ethiopic wordspace and
+        -- full stop (U+1361-U+1368) act as separators
+        regexp_split_to_table(lower(message_text), '[^[:alnum:]ሀ-ፚ]+') as term
+    from msgs
+),
+
+terms as (
+    select t.*
+    from tokens t
+    where t.term <> ''
+      and t.term !~ '^[0-9]+$'
+      -- Ethiopic syllables carry a consonant and a vowel, so 2 characters is
+      -- already a real word
+      and length(t.term) >= case when t.term ~ '[ሀ-ፚ]' then 2 else 3 end
+      and not exists (
+          select 1 from {{ ref('stopwords') }} s where s.term = t.term
+      )
+)
+
+select
+    date_key,
+    channel_key,
+    term,
+    count(*)::int as term_count,
+    max(ingested_at) as source_ingested_at
+from terms
+group by date_key, channel_key, term
@@ -0,0 +1,41 @@
+{{
+    config(
+        materialized='incremental',
+        unique_key=['channel_key', 'date_key'],
+        incremental_strategy='delete+insert',
+        indexes=[
+            {'columns': ['channel_key', 'date_key', 'image_category'], 'unique': True},
+            {'columns': ['date_key']},
+        ],
+        post_hook="analyze {{ this }}"
+    )
+}}
+
+-- Image posts and their views per channel, day and YOLO image_category.
+-- Post totals for the image share come from agg_channel_activity_daily at
+-- the same grain. Incremental runs recompute every (channel_key, date_key)
+-- with new detections or refreshed view counts.
+
+with det as (
+    select d.channel_key, d.date_key, d.image_category, d.view_count, d.ingested_at
+    from {{ ref('fct_image_detections') }} d
+    {% if is_incremental() %}
+    join (
+        select distinct channel_key, date_key
+        from {{ ref('fct_image_detections') }}
+        where ingested_at > (select coalesce(max(source_ingested_at), '1900-01-01'::timestamp) from {{ this }})
+    ) changed
+      on d.channel_key = changed.channel_key
+     and d.date_key = changed.date_key
+    {% endif %}
+)
+
+select
+    channel_key,
+    date_key,
+    coalesce(image_category, 'other') as image_category,
+    count(*)::int as image_posts,
+    coalesce(sum(view_count), 0)::bigint as views,
+    max(ingested_at) as source_ingested_at
+from det
+group by channel_key, date_key, coalesce(image_category, 'other')
@@ -1,3 +1,18 @@
+{{
+    config(
+        materialized='incremental',
+        unique_key=['channel_key', 'message_id'],
+        incremental_strategy='merge',
+        on_schema_change='append_new_columns',
+        indexes=[
+            {'columns': ['channel_key', 'message_id'], 'unique': True},
+            {'columns': ['channel_key', 'date_key']},
+            {'columns': ['image_category']},
+        ],
+        post_hook="analyze {{ this }}"
+    )
+}}
+
 with det as (
     select
         cast(message_id as bigint) as message_id,
@@ -5,8 +20,9 @@ with det as (
         detected_objects,
         cast(confidence_score as double precision) as confidence_score,
         lower(trim(image_category)) as image_category,
-        image_path
-    from raw.yolo_detections
+        image_path,
+        ingested_at
+    from {{ source('raw', 'yolo_detections') }}
 ),
 
 msg as (
@@ -14,7 +30,8 @@ msg as (
         message_id,
         channel_key,
         date_key,
-        view_count
+        view_count,
+        ingested_at
     from {{ ref('fct_messages') }}
 ),
 
@@ -31,10 +48,16 @@ select
     d.confidence_score,
     d.image_category,
     d.image_path,
-    m.view_count
+    m.view_count,
+    greatest(d.ingested_at, m.ingested_at) as ingested_at
 from det d
 join ch c
   on d.channel_name = c.channel_name
 join msg m
   on m.message_id = d.message_id
  and m.channel_key = c.channel_key
+{% if is_incremental() %}
+-- new detections, or messages whose view counts were refreshed
+where d.ingested_at > (select coalesce(max(ingested_at), '1900-01-01'::timestamp) from {{ this }})
+   or m.ingested_at > (select coalesce(max(ingested_at), '1900-01-01'::timestamp) from {{ this }})
+{% endif %}
@@ -0,0 +1,56 @@
+{{
+    config(
+        indexes=[
+            {'columns': ['class_name', 'confidence']},
+            {'columns': ['channel_key', 'class_name']},
+            {'columns': ['channel_key', 'message_id']},
+        ]
+    )
+}}
+
+with obj as (
+    select
+        cast(message_id as bigint) as message_id,
+        lower(trim(channel_name)) as channel_name,
+        box_index,
+        class_id,
+        class_name,
+        cast(confidence as double precision) as confidence,
+        x1,
+        y1,
+        x2,
+        y2
+    from {{ source('raw', 'yolo_objects') }}
+),
+
+msg as (
+    select
+        message_id,
+        channel_key,
+        date_key
+    from {{ ref('fct_messages') }}
+),
+
+ch as (
+    select channel_key, channel_name
+    from {{ ref('dim_channels') }}
+)
+
+select
+    o.message_id,
+    c.channel_key,
+    m.date_key,
+    o.box_index,
+    o.class_id,
+    o.class_name,
+    o.confidence,
+    o.x1,
+    o.y1,
+    o.x2,
+    o.y2
+from obj o
+join ch c
+  on o.channel_name = c.channel_name
+join msg m
+  on m.message_id = o.message_id
+ and m.channel_key = c.channel_key
@@ -1,3 +1,24 @@
+{{
+    config(
+        materialized='incremental',
+        unique_key=['channel_key', 'message_id'],
+        incremental_strategy='merge',
+        on_schema_change='append_new_columns',
+        indexes=[
+            {'columns': ['channel_key', 'message_id'], 'unique': True},
+            {'columns': ['channel_key', 'date_key']},
+            {'columns': ['date_key']},
+            {'columns': ['message_timestamp']},
+        ],
+        pre_hook="create extension if not exists pg_trgm with schema public",
+        post_hook=[
+            "create index if not exists fct_messages_search_vector_idx on {{ this }} using gin (search_vector)",
+            "create index if not exists fct_messages_message_text_trgm_idx on {{ this }} using gin (message_text public.gin_trgm_ops)",
+            "analyze {{ this }}",
+        ]
+    )
+}}
+
 with msgs as (
     select
         message_id,
@@ -8,8 +29,13 @@ with msgs as (
         message_length,
         view_count,
         forward_count,
-        has_image
+        has_image,
+        ingested_at
     from {{ ref('stg_telegram_messages') }}
+    {% if is_incremental() %}
+    -- new messages and re-loaded ones (views/forwards refreshed) since the last run
+    where ingested_at > (select coalesce(max(ingested_at), '1900-01-01'::timestamp) from {{ this }})
+    {% endif %}
 ),
 
 joined as (
@@ -22,7 +48,10 @@ joined as (
         m.message_length,
         m.view_count,
         m.forward_count,
-        m.has_image
+        m.has_image,
+        -- 'simple' config: no stemming, so Amharic and English tokenize the same way
+        to_tsvector('simple', coalesce(m.message_text, '')) as search_vector,
+        m.ingested_at
     from msgs m
     join {{ ref('dim_channels') }} c
       on m.channel_name = c.channel_name
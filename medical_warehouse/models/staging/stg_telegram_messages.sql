@@ -9,7 +9,7 @@ with source as (
         views,
         forwards,
         ingested_at
-    from raw.telegram_messages
+    from {{ source('raw', 'telegram_messages') }}
 ),
 
 clean as (
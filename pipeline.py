@@ -1,150 +1,301 @@
 # pipeline.py
 #
-# End-to-end orchestration for the Medical Telegram Warehouse project.
-# Works on Windows + PowerShell + venv, and avoids "python -m dbt" issues by
-# calling the dbt executable from .venv\Scripts\dbt.exe.
+# End-to-end orchestration for the Medical Telegram Warehouse project, as a
+# daily-partitioned Dagster asset graph:
+#
+#   raw_telegram_partition   scrape every channel in one step (one client, one rate budget)
+#     ├── raw_telegram_messages   load the day's partition into raw.telegram_messages
+#     └── yolo_detections         YOLO over the day's images -> raw.yolo_detections
+#           (runs alongside the raw load; it only needs the images)
+#   dbt_marts                after both: selective dbt build + warehouse version bump
+#
+# Everything runs in-process (src/ is put on sys.path); nothing shells out.
+#
+# Parallelism:
+#   - steps of one run: multiprocess executor, PIPELINE_MAX_CONCURRENT (default 4)
+#   - backfills: one run per day partition, capped by the QueuedRunCoordinator
+#     in dagster.yaml (point DAGSTER_HOME at the repo root), which also keeps
+#     two runs of the same partition from overlapping
+#   - channels: SCRAPE_CONCURRENCY at a time inside the scrape step
+#   - scrape, yolo and dbt steps carry dagster/concurrency_key tags so
+#     concurrent runs do not share the Telethon session or infer/build at
+#     the same time:
+#       dagster instance concurrency set telegram 1
+#       dagster instance concurrency set yolo 1
+#       dagster instance concurrency set dbt 1
+#   - raw loads and dbt_marts: Postgres advisory lock (load_ledger.RAW_WRITE_LOCK),
+#     so no load commits behind an ingested_at watermark dbt already consumed
 
 from __future__ import annotations
 
 import os
-import subprocess
+import sys
+import asyncio
 from pathlib import Path
-from datetime import datetime
+from contextlib import contextmanager
+from typing import Any, Iterator
 
 from dotenv import load_dotenv
-from dagster import op, job, get_dagster_logger
+from dagster import (
+    AssetExecutionContext,
+    DailyPartitionsDefinition,
+    Definitions,
+    MaterializeResult,
+    asset,
+    build_schedule_from_partitioned_job,
+    define_asset_job,
+    get_dagster_logger,
+)
 
 
 # ---------- paths / helpers ----------
 
 REPO_ROOT = Path(__file__).resolve().parent
+SRC_DIR = REPO_ROOT / "src"
 DBT_DIR = REPO_ROOT / "medical_warehouse"
 ENV_PATH = REPO_ROOT / ".env"
+DATA_DIR = "data"
+
+if str(SRC_DIR) not in sys.path:
+    sys.path.insert(0, str(SRC_DIR))
 
-# Use the dbt executable in the repo venv
-DBT_EXE = REPO_ROOT / ".venv" / "Scripts" / "dbt.exe"
+CHANNELS = [
+    "https://t.me/lobelia4cosmetics",
+    "https://t.me/tikvahpharma",
+]
+SCRAPE_LIMIT = 300
+MESSAGE_DELAY = 0.7
+SCRAPE_CONCURRENCY = int(os.getenv("SCRAPE_CONCURRENCY", "2"))
 
+daily_partitions = DailyPartitionsDefinition(
+    start_date=os.getenv("PIPELINE_START_DATE", "2025-01-01"),
+    end_offset=1,  # include today
+)
 
-def _load_env() -> None:
-    # Always load from repo-root .env
+
+def _prepare() -> None:
+    # Always load from repo-root .env; the scripts use paths relative to the repo root
     load_dotenv(dotenv_path=ENV_PATH, override=True)
+    os.chdir(REPO_ROOT)
 
 
-def run_cmd(cmd: str) -> None:
-    """
-    Run a shell command from repo root.
-    Raises RuntimeError if it fails.
-    """
-    log = get_dagster_logger()
-    log.info(f"Running: {cmd}")
+@contextmanager
+def _instrumented(asset_name: str, day: str) -> Iterator[Any]:
+    """Time an asset into the partition's _run_report.json and the Prometheus textfile."""
+    from instrumentation import RunMetrics
 
-    result = subprocess.run(cmd, shell=True, cwd=str(REPO_ROOT))
-    if result.returncode != 0:
-        raise RuntimeError(f"Command failed with exit code {result.returncode}: {cmd}")
+    metrics = RunMetrics(f"pipeline.{asset_name}", DATA_DIR, day)
+    try:
+        with metrics.stage(asset_name) as st:
+            yield st
+    finally:
+        metrics.write()
 
 
-def today_partition() -> str:
-    # "YYYY-MM-DD"
-    return datetime.now().strftime("%Y-%m-%d")
+def _run_sql_script(path: Path) -> None:
+    import psycopg2
+    from load_yolo_to_postgres import get_db_params
 
+    conn = psycopg2.connect(**get_db_params())
+    try:
+        with conn:
+            with conn.cursor() as cur:
+                cur.execute(path.read_text(encoding="utf-8"))
+    finally:
+        conn.close()
 
-# ---------- Dagster ops ----------
 
-@op
-def scrape_telegram_data():
-    """
-    Scrape raw Telegram messages + images into the data lake.
-    Skip if today's partition already exists.
-    """
-    _load_env()
+def _dbt(*args: str) -> None:
+    from dbt.cli.main import dbtRunner
+
     log = get_dagster_logger()
+    log.info(f"dbt {' '.join(args)}")
+    cli = [*args, "--project-dir", str(DBT_DIR), "--profiles-dir", str(DBT_DIR)]
+    if args[0] in ("build", "run", "seed", "test"):
+        cli += ["--threads", os.getenv("DBT_THREADS", "4")]
+    res = dbtRunner().invoke(cli)
+    if not res.success:
+        raise RuntimeError(f"dbt {' '.join(args)} failed: {res.exception}")
 
-    day = today_partition()
-    partition_dir = REPO_ROOT / "data" / "raw" / "telegram_messages" / day
 
-    if partition_dir.exists() and any(partition_dir.glob("*.json")):
-        log.info(f"Raw data already exists for {day}. Skipping scrape step.")
-        return {"partition": day, "skipped": True}
+# ---------- scrape ----------
 
-    # NOTE: keep the same channels/limit you used before
-    cmd = (
-        r'python src\scraper.py --path data '
-        r'--channels https://t.me/lobelia4cosmetics https://t.me/tikvahpharma '
-        r'--limit 300 --message-delay 0.7'
+@asset(partitions_def=daily_partitions, op_tags={"dagster/concurrency_key": "telegram"})
+def raw_telegram_partition(context: AssetExecutionContext) -> MaterializeResult:
+    """
+    Raw Telegram messages + images for one day in the data lake. All channels
+    are scraped in this one step, SCRAPE_CONCURRENCY at a time, over a single
+    Telethon client and one shared rate budget.
+
+    Only the latest (today's) partition is scraped. The scraper resumes from
+    the per-channel checkpoint, so scraping a past day would file today's
+    messages under that date and move the checkpoint past them; backfills of
+    past days load whatever the lake already holds for them.
+    """
+    _prepare()
+    from scraper import run
+
+    day = context.partition_key
+    if day != daily_partitions.get_last_partition_key():
+        context.log.info(f"{day} is a past partition. Not scraping.")
+        return MaterializeResult(metadata={"partition": day, "skipped": True})
+
+    counts = asyncio.run(
+        run(
+            base_path=DATA_DIR,
+            channels=CHANNELS,
+            limit=SCRAPE_LIMIT,
+            date_str=day,
+            message_delay=MESSAGE_DELAY,
+            concurrency=SCRAPE_CONCURRENCY,
+        )
     )
-    run_cmd(cmd)
-    return {"partition": day, "skipped": False}
+    return MaterializeResult(metadata={"partition": day, "messages": sum(counts.values())})
 
 
-@op
-def load_raw_to_postgres(_scrape_result):
-    """
-    Load raw telegram JSON into Postgres (raw.telegram_messages).
-    """
-    _load_env()
-    run_cmd(r"python src\load_raw_to_postgres.py")
-    return {"loaded": True}
+# ---------- load / enrich (in parallel) ----------
 
+@asset(partitions_def=daily_partitions, deps=[raw_telegram_partition])
+def raw_telegram_messages(context: AssetExecutionContext) -> MaterializeResult:
+    """The day's partition loaded into raw.telegram_messages (ledger-aware)."""
+    _prepare()
+    from load_raw_to_postgres import main as load_raw
 
-@op
-def run_yolo_enrichment(_raw_load_result):
-    """
-    Run YOLO detection over images and create/update data\yolo_detections.csv
-    """
-    _load_env()
-    run_cmd(r"python src\yolo_detect.py")
-    return {"yolo_done": True}
+    with _instrumented("raw_telegram_messages", context.partition_key):
+        load_raw(["--path", DATA_DIR, "--date", context.partition_key])
+    return MaterializeResult(metadata={"partition": context.partition_key})
 
 
-@op
-def load_yolo_to_postgres(_yolo_result):
+@asset(
+    partitions_def=daily_partitions,
+    deps=[raw_telegram_partition],
+    op_tags={"dagster/concurrency_key": "yolo"},
+)
+def yolo_detections(context: AssetExecutionContext) -> MaterializeResult:
     """
-    Create YOLO raw tables (if needed) and load detections into raw.yolo_detections
+    YOLO over the day's images, streamed straight into raw.yolo_detections /
+    raw.yolo_objects. Only needs the images, so it runs next to the raw load.
     """
-    _load_env()
+    _prepare()
+    _run_sql_script(REPO_ROOT / "scripts" / "create_yolo_tables.sql")
+    from yolo_detect import main as detect
 
-    # Create table(s) via psql inside container using PowerShell piping
-    run_cmd(
-        r'powershell -Command "Get-Content scripts\create_yolo_tables.sql | '
-        r'docker exec -i med_postgres psql -U med_user -d med_warehouse"'
-    )
+    with _instrumented("yolo_detections", context.partition_key):
+        detect(["--date", context.partition_key, "--sink", "postgres"])
+    return MaterializeResult(metadata={"partition": context.partition_key})
 
-    run_cmd(r"python src\load_yolo_to_postgres.py")
-    return {"yolo_loaded": True}
 
+# ---------- transform ----------
 
-@op
-def run_all_dbt_models(_yolo_loaded_result):
+@asset(
+    partitions_def=daily_partitions,
+    deps=[raw_telegram_messages, yolo_detections],
+    op_tags={"dagster/concurrency_key": "dbt"},
+)
+def dbt_marts(context: AssetExecutionContext) -> MaterializeResult:
     """
-    Run all dbt models (staging + marts).
-    Uses dbt executable from the repo venv (fixes 'python -m dbt' issue).
+    Build only what changed: models (and their tests) downstream of raw
+    tables whose row count or max(ingested_at) moved since the last
+    successful run, plus anything state:modified against the saved manifest.
+    Incremental models downstream of a raw table that lost rows are fully
+    refreshed in a second build. With no new rows and no project changes dbt
+    is not invoked at all. Then bump the API cache stamp.
+    Loads in other runs wait while this runs (load_ledger.RAW_WRITE_LOCK).
     """
-    _load_env()
-
-    if not DBT_EXE.exists():
-        raise RuntimeError(
-            f"dbt executable not found at: {DBT_EXE}\n"
-            "Make sure you created/installed dependencies in the repo venv (.venv)."
+    _prepare()
+    import psycopg2
+    from dbt_state import (
+        build_selection,
+        changed_sources,
+        file_sha1,
+        load_state,
+        project_fingerprint,
+        raw_watermarks,
+        save_state,
+        shrunk_sources,
+        state_dir,
+    )
+    from load_ledger import RAW_WRITE_LOCK
+    from load_yolo_to_postgres import get_db_params
+    from warehouse_version import main as bump_warehouse_version
+
+    state = load_state(DBT_DIR)
+
+    # dbt deps only when the lock file changed (or packages were cleaned)
+    lock_hash = file_sha1(DBT_DIR / "package-lock.yml")
+    if lock_hash != state.get("package_lock") or not (DBT_DIR / "dbt_packages").exists():
+        _dbt("deps")
+
+    # Hold RAW_WRITE_LOCK exclusively from reading the watermarks until the
+    # build is done: loads that started earlier have committed by then and
+    # later ones stamp ingested_at after it. Closing the connection releases it.
+    conn = psycopg2.connect(**get_db_params())
+    conn.autocommit = True
+    try:
+        with conn.cursor() as cur:
+            cur.execute("SELECT pg_advisory_lock(%s)", (RAW_WRITE_LOCK,))
+            marks = raw_watermarks(cur)
+        fingerprint = project_fingerprint(DBT_DIR)
+        has_manifest = (state_dir(DBT_DIR) / "manifest.json").exists()
+
+        if not state or not has_manifest:
+            selection: list[str] = []  # first run: build everything
+            shrunk: list[str] = []
+        else:
+            changed = changed_sources(state.get("raw_watermarks", {}), marks)
+            if not changed and fingerprint == state.get("project_fingerprint"):
+                context.log.info("No new raw rows and no dbt project changes. Skipping dbt.")
+                return MaterializeResult(metadata={"partition": context.partition_key, "skipped": True})
+            selection = build_selection(changed, has_manifest)
+            shrunk = shrunk_sources(state.get("raw_watermarks", {}), marks)
+
+        builds = [["build"]]
+        if selection:
+            builds = [["build", "--select", *selection, "--state", str(state_dir(DBT_DIR))]]
+            if shrunk:
+                # Rows were deleted upstream: what is downstream of those sources
+                # is built after the rest with --full-refresh, which only changes
+                # how incremental models build (tables and views rebuild anyway).
+                context.log.info(f"Rows removed from {', '.join(shrunk)}. Full refresh downstream of them.")
+                refresh = [f"source:raw.{t}+" for t in shrunk]
+                builds[0] += ["--exclude", *refresh]
+                builds.append(["build", "--select", *refresh, "--full-refresh"])
+        try:
+            # build = seeds + models + their tests, in DAG order
+            with _instrumented("dbt_marts", context.partition_key):
+                for args in builds:
+                    _dbt(*args)
+        finally:
+            # Marts may have changed even if a test failed: bump the stamp the API
+            # uses to invalidate its response cache
+            bump_warehouse_version()
+
+        save_state(DBT_DIR, {
+            "package_lock": lock_hash,
+            "project_fingerprint": fingerprint,
+            "raw_watermarks": marks,
+        })
+        return MaterializeResult(
+            metadata={"partition": context.partition_key, "select": " ".join(selection) or "all"}
         )
-
-    # dbt deps is safe to run; if already installed it’s quick
-    run_cmd(rf'cd medical_warehouse && "{DBT_EXE}" deps --profiles-dir .')
-
-    # Run everything
-    run_cmd(rf'cd medical_warehouse && "{DBT_EXE}" run --profiles-dir .')
-
-    # Optional but recommended: run tests too
-    run_cmd(rf'cd medical_warehouse && "{DBT_EXE}" test --profiles-dir .')
-
-    return {"dbt_ok": True}
+    finally:
+        conn.close()
 
 
 # ---------- job ----------
 
-@job
-def medical_telegram_job():
-    scrape = scrape_telegram_data()
-    raw_loaded = load_raw_to_postgres(scrape)
-    yolo_done = run_yolo_enrichment(raw_loaded)
-    yolo_loaded = load_yolo_to_postgres(yolo_done)
-    run_all_dbt_models(yolo_loaded)
+medical_telegram_job = define_asset_job(
+    "medical_telegram_job",
+    partitions_def=daily_partitions,
+    config={
+        "execution": {
+            "config": {"multiprocess": {"max_concurrent": int(os.getenv("PIPELINE_MAX_CONCURRENT", "4"))}}
+        }
+    },
+)
+
+defs = Definitions(
+    assets=[raw_telegram_partition, raw_telegram_messages, yolo_detections, dbt_marts],
+    jobs=[medical_telegram_job],
+    schedules=[build_schedule_from_partitioned_job(medical_telegram_job)],
+)
@@ -12,3 +12,16 @@ CREATE TABLE IF NOT EXISTS raw.telegram_messages (
     ingested_at     TIMESTAMP NOT NULL DEFAULT NOW(),
     PRIMARY KEY (channel_name, message_id)
 );
+
+CREATE TABLE IF NOT EXISTS raw.load_ledger (
+    file_path       TEXT PRIMARY KEY,
+    target_table    TEXT NOT NULL,
+    file_size       BIGINT NOT NULL,
+    file_mtime      TIMESTAMPTZ NOT NULL,
+    content_hash    TEXT NOT NULL,
+    loaded_at       TIMESTAMP NOT NULL DEFAULT NOW()
+);
+
+-- dbt incremental models pick up new/updated rows by ingested_at
+CREATE INDEX IF NOT EXISTS telegram_messages_ingested_at_idx
+    ON raw.telegram_messages (ingested_at);
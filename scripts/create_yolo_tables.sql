@@ -10,3 +10,22 @@ CREATE TABLE IF NOT EXISTS raw.yolo_detections (
   ingested_at        TIMESTAMP NOT NULL DEFAULT NOW(),
   PRIMARY KEY (channel_name, message_id)
 );
+
+CREATE TABLE IF NOT EXISTS raw.yolo_objects (
+  message_id         BIGINT NOT NULL,
+  channel_name       TEXT NOT NULL,
+  box_index          INT NOT NULL,
+  class_id           INT NOT NULL,
+  class_name         TEXT NOT NULL,
+  confidence         DOUBLE PRECISION NOT NULL,
+  x1                 DOUBLE PRECISION NOT NULL,
+  y1                 DOUBLE PRECISION NOT NULL,
+  x2                 DOUBLE PRECISION NOT NULL,
+  y2                 DOUBLE PRECISION NOT NULL,
+  ingested_at        TIMESTAMP NOT NULL DEFAULT NOW(),
+  PRIMARY KEY (channel_name, message_id, box_index)
+);
+
+-- dbt incremental models pick up new/updated rows by ingested_at
+CREATE INDEX IF NOT EXISTS yolo_detections_ingested_at_idx
+  ON raw.yolo_detections (ingested_at);
@@ -1,7 +1,27 @@
+import gzip
 import json
 import os
 from datetime import datetime, timezone
-from typing import Any, Dict, List, Optional
+from typing import IO, Any, Dict, Iterator, List, Optional
+
+try:
+    import zstandard
+except ImportError:  # optional: only needed for compression="zstd"
+    zstandard = None
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # optional: only needed for Parquet partitions
+    pa = None
+    pq = None
+
+
+NDJSON_SUFFIX = ".ndjson"
+PARQUET_SUFFIX = ".parquet"
+MANIFEST_NAME = "_manifest.json"
+PARQUET_ROW_GROUP_SIZE = 50_000
+COMPRESSION_SUFFIXES = {"none": "", "gzip": ".gz", "zstd": ".zst"}
 
 
 def ensure_dir(path: str) -> None:
@@ -16,29 +36,316 @@ def telegram_images_dir(base_path: str) -> str:
     return os.path.join(base_path, "raw", "images")
 
 
-def channel_messages_json_path(base_path: str, date_str: str, channel_name: str) -> str:
-    partition_dir = telegram_messages_partition_dir(base_path, date_str)
-    ensure_dir(partition_dir)
-    return os.path.join(partition_dir, f"{channel_name}.json")
+def checkpoints_dir(base_path: str) -> str:
+    return os.path.join(base_path, "raw", "checkpoints")
 
 
-def write_channel_messages_json(
-    *,
+def channel_checkpoint_path(base_path: str, channel_name: str) -> str:
+    out_dir = checkpoints_dir(base_path)
+    ensure_dir(out_dir)
+    return os.path.join(out_dir, f"{channel_name}.json")
+
+
+def read_channel_checkpoint(base_path: str, channel_name: str) -> Dict[str, Any]:
+    path = channel_checkpoint_path(base_path, channel_name)
+    if not os.path.exists(path):
+        return {}
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def write_channel_checkpoint(
     base_path: str,
-    date_str: str,
     channel_name: str,
-    messages: List[Dict[str, Any]],
+    last_message_id: int,
+    download_failures: Optional[Dict[int, int]] = None,
 ) -> str:
-    out_path = channel_messages_json_path(base_path, date_str, channel_name)
-    with open(out_path, "w", encoding="utf-8") as f:
-        json.dump(messages, f, ensure_ascii=False, indent=2)
+    """
+    Persist the channel's high-water mark, plus attempt counts for messages
+    whose photo download failed. Written to a temp file and renamed so an
+    interrupted run never leaves a truncated checkpoint behind.
+    """
+    out_path = channel_checkpoint_path(base_path, channel_name)
+    payload = {
+        "channel_name": channel_name,
+        "last_message_id": last_message_id,
+        "download_failures": {str(k): v for k, v in sorted((download_failures or {}).items())},
+        "updated_utc": datetime.now(timezone.utc).isoformat(),
+    }
+    tmp_path = out_path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(payload, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, out_path)
     return out_path
 
 
+def channel_messages_ndjson_path(
+    base_path: str, date_str: str, channel_name: str, compression: str = "none"
+) -> str:
+    if compression not in COMPRESSION_SUFFIXES:
+        raise ValueError(f"Unknown compression: {compression}")
+    partition_dir = telegram_messages_partition_dir(base_path, date_str)
+    ensure_dir(partition_dir)
+    return os.path.join(partition_dir, f"{channel_name}{NDJSON_SUFFIX}{COMPRESSION_SUFFIXES[compression]}")
+
+
+def _open_text(path: str, mode: str, compression: str) -> IO[str]:
+    if compression == "gzip":
+        return gzip.open(path, mode + "t", encoding="utf-8")
+    if compression == "zstd":
+        if zstandard is None:
+            raise RuntimeError("compression='zstd' requires the zstandard package")
+        return zstandard.open(path, mode + "t", encoding="utf-8")
+    return open(path, mode, encoding="utf-8")
+
+
+def _compression_for_path(path: str) -> str:
+    for name, suffix in COMPRESSION_SUFFIXES.items():
+        if suffix and path.endswith(suffix):
+            return name
+    return "none"
+
+
+class ChannelMessagesWriter:
+    """
+    Streaming writer for one channel partition: one JSON object per line,
+    optionally gzip/zstd compressed. Rows go to a temp file that is renamed
+    into place on close(), so readers never see a half-written partition.
+    Rows already in the partition file are carried over first, so a second
+    run on the same day adds to it instead of replacing it; readers that
+    merge on message_id keep the later copy.
+    """
+
+    def __init__(
+        self,
+        *,
+        base_path: str,
+        date_str: str,
+        channel_name: str,
+        compression: str = "none",
+    ) -> None:
+        self.path = channel_messages_ndjson_path(base_path, date_str, channel_name, compression)
+        self._tmp_path = self.path + ".tmp"
+        self._f = _open_text(self._tmp_path, "w", compression)
+        self.count = 0
+        if os.path.exists(self.path):
+            with _open_text(self.path, "r", compression) as existing:
+                for line in existing:
+                    if line.strip():
+                        self._f.write(line if line.endswith("\n") else line + "\n")
+
+    def write(self, row: Dict[str, Any]) -> None:
+        self._f.write(json.dumps(row, ensure_ascii=False))
+        self._f.write("\n")
+        self.count += 1
+
+    def close(self) -> str:
+        self._f.close()
+        os.replace(self._tmp_path, self.path)
+        return self.path
+
+    def abort(self) -> None:
+        self._f.close()
+        if os.path.exists(self._tmp_path):
+            os.remove(self._tmp_path)
+
+    def __enter__(self) -> "ChannelMessagesWriter":
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+
+def is_channel_messages_file(name: str) -> bool:
+    if name.startswith("_") or name.endswith(".tmp"):
+        return False
+    if name.endswith(".json"):
+        return True
+    return any(name.endswith(NDJSON_SUFFIX + suffix) for suffix in COMPRESSION_SUFFIXES.values())
+
+
+def list_partition_dirs(messages_root: str) -> List[str]:
+    """YYYY-MM-DD partition directories under data/raw/telegram_messages, oldest first."""
+    if not os.path.isdir(messages_root):
+        return []
+    return sorted(
+        os.path.join(messages_root, name)
+        for name in os.listdir(messages_root)
+        if os.path.isdir(os.path.join(messages_root, name))
+    )
+
+
+def list_channel_message_files(partition_dir: str) -> List[str]:
+    """Channel partition files (legacy .json and .ndjson[.gz|.zst]), skipping manifests."""
+    if not os.path.isdir(partition_dir):
+        return []
+    return sorted(
+        os.path.join(partition_dir, name)
+        for name in os.listdir(partition_dir)
+        if is_channel_messages_file(name)
+    )
+
+
+def iter_channel_messages(path: str) -> Iterator[Dict[str, Any]]:
+    """
+    Yield messages from a channel partition file one at a time.
+    Legacy whole-list .json files are still supported but are loaded at once.
+    """
+    path = str(path)
+    if path.endswith(".json"):
+        with open(path, "r", encoding="utf-8") as f:
+            messages = json.load(f)
+        if isinstance(messages, list):
+            yield from messages
+        return
+
+    with _open_text(path, "r", _compression_for_path(path)) as f:
+        for line in f:
+            line = line.strip()
+            if line:
+                yield json.loads(line)
+
+
+def _require_pyarrow() -> None:
+    if pa is None:
+        raise RuntimeError("Parquet partitions require the pyarrow package")
+
+
+def telegram_messages_parquet_schema() -> "pa.Schema":
+    _require_pyarrow()
+    return pa.schema([
+        ("message_id", pa.int64()),
+        ("channel_name", pa.dictionary(pa.int32(), pa.string())),
+        ("message_date", pa.timestamp("us", tz="UTC")),
+        ("message_text", pa.string()),
+        ("has_media", pa.bool_()),
+        ("image_path", pa.string()),
+        ("views", pa.int64()),
+        ("forwards", pa.int64()),
+    ])
+
+
+def channel_messages_parquet_path(base_path: str, date_str: str, channel_name: str) -> str:
+    partition_dir = telegram_messages_partition_dir(base_path, date_str)
+    ensure_dir(partition_dir)
+    return os.path.join(partition_dir, f"{channel_name}{PARQUET_SUFFIX}")
+
+
+class ChannelMessagesParquetWriter:
+    """
+    Parquet counterpart of ChannelMessagesWriter. Rows are buffered and
+    flushed as row groups (with min/max statistics) every `row_group_size`
+    rows; channel_name is dictionary-encoded. Same temp-file + rename
+    behaviour on close(), and the same carry-over of an existing partition.
+    """
+
+    def __init__(
+        self,
+        *,
+        base_path: str,
+        date_str: str,
+        channel_name: str,
+        row_group_size: int = PARQUET_ROW_GROUP_SIZE,
+    ) -> None:
+        _require_pyarrow()
+        self.path = channel_messages_parquet_path(base_path, date_str, channel_name)
+        self._tmp_path = self.path + ".tmp"
+        self.schema = telegram_messages_parquet_schema()
+        self.row_group_size = row_group_size
+        self._writer = pq.ParquetWriter(
+            self._tmp_path,
+            self.schema,
+            compression="zstd",
+            use_dictionary=["channel_name"],
+            write_statistics=True,
+        )
+        self._buffer: List[Dict[str, Any]] = []
+        self.count = 0
+        if os.path.exists(self.path):
+            for batch in pq.ParquetFile(self.path).iter_batches(batch_size=row_group_size):
+                self._writer.write_table(
+                    pa.Table.from_batches([batch]).cast(self.schema), row_group_size=row_group_size
+                )
+
+    def write(self, row: Dict[str, Any]) -> None:
+        self._buffer.append(row)
+        self.count += 1
+        if len(self._buffer) >= self.row_group_size:
+            self._flush()
+
+    def _flush(self) -> None:
+        if not self._buffer:
+            return
+        columns: Dict[str, List[Any]] = {name: [] for name in self.schema.names}
+        for row in self._buffer:
+            for name in self.schema.names:
+                value = row.get(name)
+                if name == "message_date" and isinstance(value, str):
+                    value = datetime.fromisoformat(value)
+                columns[name].append(value)
+        table = pa.Table.from_pydict(columns, schema=self.schema)
+        self._writer.write_table(table, row_group_size=self.row_group_size)
+        self._buffer = []
+
+    def close(self) -> str:
+        self._flush()
+        self._writer.close()
+        os.replace(self._tmp_path, self.path)
+        return self.path
+
+    def abort(self) -> None:
+        self._writer.close()
+        if os.path.exists(self._tmp_path):
+            os.remove(self._tmp_path)
+
+    def __enter__(self) -> "ChannelMessagesParquetWriter":
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+
+def iter_messages_parquet(
+    base_path: str,
+    *,
+    date_from: Optional[str] = None,
+    date_to: Optional[str] = None,
+    channels: Optional[List[str]] = None,
+    columns: Optional[List[str]] = None,
+    batch_size: int = 65_536,
+) -> Iterator["pa.RecordBatch"]:
+    """
+    Yield record batches from Parquet partitions. Dates (YYYY-MM-DD,
+    inclusive) and channels are pruned from the directory/file names, so
+    files outside the range are never opened.
+    """
+    _require_pyarrow()
+    root = os.path.join(base_path, "raw", "telegram_messages")
+    wanted = set(channels) if channels else None
+
+    for partition_dir in list_partition_dirs(root):
+        date_str = os.path.basename(partition_dir)
+        if (date_from and date_str < date_from) or (date_to and date_str > date_to):
+            continue
+        for name in sorted(os.listdir(partition_dir)):
+            if not name.endswith(PARQUET_SUFFIX):
+                continue
+            if wanted is not None and name[: -len(PARQUET_SUFFIX)] not in wanted:
+                continue
+            pf = pq.ParquetFile(os.path.join(partition_dir, name))
+            yield from pf.iter_batches(batch_size=batch_size, columns=columns)
+
+
 def manifest_path(base_path: str, date_str: str) -> str:
     partition_dir = telegram_messages_partition_dir(base_path, date_str)
     ensure_dir(partition_dir)
-    return os.path.join(partition_dir, "_manifest.json")
+    return os.path.join(partition_dir, MANIFEST_NAME)
 
 
 def write_manifest(
@@ -0,0 +1,106 @@
+import os
+import json
+import shutil
+import hashlib
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+# Raw tables declared as dbt sources (medical_warehouse/models/staging/sources.yml)
+RAW_SOURCES = ("telegram_messages", "yolo_detections", "yolo_objects")
+
+# Inputs that change what dbt builds; hashed to detect code/seed changes
+# without parsing the project.
+PROJECT_GLOBS = ("dbt_project.yml", "packages.yml", "models/**/*", "seeds/**/*", "macros/**/*", "tests/**/*")
+
+STATE_FILE = "pipeline_state.json"
+
+
+def state_dir(dbt_dir: Path) -> Path:
+    """Saved manifest.json (for state:modified) + pipeline_state.json from the last good run."""
+    return dbt_dir / "state"
+
+
+def load_state(dbt_dir: Path) -> Dict[str, Any]:
+    path = state_dir(dbt_dir) / STATE_FILE
+    if not path.exists():
+        return {}
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def save_state(dbt_dir: Path, state: Dict[str, Any]) -> None:
+    """Keep the run's manifest for the next state:modified comparison, then the state file (atomically)."""
+    out = state_dir(dbt_dir)
+    out.mkdir(exist_ok=True)
+    manifest = dbt_dir / "target" / "manifest.json"
+    if manifest.exists():
+        shutil.copyfile(manifest, out / "manifest.json")
+    tmp = out / f"{STATE_FILE}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(state, f, indent=2)
+    os.replace(tmp, out / STATE_FILE)
+
+
+def file_sha1(path: Path) -> Optional[str]:
+    if not path.exists():
+        return None
+    return hashlib.sha1(path.read_bytes()).hexdigest()
+
+
+def project_fingerprint(dbt_dir: Path) -> str:
+    h = hashlib.sha1()
+    files = sorted({p for g in PROJECT_GLOBS for p in dbt_dir.glob(g) if p.is_file()})
+    for p in files:
+        h.update(p.relative_to(dbt_dir).as_posix().encode("utf-8"))
+        h.update(p.read_bytes())
+    return h.hexdigest()
+
+
+def raw_watermarks(cur) -> Dict[str, Optional[Dict[str, Any]]]:
+    """
+    Row count and max(ingested_at) per raw source table; None if the table is
+    missing. The count catches deletes and shrinking reloads, which leave
+    max(ingested_at) where it was.
+    """
+    marks: Dict[str, Optional[Dict[str, Any]]] = {}
+    for table in RAW_SOURCES:
+        cur.execute("SELECT to_regclass(%s)", (f"raw.{table}",))
+        if cur.fetchone()[0] is None:
+            marks[table] = None
+            continue
+        cur.execute(f"SELECT count(*), max(ingested_at) FROM raw.{table}")
+        rows, latest = cur.fetchone()
+        marks[table] = {
+            "rows": rows,
+            "max_ingested_at": latest.isoformat() if latest is not None else None,
+        }
+    return marks
+
+
+def changed_sources(previous: Dict[str, Any], current: Dict[str, Any]) -> List[str]:
+    """Raw tables whose row count or high-water mark differs from the last successful dbt run."""
+    return [t for t in RAW_SOURCES if current.get(t) != previous.get(t)]
+
+
+def shrunk_sources(previous: Dict[str, Any], current: Dict[str, Any]) -> List[str]:
+    """
+    Raw tables that lost rows since the last run. Incremental models only add
+    or replace rows, so what is downstream of these needs a full refresh.
+    """
+    shrunk = []
+    for t in RAW_SOURCES:
+        before, now = previous.get(t), current.get(t)
+        if isinstance(before, dict) and isinstance(now, dict) and now["rows"] < before["rows"]:
+            shrunk.append(t)
+    return shrunk
+
+
+def build_selection(changed: List[str], has_saved_manifest: bool) -> List[str]:
+    """
+    dbt --select arguments: everything downstream of the changed sources,
+    plus anything whose code/config changed versus the saved manifest.
+    """
+    selectors = [f"source:raw.{t}+" for t in changed]
+    if has_saved_manifest:
+        selectors.append("state:modified+")
+    return selectors
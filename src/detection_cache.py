@@ -0,0 +1,166 @@
+import os
+import sqlite3
+from pathlib import Path
+from typing import Dict, Iterable, List, Tuple
+
+from load_ledger import file_hash
+
+DEFAULT_CACHE_PATH = Path("data/yolo_cache.sqlite")
+
+SCHEMA = """
+    CREATE TABLE IF NOT EXISTS files (
+        image_path      TEXT PRIMARY KEY,
+        file_size       INTEGER NOT NULL,
+        file_mtime      REAL NOT NULL,
+        content_hash    TEXT NOT NULL
+    );
+    CREATE TABLE IF NOT EXISTS detections (
+        content_hash        TEXT NOT NULL,
+        model_name          TEXT NOT NULL,
+        model_version       TEXT NOT NULL,
+        detected_objects    TEXT NOT NULL,
+        confidence_score    REAL NOT NULL,
+        image_category      TEXT NOT NULL,
+        objects             TEXT,
+        PRIMARY KEY (content_hash, model_name, model_version)
+    );
+    CREATE TABLE IF NOT EXISTS exports (
+        image_path      TEXT NOT NULL,
+        sink            TEXT NOT NULL,
+        content_hash    TEXT NOT NULL,
+        model_name      TEXT NOT NULL,
+        model_version   TEXT NOT NULL,
+        PRIMARY KEY (image_path, sink)
+    );
+"""
+
+# (detected_objects, confidence_score, image_category, objects as JSON)
+Detection = Tuple[str, float, str, str]
+
+
+class DetectionCache:
+    """
+    Persistent YOLO results keyed by (image content hash, model name, model
+    version), stored in SQLite next to the data lake.
+
+    A second table remembers each image's size/mtime -> hash so unchanged
+    files are not re-read just to be hashed, and a third which image paths
+    each sink (csv, postgres) already received a row for, so a new path with
+    known content still gets its own row.
+    """
+
+    def __init__(self, path: Path, model_name: str, model_version: str) -> None:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self.path = path
+        self.model_name = model_name
+        self.model_version = model_version
+        self._conn = sqlite3.connect(str(path))
+        self._conn.executescript(SCHEMA)
+        # caches created before per-box output have no objects column; their
+        # rows are ignored by get_many so those images are inferred again
+        columns = {row[1] for row in self._conn.execute("PRAGMA table_info(detections)")}
+        if "objects" not in columns:
+            self._conn.execute("ALTER TABLE detections ADD COLUMN objects TEXT")
+
+    def _select_wanted(self, keys: Iterable[str], sql: str, params: Tuple = ()) -> List[Tuple]:
+        """
+        Run `sql`, which joins the temp table `wanted` on its `key` column, for
+        just `keys`, so lookups cost what the run asks for, not the whole cache.
+        """
+        self._conn.execute("CREATE TEMP TABLE IF NOT EXISTS wanted (key TEXT PRIMARY KEY)")
+        self._conn.execute("DELETE FROM wanted")
+        self._conn.executemany("INSERT OR IGNORE INTO wanted (key) VALUES (?)", ((k,) for k in keys))
+        try:
+            return self._conn.execute(sql, params).fetchall()
+        finally:
+            self._conn.execute("DELETE FROM wanted")
+            self._conn.commit()
+
+    def content_hashes(self, image_paths: Iterable[Path]) -> Dict[Path, str]:
+        """Hash every image, reusing the stored hash when size and mtime are unchanged."""
+        image_paths = list(image_paths)
+        known = {
+            row[0]: (row[1], row[2], row[3])
+            for row in self._select_wanted(
+                (str(p).replace("\\", "/") for p in image_paths),
+                "SELECT f.image_path, f.file_size, f.file_mtime, f.content_hash "
+                "FROM files f JOIN wanted w ON w.key = f.image_path",
+            )
+        }
+        hashes: Dict[Path, str] = {}
+        updates: List[Tuple[str, int, float, str]] = []
+        for p in image_paths:
+            key = str(p).replace("\\", "/")
+            st = os.stat(p)
+            prev = known.get(key)
+            if prev is not None and prev[0] == st.st_size and prev[1] == st.st_mtime:
+                hashes[p] = prev[2]
+                continue
+            digest = file_hash(str(p))
+            hashes[p] = digest
+            updates.append((key, st.st_size, st.st_mtime, digest))
+        with self._conn:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO files (image_path, file_size, file_mtime, content_hash) VALUES (?, ?, ?, ?)",
+                updates,
+            )
+        return hashes
+
+    def get_many(self, content_hashes: Iterable[str]) -> Dict[str, Detection]:
+        rows = self._select_wanted(
+            content_hashes,
+            "SELECT d.content_hash, d.detected_objects, d.confidence_score, d.image_category, d.objects "
+            "FROM detections d JOIN wanted w ON w.key = d.content_hash "
+            "WHERE d.model_name = ? AND d.model_version = ? AND d.objects IS NOT NULL",
+            (self.model_name, self.model_version),
+        )
+        return {
+            content_hash: (detected_objects, conf, category, objects)
+            for content_hash, detected_objects, conf, category, objects in rows
+        }
+
+    def put_many(self, items: Iterable[Tuple[str, Detection]]) -> None:
+        with self._conn:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO detections "
+                "(content_hash, model_name, model_version, detected_objects, confidence_score, image_category, objects) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                [(h, self.model_name, self.model_version, *det) for h, det in items],
+            )
+
+    def exported(self, sink: str, image_paths: Iterable[str]) -> Dict[str, str]:
+        """image_path -> content_hash of the rows `sink` already has for this model, among `image_paths`."""
+        rows = self._select_wanted(
+            image_paths,
+            "SELECT e.image_path, e.content_hash FROM exports e JOIN wanted w ON w.key = e.image_path "
+            "WHERE e.sink = ? AND e.model_name = ? AND e.model_version = ?",
+            (sink, self.model_name, self.model_version),
+        )
+        return dict(rows)
+
+    def mark_exported(self, sink: str, items: Iterable[Tuple[str, str]]) -> None:
+        """Record (image_path, content_hash) pairs as written to `sink`."""
+        with self._conn:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO exports (image_path, sink, content_hash, model_name, model_version) "
+                "VALUES (?, ?, ?, ?, ?)",
+                [(key, sink, h, self.model_name, self.model_version) for key, h in items],
+            )
+
+    def clear_exports(self, sink: str) -> None:
+        """Forget what `sink` received, e.g. when its output file is rewritten from scratch."""
+        with self._conn:
+            self._conn.execute("DELETE FROM exports WHERE sink = ?", (sink,))
+
+    def close(self) -> None:
+        self._conn.close()
+
+
+def model_version(weights: str) -> str:
+    """ultralytics version plus a hash of the local weights file, when present."""
+    import ultralytics
+
+    version = f"ultralytics-{ultralytics.__version__}"
+    if os.path.exists(weights):
+        version += f"+{file_hash(weights)[:12]}"
+    return version
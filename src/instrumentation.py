@@ -0,0 +1,240 @@
+import os
+import sys
+import json
+import time
+import threading
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from typing import Any, Dict, Iterator, List, Optional
+
+import psycopg2.extensions
+
+from datalake import telegram_messages_partition_dir
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+try:
+    import psutil
+except ImportError:  # optional: peak RSS fallback where `resource` is missing
+    psutil = None
+
+RUN_REPORT_NAME = "_run_report.json"
+METRIC_PREFIX = "med_pipeline"
+# node_exporter textfile collector directory; one <component>.prom per component
+DEFAULT_TEXTFILE_DIR = os.path.join("data", "metrics")
+
+
+class StageTimer:
+    """Mutable handle yielded by RunMetrics.stage(); callers add their counts."""
+
+    def __init__(self, name: str) -> None:
+        self.name = name
+        self.rows = 0
+        self.bytes = 0
+        self.seconds = 0.0
+
+    def add(self, rows: int = 0, nbytes: int = 0) -> None:
+        self.rows += rows
+        self.bytes += nbytes
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {
+            "seconds": round(self.seconds, 3),
+            "rows": self.rows,
+            "rows_per_second": round(self.rows / self.seconds, 1) if self.seconds > 0 else None,
+            "bytes_written": self.bytes,
+        }
+
+
+class RunMetrics:
+    """
+    Per-process run telemetry for one component (scraper, yolo_detect, a
+    loader, a pipeline asset): stage durations, rows/s, bytes written, peak
+    RSS and DB round-trips.
+
+    `write()` merges the component's section into the partition's
+    _run_report.json (next to _manifest.json) and writes a Prometheus
+    textfile for node_exporter.
+    """
+
+    def __init__(self, component: str, base_path: str = "data", date_str: Optional[str] = None) -> None:
+        self.component = component
+        self.base_path = base_path
+        self.date_str = date_str or datetime.now().strftime("%Y-%m-%d")
+        self.started_at = datetime.now(timezone.utc)
+        self._t0 = time.perf_counter()
+        self.stages: Dict[str, StageTimer] = {}
+        self.db_round_trips = 0
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def stage(self, name: str) -> Iterator[StageTimer]:
+        timer = self.stages.setdefault(name, StageTimer(name))
+        t0 = time.perf_counter()
+        try:
+            yield timer
+        finally:
+            timer.seconds += time.perf_counter() - t0
+
+    def count_round_trip(self, n: int = 1) -> None:
+        with self._lock:
+            self.db_round_trips += n
+
+    def cursor_factory(self):
+        """psycopg2 cursor_factory that counts statements sent to the server."""
+        return counting_cursor(self)
+
+    def report(self) -> Dict[str, Any]:
+        return {
+            "started_at": self.started_at.isoformat(),
+            "seconds": round(time.perf_counter() - self._t0, 3),
+            "peak_rss_bytes": peak_rss_bytes(),
+            "db_round_trips": self.db_round_trips,
+            "stages": {name: s.as_dict() for name, s in self.stages.items()},
+        }
+
+    def write(self) -> Dict[str, Any]:
+        report = self.report()
+        try:
+            write_run_report(self.base_path, self.date_str, self.component, report)
+            write_prometheus_textfile(self.component, report)
+        except OSError as e:
+            # telemetry must never fail the run it describes
+            print(f"Could not write run metrics for {self.component}: {e}", file=sys.stderr)
+        return report
+
+
+def counting_cursor(metrics: RunMetrics):
+    class CountingCursor(psycopg2.extensions.cursor):
+        def execute(self, query, vars=None):
+            metrics.count_round_trip()
+            return super().execute(query, vars)
+
+        def executemany(self, query, vars_list):
+            # psycopg2 sends one statement per parameter set
+            vars_list = list(vars_list)
+            metrics.count_round_trip(len(vars_list))
+            return super().executemany(query, vars_list)
+
+        def copy_expert(self, sql, file, size=8192):
+            metrics.count_round_trip()
+            return super().copy_expert(sql, file, size)
+
+    return CountingCursor
+
+
+def peak_rss_bytes() -> Optional[int]:
+    """Peak RSS of this process plus its finished children (process pools)."""
+    if resource is not None:
+        # ru_maxrss is KiB on Linux, bytes on macOS
+        scale = 1 if sys.platform == "darwin" else 1024
+        own = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+        return (own + children) * scale
+    if psutil is not None:
+        info = psutil.Process().memory_info()
+        # Windows exposes the peak working set
+        return getattr(info, "peak_wset", None) or info.rss
+    return None
+
+
+def write_run_report(base_path: str, date_str: str, component: str, report: Dict[str, Any]) -> str:
+    """
+    Merge `report` under components.<component> in the partition's
+    _run_report.json. Components run in separate processes, so the
+    read-modify-write happens under a lock file.
+    """
+    partition_dir = telegram_messages_partition_dir(base_path, date_str)
+    os.makedirs(partition_dir, exist_ok=True)
+    out_path = os.path.join(partition_dir, RUN_REPORT_NAME)
+    with _file_lock(out_path + ".lock"):
+        payload: Dict[str, Any] = {"date": date_str, "components": {}}
+        if os.path.exists(out_path):
+            with open(out_path, "r", encoding="utf-8") as f:
+                payload = json.load(f)
+        payload.setdefault("components", {})[component] = report
+        payload["updated_utc"] = datetime.now(timezone.utc).isoformat()
+        tmp = out_path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(payload, f, ensure_ascii=False, indent=2)
+        os.replace(tmp, out_path)
+    return out_path
+
+
+@contextmanager
+def _file_lock(path: str, timeout: float = 10.0) -> Iterator[None]:
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            fd = os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+            break
+        except FileExistsError:
+            if time.monotonic() > deadline:
+                # a crashed writer left the lock behind
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+                deadline = time.monotonic() + timeout
+                continue
+            time.sleep(0.05)
+    try:
+        yield
+    finally:
+        os.close(fd)
+        os.remove(path)
+
+
+def _labels(**labels: str) -> str:
+    inner = ",".join(f'{k}="{str(v)}"' for k, v in labels.items())
+    return "{" + inner + "}"
+
+
+def prometheus_lines(component: str, report: Dict[str, Any]) -> List[str]:
+    p = METRIC_PREFIX
+    c = component
+    lines = [
+        f"# HELP {p}_run_seconds Wall time of the component's last run.",
+        f"# TYPE {p}_run_seconds gauge",
+        f"{p}_run_seconds{_labels(component=c)} {report['seconds']}",
+        f"# HELP {p}_last_run_timestamp_seconds Start of the component's last run (unix time).",
+        f"# TYPE {p}_last_run_timestamp_seconds gauge",
+        f"{p}_last_run_timestamp_seconds{_labels(component=c)} "
+        f"{datetime.fromisoformat(report['started_at']).timestamp():.0f}",
+        f"# HELP {p}_db_round_trips Statements sent to Postgres in the last run.",
+        f"# TYPE {p}_db_round_trips gauge",
+        f"{p}_db_round_trips{_labels(component=c)} {report['db_round_trips']}",
+    ]
+    if report["peak_rss_bytes"] is not None:
+        lines += [
+            f"# HELP {p}_peak_rss_bytes Peak resident set size of the last run.",
+            f"# TYPE {p}_peak_rss_bytes gauge",
+            f"{p}_peak_rss_bytes{_labels(component=c)} {report['peak_rss_bytes']}",
+        ]
+    stage_metrics = [
+        ("stage_seconds", "seconds", "Duration of each stage in the last run."),
+        ("stage_rows", "rows", "Rows/images processed by each stage in the last run."),
+        ("stage_rows_per_second", "rows_per_second", "Throughput of each stage in the last run."),
+        ("stage_bytes_written", "bytes_written", "Bytes written by each stage in the last run."),
+    ]
+    for metric, key, help_text in stage_metrics:
+        lines += [f"# HELP {p}_{metric} {help_text}", f"# TYPE {p}_{metric} gauge"]
+        for name, s in report["stages"].items():
+            if s[key] is not None:
+                lines.append(f"{p}_{metric}{_labels(component=c, stage=name)} {s[key]}")
+    return lines
+
+
+def write_prometheus_textfile(component: str, report: Dict[str, Any]) -> str:
+    out_dir = os.getenv("PROMETHEUS_TEXTFILE_DIR", DEFAULT_TEXTFILE_DIR)
+    os.makedirs(out_dir, exist_ok=True)
+    out_path = os.path.join(out_dir, f"{component}.prom")
+    # node_exporter may read at any time: write then rename
+    tmp = out_path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        f.write("\n".join(prometheus_lines(component, report)) + "\n")
+    os.replace(tmp, out_path)
+    return out_path
@@ -0,0 +1,180 @@
+import os
+import hashlib
+from datetime import datetime, timezone
+from typing import Dict, Iterable, List, Optional, Tuple
+
+# Kept in sync with scripts/create_raw_tables.sql so loaders also work on a
+# database that predates the ledger.
+LEDGER_DDL = """
+    CREATE TABLE IF NOT EXISTS raw.load_ledger (
+        file_path       TEXT PRIMARY KEY,
+        target_table    TEXT NOT NULL,
+        file_size       BIGINT NOT NULL,
+        file_mtime      TIMESTAMPTZ NOT NULL,
+        content_hash    TEXT NOT NULL,
+        loaded_at       TIMESTAMP NOT NULL DEFAULT NOW()
+    );
+"""
+
+RECORD_SQL = """
+    INSERT INTO raw.load_ledger (file_path, target_table, file_size, file_mtime, content_hash)
+    VALUES (%s, %s, %s, %s, %s)
+    ON CONFLICT (file_path) DO UPDATE SET
+        target_table = EXCLUDED.target_table,
+        file_size = EXCLUDED.file_size,
+        file_mtime = EXCLUDED.file_mtime,
+        content_hash = EXCLUDED.content_hash,
+        loaded_at = NOW();
+"""
+
+# (file_path, file_size, file_mtime, content_hash)
+LedgerEntry = Tuple[str, int, datetime, str]
+
+# ingested_at = NOW() is the transaction's start time, so a slow load can
+# commit rows stamped before a max(ingested_at) that dbt already consumed.
+# Loaders hold this advisory lock shared for each write transaction; the
+# pipeline's dbt step takes it exclusively, which waits for in-flight loads
+# and holds new ones off until the build is done.
+RAW_WRITE_LOCK = 7_242_001
+
+
+def ensure_ledger(cur) -> None:
+    cur.execute("CREATE SCHEMA IF NOT EXISTS raw;")
+    cur.execute(LEDGER_DDL)
+
+
+def lock_raw_writes(cur) -> None:
+    """Take RAW_WRITE_LOCK shared until commit. Must be the transaction's first statement."""
+    cur.execute("SELECT pg_advisory_xact_lock_shared(%s)", (RAW_WRITE_LOCK,))
+
+
+def file_hash(path: str, chunk_size: int = 1 << 20) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def file_stat(path: str) -> Tuple[int, datetime]:
+    st = os.stat(path)
+    return st.st_size, datetime.fromtimestamp(st.st_mtime, tz=timezone.utc)
+
+
+def ledger_key(path: str, base_path: str) -> str:
+    """Ledger paths are stored relative to the data directory, with forward slashes."""
+    return os.path.relpath(path, base_path).replace("\\", "/")
+
+
+def fetch_ledger(cur, keys: Iterable[str]) -> Dict[str, Tuple[int, datetime, str]]:
+    keys = list(keys)
+    if not keys:
+        return {}
+    cur.execute(
+        "SELECT file_path, file_size, file_mtime, content_hash FROM raw.load_ledger WHERE file_path = ANY(%s)",
+        (keys,),
+    )
+    return {r[0]: (r[1], r[2], r[3]) for r in cur.fetchall()}
+
+
+def unchanged_by_stat(path: str, prev: Optional[Tuple[int, datetime, str]]) -> bool:
+    if prev is None:
+        return False
+    size, mtime = file_stat(path)
+    return prev[0] == size and prev[1] == mtime
+
+
+def changed_files(
+    cur,
+    paths: List[str],
+    base_path: str,
+    full_reload: bool = False,
+) -> Tuple[List[Tuple[str, LedgerEntry]], List[LedgerEntry]]:
+    """
+    Split `paths` into files that need loading and files that only need their
+    ledger row refreshed. Size + mtime matching the ledger skips the file
+    without reading it; otherwise the content hash decides (a touched but
+    identical file is not reloaded).
+
+    Returns ([(path, entry), ...] to load, [entry, ...] to re-record).
+    """
+    keys = {p: ledger_key(p, base_path) for p in paths}
+    known = {} if full_reload else fetch_ledger(cur, keys.values())
+
+    to_load: List[Tuple[str, LedgerEntry]] = []
+    touched: List[LedgerEntry] = []
+    for p in paths:
+        prev = known.get(keys[p])
+        if unchanged_by_stat(p, prev):
+            continue
+        entry = make_entry(p, base_path)
+        if prev is not None and prev[2] == entry[3]:
+            touched.append(entry)
+        else:
+            to_load.append((p, entry))
+    return to_load, touched
+
+
+def make_entry(path: str, base_path: str) -> LedgerEntry:
+    size, mtime = file_stat(path)
+    return ledger_key(path, base_path), size, mtime, file_hash(path)
+
+
+def complete_lines_end(path: str, size: int) -> int:
+    """Offset just past the last newline in the first `size` bytes; a writer may be mid-line."""
+    with open(path, "rb") as f:
+        pos = size
+        while pos > 0:
+            step = min(1 << 16, pos)
+            f.seek(pos - step)
+            i = f.read(step).rfind(b"\n")
+            if i >= 0:
+                return pos - step + i + 1
+            pos -= step
+    return 0
+
+
+def prefix_hashes(path: str, cut: int, end: int, chunk_size: int = 1 << 20) -> Tuple[str, str]:
+    """sha256 of the first `cut` bytes and of the first `end` bytes, in one read."""
+    h = hashlib.sha256()
+    head = h.hexdigest() if cut == 0 else None
+    pos = 0
+    with open(path, "rb") as f:
+        while pos < end:
+            n = min(chunk_size, end - pos)
+            if head is None:
+                n = min(n, cut - pos)
+            chunk = f.read(n)
+            if not chunk:
+                break
+            h.update(chunk)
+            pos += len(chunk)
+            if head is None and pos == cut:
+                head = h.hexdigest()
+    return head or "", h.hexdigest()
+
+
+def plan_append(
+    path: str,
+    base_path: str,
+    prev: Optional[Tuple[int, datetime, str]],
+    full_reload: bool = False,
+) -> Tuple[int, LedgerEntry]:
+    """
+    For an append-only file: the byte offset to load from and the ledger
+    entry to record once loaded. The entry's size is the number of bytes
+    loaded (up to the last complete line) and its hash covers those bytes,
+    so the next run resumes there if the file only grew. Offset 0 (a full
+    load) when there is no ledger row, or the file shrank or its head changed.
+    """
+    size, mtime = file_stat(path)
+    end = complete_lines_end(path, size)
+    cut = prev[0] if prev is not None and not full_reload and prev[0] <= end else 0
+    head, digest = prefix_hashes(path, cut, end)
+    start = cut if cut and head == prev[2] else 0
+    return start, (ledger_key(path, base_path), end, mtime, digest)
+
+
+def record_files(cur, entries: Iterable[LedgerEntry], target_table: str) -> None:
+    for key, size, mtime, digest in entries:
+        cur.execute(RECORD_SQL, (key, target_table, size, mtime, digest))
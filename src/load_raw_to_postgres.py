@@ -1,13 +1,109 @@
-import json
 import os
+import time
+import argparse
+from itertools import islice
 from pathlib import Path
 from datetime import datetime
-from typing import Optional, List, Tuple
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Dict, Iterable, Iterator, Optional, List, Tuple
 
 from dotenv import load_dotenv
 import psycopg2
 from psycopg2.extras import execute_values
+from psycopg2.pool import SimpleConnectionPool
 
+from datalake import iter_channel_messages, list_channel_message_files, list_partition_dirs
+from instrumentation import RunMetrics
+from load_ledger import (
+    LedgerEntry,
+    changed_files,
+    ensure_ledger,
+    lock_raw_writes,
+    record_files,
+)
+from pg_copy import copy_rows
+
+TARGET_TABLE = "raw.telegram_messages"
+
+
+RAW_COLUMNS = (
+    "message_id",
+    "channel_name",
+    "message_date",
+    "message_text",
+    "has_media",
+    "image_path",
+    "views",
+    "forwards",
+)
+
+# Shared by every statement that writes raw.telegram_messages. Unchanged rows
+# are left alone so dbt's ingested_at filter only sees real updates.
+ON_CONFLICT_SQL = """
+    ON CONFLICT (channel_name, message_id) DO UPDATE SET
+        message_date = EXCLUDED.message_date,
+        message_text = EXCLUDED.message_text,
+        has_media = EXCLUDED.has_media,
+        image_path = EXCLUDED.image_path,
+        views = EXCLUDED.views,
+        forwards = EXCLUDED.forwards,
+        ingested_at = NOW()
+    WHERE (raw.telegram_messages.message_date, raw.telegram_messages.message_text,
+           raw.telegram_messages.has_media, raw.telegram_messages.image_path,
+           raw.telegram_messages.views, raw.telegram_messages.forwards)
+        IS DISTINCT FROM
+          (EXCLUDED.message_date, EXCLUDED.message_text, EXCLUDED.has_media,
+           EXCLUDED.image_path, EXCLUDED.views, EXCLUDED.forwards);
+"""
+
+UPSERT_SQL = """
+    INSERT INTO raw.telegram_messages
+    (message_id, channel_name, message_date, message_text, has_media, image_path, views, forwards)
+    VALUES %s
+""" + ON_CONFLICT_SQL
+
+# load_seq preserves file order so the merge keeps the last seen version
+STAGE_DDL = """
+    CREATE TEMP TABLE {stage} (
+        LIKE raw.telegram_messages INCLUDING DEFAULTS,
+        load_seq BIGSERIAL
+    ) ON COMMIT DROP;
+"""
+
+MERGE_SQL = """
+    INSERT INTO raw.telegram_messages
+    (message_id, channel_name, message_date, message_text, has_media, image_path, views, forwards)
+    SELECT DISTINCT ON (channel_name, message_id)
+        message_id, channel_name, message_date, message_text, has_media, image_path, views, forwards
+    FROM {stage}
+    ORDER BY channel_name, message_id, load_seq DESC
+""" + ON_CONFLICT_SQL
+
+# Parallel mode: each worker process COPYs into its own unlogged table that
+# the final merge reads from another connection, so these cannot be TEMP.
+# part_seq is the file's position in load order so later files still win.
+PARALLEL_STAGE_DDL = """
+    CREATE UNLOGGED TABLE IF NOT EXISTS {stage} (
+        LIKE raw.telegram_messages INCLUDING DEFAULTS,
+        part_seq INT NOT NULL,
+        load_seq BIGSERIAL
+    );
+"""
+
+PARALLEL_MERGE_SQL = """
+    INSERT INTO raw.telegram_messages
+    (message_id, channel_name, message_date, message_text, has_media, image_path, views, forwards)
+    SELECT DISTINCT ON (channel_name, message_id)
+        message_id, channel_name, message_date, message_text, has_media, image_path, views, forwards
+    FROM ({union}) s
+    ORDER BY channel_name, message_id, part_seq DESC, load_seq DESC
+""" + ON_CONFLICT_SQL
+
+DEFAULT_BATCH_SIZE = 50_000
+
+# per-process connection pool and staging table, created by _init_worker
+_POOL: Optional[SimpleConnectionPool] = None
+_STAGE: Optional[str] = None
 
 def parse_ts(value: Optional[str]) -> Optional[datetime]:
     if not value:
@@ -18,47 +114,46 @@ def parse_ts(value: Optional[str]) -> Optional[datetime]:
         return None
 
 
-def main() -> None:
+def get_db_params() -> Dict[str, Any]:
     # Always load .env from repo root
     env_path = Path(__file__).resolve().parents[1] / ".env"
     load_dotenv(dotenv_path=env_path, override=True)
 
-    db_host = os.getenv("DB_HOST", "localhost")
-    db_port = int(os.getenv("DB_PORT", "5432"))
-    db_name = os.getenv("DB_NAME", "med_warehouse")
-    db_user = os.getenv("DB_USER", "med_user")
-    db_password = os.getenv("DB_PASSWORD", "med_password")
-
-    print("Using DB creds:", db_host, db_port, db_name, db_user, db_password)
-
-    base_dir = Path("data/raw/telegram_messages")
-    json_files = [p for p in base_dir.rglob("*.json") if p.name != "_manifest.json"]
-    if not json_files:
-        raise RuntimeError("No JSON files found under data/raw/telegram_messages")
-
-    rows: List[Tuple] = []
-    for fp in json_files:
-        with open(fp, "r", encoding="utf-8") as f:
-            messages = json.load(f)
-
-        if not isinstance(messages, list):
-            continue
-
-        for m in messages:
-            # NOTE: your ON CONFLICT key is (channel_name, message_id)
-            # so we keep exactly those fields consistent
-            rows.append(
-                (
-                    int(m.get("message_id")),
-                    str(m.get("channel_name")),
-                    parse_ts(m.get("message_date")),
-                    m.get("message_text") or "",
-                    bool(m.get("has_media", False)),
-                    m.get("image_path"),
-                    int(m.get("views") or 0),
-                    int(m.get("forwards") or 0),
-                )
-            )
+    return {
+        "host": os.getenv("DB_HOST", "localhost"),
+        "port": int(os.getenv("DB_PORT", "5432")),
+        "dbname": os.getenv("DB_NAME", "med_warehouse"),
+        "user": os.getenv("DB_USER", "med_user"),
+        "password": os.getenv("DB_PASSWORD", "med_password"),
+    }
+
+
+def message_row(m: Dict[str, Any]) -> Tuple:
+    # NOTE: your ON CONFLICT key is (channel_name, message_id)
+    # so we keep exactly those fields consistent
+    return (
+        int(m.get("message_id")),
+        str(m.get("channel_name")),
+        parse_ts(m.get("message_date")),
+        m.get("message_text") or "",
+        bool(m.get("has_media", False)),
+        m.get("image_path"),
+        int(m.get("views") or 0),
+        int(m.get("forwards") or 0),
+    )
+
+
+def iter_message_rows(files: Iterable[str]) -> Iterator[Tuple]:
+    for fp in files:
+        for m in iter_channel_messages(fp):
+            yield message_row(m)
+
+
+def upsert_rows(conn, files: List[str], ledger_entries: List[LedgerEntry]) -> int:
+    """
+    Original loader: collect all rows, dedup in memory, execute_values upsert.
+    """
+    rows: List[Tuple] = list(iter_message_rows(files))
 
     # ------------------ DEDUP (fixes CardinalityViolation) ------------------
     # Conflict key in SQL: (channel_name, message_id)
@@ -71,29 +166,226 @@ def main() -> None:
     rows = list(unique.values())
     # -----------------------------------------------------------------------
 
-    conn = psycopg2.connect(
-        host=db_host, port=db_port, dbname=db_name, user=db_user, password=db_password
-    )
+    with conn:
+        with conn.cursor() as cur:
+            lock_raw_writes(cur)
+            execute_values(cur, UPSERT_SQL, rows, page_size=1000)
+            record_files(cur, ledger_entries, TARGET_TABLE)
+    return len(rows)
 
-    sql = """
-        INSERT INTO raw.telegram_messages
-        (message_id, channel_name, message_date, message_text, has_media, image_path, views, forwards)
-        VALUES %s
-        ON CONFLICT (channel_name, message_id) DO UPDATE SET
-            message_date = EXCLUDED.message_date,
-            message_text = EXCLUDED.message_text,
-            has_media = EXCLUDED.has_media,
-            image_path = EXCLUDED.image_path,
-            views = EXCLUDED.views,
-            forwards = EXCLUDED.forwards;
+
+def copy_and_merge(
+    conn,
+    files: List[str],
+    ledger_entries: List[LedgerEntry],
+    stage: str = "stage_telegram_messages",
+) -> int:
+    """
+    Stream rows into a temp staging table with COPY and merge them into
+    raw.telegram_messages with one set-based INSERT ... ON CONFLICT.
+    Memory use does not depend on how many files are loaded. Ledger rows
+    are written in the same transaction as the merge.
     """
+    with conn:
+        with conn.cursor() as cur:
+            lock_raw_writes(cur)
+            cur.execute(STAGE_DDL.format(stage=stage))
+            copied = copy_rows(cur, stage, RAW_COLUMNS, iter_message_rows(files))
+            cur.execute(MERGE_SQL.format(stage=stage))
+            merged = cur.rowcount
+            record_files(cur, ledger_entries, TARGET_TABLE)
+    print(f"Copied {copied} rows into {stage}, merged {merged}")
+    return merged
+
+
+def _init_worker(db_params: Dict[str, Any], run_id: str) -> None:
+    global _POOL, _STAGE
+    _POOL = SimpleConnectionPool(1, 2, **db_params)
+    _STAGE = f"raw._stage_telegram_messages_{run_id}_{os.getpid()}"
+
+
+def _copy_partition(part_seq: int, path: str, batch_size: int) -> Tuple[str, int]:
+    """
+    Worker task: parse one date/channel partition file and COPY it into this
+    worker's staging table in batches of `batch_size` rows.
+    """
+    assert _POOL is not None and _STAGE is not None, "worker not initialised"
+    conn = _POOL.getconn()
+    copied = 0
+    try:
+        with conn:
+            with conn.cursor() as cur:
+                cur.execute(PARALLEL_STAGE_DDL.format(stage=_STAGE))
+        rows = (row + (part_seq,) for row in iter_message_rows([path]))
+        while True:
+            batch = list(islice(rows, batch_size))
+            if not batch:
+                break
+            with conn:
+                with conn.cursor() as cur:
+                    copied += copy_rows(cur, _STAGE, RAW_COLUMNS + ("part_seq",), batch)
+    finally:
+        _POOL.putconn(conn)
+    return _STAGE, copied
+
+
+def parallel_copy_and_merge(
+    conn,
+    db_params: Dict[str, Any],
+    files: List[str],
+    ledger_entries: List[LedgerEntry],
+    workers: int,
+    batch_size: int = DEFAULT_BATCH_SIZE,
+) -> int:
+    """
+    Parse and COPY date/channel partition files on a process pool. Each
+    worker has a pooled connection and its own staging table; all staging
+    tables are merged into raw.telegram_messages in one final statement.
+    """
+    run_id = f"{os.getpid()}_{int(time.time())}"
+    stages = set()
+    copied = 0
+    merged = 0
+    try:
+        with ProcessPoolExecutor(
+            max_workers=workers, initializer=_init_worker, initargs=(db_params, run_id)
+        ) as pool:
+            futures = [
+                pool.submit(_copy_partition, part_seq, fp, batch_size)
+                for part_seq, fp in enumerate(files)
+            ]
+            for fut in futures:
+                stage, n = fut.result()
+                stages.add(stage)
+                copied += n
+
+        if stages:
+            union = " UNION ALL ".join(f"SELECT * FROM {stage}" for stage in sorted(stages))
+            with conn:
+                with conn.cursor() as cur:
+                    lock_raw_writes(cur)
+                    cur.execute(PARALLEL_MERGE_SQL.format(union=union))
+                    merged = cur.rowcount
+                    record_files(cur, ledger_entries, TARGET_TABLE)
+    finally:
+        # workers that failed before returning may still have created a table
+        with conn:
+            with conn.cursor() as cur:
+                cur.execute(
+                    "SELECT schemaname || '.' || tablename FROM pg_tables "
+                    "WHERE schemaname = 'raw' AND tablename LIKE %s",
+                    (f"\\_stage\\_telegram\\_messages\\_{run_id}\\_%",),
+                )
+                for (stage,) in cur.fetchall():
+                    cur.execute(f"DROP TABLE IF EXISTS {stage};")
+
+    print(f"Copied {copied} rows from {len(files)} files with {workers} workers, merged {merged}")
+    return merged
+
+
+def plan_load(
+    conn,
+    base_path: str,
+    full_reload: bool = False,
+    dates: Optional[List[str]] = None,
+) -> Tuple[List[str], List[LedgerEntry]]:
+    """
+    Decide which partition files to load using raw.load_ledger. Every
+    channel file is checked: size + mtime matching its ledger row skips it
+    without reading, otherwise its content hash decides. The ledger rows of
+    all files are fetched in one query. `dates` restricts the plan to those
+    YYYY-MM-DD partitions.
+    """
+    root = os.path.join(base_path, "raw", "telegram_messages")
+    partitions = list_partition_dirs(root)
+    if dates is not None:
+        partitions = [d for d in partitions if os.path.basename(d) in set(dates)]
+    paths = [p for d in partitions for p in list_channel_message_files(d)]
 
     with conn:
         with conn.cursor() as cur:
-            execute_values(cur, sql, rows, page_size=1000)
+            ensure_ledger(cur)
+            to_load, touched = changed_files(cur, paths, base_path, full_reload)
+    return [p for p, _ in to_load], [e for _, e in to_load] + touched
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description="Load raw Telegram partitions into raw.telegram_messages")
+    parser.add_argument(
+        "--path",
+        type=str,
+        default="data",
+        help="Base data directory (default: data)",
+    )
+    parser.add_argument(
+        "--mode",
+        choices=["copy", "upsert"],
+        default="copy",
+        help="copy: COPY into a staging table + one merge; upsert: in-memory execute_values (default: copy)",
+    )
+    parser.add_argument(
+        "--full-reload",
+        action="store_true",
+        help="Ignore raw.load_ledger and reload every partition",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="Processes that parse + COPY partitions in parallel (copy mode only, default: 1)",
+    )
+    parser.add_argument(
+        "--batch-size",
+        type=int,
+        default=DEFAULT_BATCH_SIZE,
+        help=f"Rows per COPY batch in parallel mode (default: {DEFAULT_BATCH_SIZE})",
+    )
+    parser.add_argument(
+        "--date",
+        nargs="+",
+        default=None,
+        help="Only load these partitions (YYYY-MM-DD); default: all",
+    )
+    args = parser.parse_args(argv)
+
+    db_params = get_db_params()
+    print("Using DB creds:", *db_params.values())
+
+    base_dir = Path(args.path) / "raw" / "telegram_messages"
+    if not list_partition_dirs(str(base_dir)):
+        raise RuntimeError(f"No partitions found under {base_dir}")
+
+    metrics = RunMetrics(
+        "load_raw_to_postgres", args.path, args.date[0] if args.date and len(args.date) == 1 else None
+    )
+    # round-trips of parallel-mode worker processes are not included
+    conn = psycopg2.connect(**db_params, cursor_factory=metrics.cursor_factory())
+    try:
+        with metrics.stage("plan") as st:
+            json_files, ledger_entries = plan_load(conn, args.path, full_reload=args.full_reload, dates=args.date)
+            st.add(rows=len(json_files))
+        if not json_files:
+            if ledger_entries:
+                with conn:
+                    with conn.cursor() as cur:
+                        record_files(cur, ledger_entries, TARGET_TABLE)
+            print("No new or changed partitions; nothing to load")
+            return
+        with metrics.stage("load") as st:
+            if args.mode == "upsert":
+                n = upsert_rows(conn, json_files, ledger_entries)
+            elif args.workers > 1:
+                n = parallel_copy_and_merge(
+                    conn, db_params, json_files, ledger_entries, args.workers, args.batch_size
+                )
+            else:
+                n = copy_and_merge(conn, json_files, ledger_entries)
+            st.add(rows=n)
+    finally:
+        conn.close()
+        metrics.write()
 
-    conn.close()
-    print(f"Loaded {len(rows)} rows from {len(json_files)} JSON files into raw.telegram_messages")
+    print(f"Loaded {n} rows from {len(json_files)} message files into raw.telegram_messages")
 
 
 if __name__ == "__main__":
@@ -1,61 +1,350 @@
 import os
 import csv
+import argparse
 from pathlib import Path
-from typing import List, Tuple
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
 
 from dotenv import load_dotenv
 import psycopg2
-from psycopg2.extras import execute_values
 
+from instrumentation import RunMetrics
+from load_ledger import (
+    LedgerEntry,
+    ensure_ledger,
+    fetch_ledger,
+    ledger_key,
+    lock_raw_writes,
+    plan_append,
+    prefix_hashes,
+    record_files,
+    unchanged_by_stat,
+)
+from pg_copy import copy_rows
 
-def main() -> None:
+TARGET_TABLE = "raw.yolo_detections"
+
+YOLO_COLUMNS = (
+    "message_id",
+    "channel_name",
+    "detected_objects",
+    "confidence_score",
+    "image_category",
+    "image_path",
+)
+
+OBJECT_COLUMNS = (
+    "message_id",
+    "channel_name",
+    "box_index",
+    "class_id",
+    "class_name",
+    "confidence",
+    "x1",
+    "y1",
+    "x2",
+    "y2",
+)
+
+# Ties a detection to its boxes in the staging tables: yolo_detect gives every
+# detection row an id and repeats it on each of its boxes. Staging only.
+DETECTION_ID = "detection_id"
+
+# load_seq keeps input order so the merge keeps the last row per message
+STAGE_DDL = """
+    CREATE TEMP TABLE IF NOT EXISTS stage_yolo_detections (
+        LIKE raw.yolo_detections INCLUDING DEFAULTS,
+        detection_id TEXT,
+        load_seq BIGSERIAL
+    ) ON COMMIT DELETE ROWS;
+"""
+
+MERGE_SQL = """
+    INSERT INTO raw.yolo_detections
+    (message_id, channel_name, detected_objects, confidence_score, image_category, image_path)
+    SELECT DISTINCT ON (channel_name, message_id)
+        message_id, channel_name, detected_objects, confidence_score, image_category, image_path
+    FROM stage_yolo_detections
+    ORDER BY channel_name, message_id, load_seq DESC
+    ON CONFLICT (channel_name, message_id) DO UPDATE SET
+        detected_objects = EXCLUDED.detected_objects,
+        confidence_score = EXCLUDED.confidence_score,
+        image_category = EXCLUDED.image_category,
+        image_path = EXCLUDED.image_path,
+        ingested_at = NOW()
+    -- leave unchanged rows alone so dbt's ingested_at filter only sees real updates
+    WHERE (raw.yolo_detections.detected_objects, raw.yolo_detections.confidence_score,
+           raw.yolo_detections.image_category, raw.yolo_detections.image_path)
+        IS DISTINCT FROM
+          (EXCLUDED.detected_objects, EXCLUDED.confidence_score,
+           EXCLUDED.image_category, EXCLUDED.image_path);
+"""
+
+OBJECTS_STAGE_DDL = """
+    CREATE TEMP TABLE IF NOT EXISTS stage_yolo_objects (
+        LIKE raw.yolo_objects INCLUDING DEFAULTS,
+        detection_id TEXT,
+        load_seq BIGSERIAL
+    ) ON COMMIT DELETE ROWS;
+"""
+
+# Every message in the detections stage gets its boxes replaced by those of
+# its last staged detection, so an image re-detected with fewer (or zero)
+# boxes loses the stale ones. Boxes of messages with no staged detection are
+# left out. Rows from before detection ids (NULL) match each other.
+OBJECTS_MERGE_SQL = """
+    DELETE FROM raw.yolo_objects o
+    USING (SELECT DISTINCT channel_name, message_id FROM stage_yolo_detections) s
+    WHERE o.channel_name = s.channel_name AND o.message_id = s.message_id;
+
+    INSERT INTO raw.yolo_objects
+    (message_id, channel_name, box_index, class_id, class_name, confidence, x1, y1, x2, y2)
+    SELECT DISTINCT ON (o.channel_name, o.message_id, o.box_index)
+        o.message_id, o.channel_name, o.box_index, o.class_id, o.class_name,
+        o.confidence, o.x1, o.y1, o.x2, o.y2
+    FROM stage_yolo_objects o
+    JOIN (
+        SELECT DISTINCT ON (channel_name, message_id) channel_name, message_id, detection_id
+        FROM stage_yolo_detections
+        ORDER BY channel_name, message_id, load_seq DESC
+    ) d ON d.channel_name = o.channel_name
+       AND d.message_id = o.message_id
+       AND d.detection_id IS NOT DISTINCT FROM o.detection_id
+    ORDER BY o.channel_name, o.message_id, o.box_index, o.load_seq DESC;
+"""
+
+
+def get_db_params() -> Dict[str, Any]:
     env_path = Path(__file__).resolve().parents[1] / ".env"
     load_dotenv(dotenv_path=env_path, override=True)
 
-    db_host = os.getenv("DB_HOST", "127.0.0.1")
-    db_port = int(os.getenv("DB_PORT", "5433"))
-    db_name = os.getenv("DB_NAME", "med_warehouse")
-    db_user = os.getenv("DB_USER", "med_user")
-    db_password = os.getenv("DB_PASSWORD", "med_password")
+    return {
+        "host": os.getenv("DB_HOST", "127.0.0.1"),
+        "port": int(os.getenv("DB_PORT", "5433")),
+        "dbname": os.getenv("DB_NAME", "med_warehouse"),
+        "user": os.getenv("DB_USER", "med_user"),
+        "password": os.getenv("DB_PASSWORD", "med_password"),
+    }
 
-    csv_path = Path("data/yolo_detections.csv")
-    if not csv_path.exists():
-        raise FileNotFoundError(f"Missing {csv_path}. Run python src/yolo_detect.py first.")
 
-    rows: List[Tuple] = []
-    with open(csv_path, "r", encoding="utf-8") as f:
-        reader = csv.DictReader(f)
-        for r in reader:
-            rows.append((
-                int(r["message_id"]),
-                str(r["channel_name"]).lower().strip(),
-                r.get("detected_objects") or "",
-                float(r["confidence_score"]) if r.get("confidence_score") else 0.0,
-                r.get("image_category") or "other",
-                r.get("image_path"),
-            ))
-
-    conn = psycopg2.connect(
-        host=db_host, port=db_port, dbname=db_name, user=db_user, password=db_password
+def detection_record(
+    message_id: Any,
+    channel_name: Any,
+    detected_objects: Any,
+    confidence_score: Any,
+    image_category: Any,
+    image_path: Any,
+    detection_id: Any = None,
+) -> Tuple:
+    return (
+        int(message_id),
+        str(channel_name).lower().strip(),
+        detected_objects or "",
+        float(confidence_score) if confidence_score not in (None, "") else 0.0,
+        image_category or "other",
+        image_path,
+        detection_id or None,
     )
 
-    sql = """
-        INSERT INTO raw.yolo_detections
-        (message_id, channel_name, detected_objects, confidence_score, image_category, image_path)
-        VALUES %s
-        ON CONFLICT (channel_name, message_id) DO UPDATE SET
-            detected_objects = EXCLUDED.detected_objects,
-            confidence_score = EXCLUDED.confidence_score,
-            image_category = EXCLUDED.image_category,
-            image_path = EXCLUDED.image_path;
+
+def object_record(
+    message_id: Any,
+    channel_name: Any,
+    box_index: Any,
+    class_id: Any,
+    class_name: Any,
+    confidence: Any,
+    x1: Any,
+    y1: Any,
+    x2: Any,
+    y2: Any,
+    detection_id: Any = None,
+) -> Tuple:
+    return (
+        int(message_id),
+        str(channel_name).lower().strip(),
+        int(box_index),
+        int(class_id),
+        str(class_name),
+        float(confidence),
+        float(x1),
+        float(y1),
+        float(x2),
+        float(y2),
+        detection_id or None,
+    )
+
+
+def iter_csv_rows(csv_path: Path, start: int = 0, end: Optional[int] = None) -> Iterator[Dict[str, str]]:
+    """
+    Rows of `csv_path` between byte offsets `start` and `end` (both on line
+    boundaries); the header is always read from the top of the file.
+    """
+    with open(csv_path, "rb") as f:
+        header = next(csv.reader([f.readline().decode("utf-8")]), [])
+        if start > f.tell():
+            f.seek(start)
+        stop = os.path.getsize(csv_path) if end is None else end
+
+        def lines() -> Iterator[str]:
+            while f.tell() < stop:
+                line = f.readline()
+                if not line:
+                    return
+                yield line.decode("utf-8")
+
+        for r in csv.reader(lines()):
+            yield dict(zip(header, r))
+
+
+def iter_csv_records(csv_path: Path, start: int = 0, end: Optional[int] = None) -> Iterator[Tuple]:
+    for r in iter_csv_rows(csv_path, start, end):
+        yield detection_record(*(r.get(c) for c in YOLO_COLUMNS + (DETECTION_ID,)))
+
+
+def iter_object_csv_records(csv_path: Path, start: int = 0, end: Optional[int] = None) -> Iterator[Tuple]:
+    for r in iter_csv_rows(csv_path, start, end):
+        yield object_record(*(r.get(c) for c in OBJECT_COLUMNS + (DETECTION_ID,)))
+
+
+def objects_end(
+    objects_path: Path, start: int, end: int, csv_path: Path, det_start: int, det_end: int
+) -> int:
+    """
+    Where to stop loading yolo_objects.csv: before the first box in
+    [start, end) whose detection is not in the detections being loaded.
+    yolo_detect writes boxes before their detection row, so a load that
+    races it can see boxes whose detection is not written yet; those are
+    left for the next load instead of being skipped for good.
     """
+    ids = set()
+    for r in iter_csv_rows(csv_path, det_start, det_end):
+        # rows from before detection ids are matched on the message
+        ids.add(r.get(DETECTION_ID) or (r.get("channel_name"), r.get("message_id")))
+    with open(objects_path, "rb") as f:
+        header = next(csv.reader([f.readline().decode("utf-8")]), [])
+        if start > f.tell():
+            f.seek(start)
+        pos = f.tell()
+        while pos < end:
+            line = f.readline()
+            if not line:
+                break
+            r = dict(zip(header, next(csv.reader([line.decode("utf-8")]), [])))
+            if (r.get(DETECTION_ID) or (r.get("channel_name"), r.get("message_id"))) not in ids:
+                return pos
+            pos += len(line)
+    return end
+
+
+def copy_and_merge_detections(
+    cur,
+    records: Iterable[Tuple],
+    objects: Optional[Iterable[Tuple]] = None,
+) -> int:
+    """
+    COPY detection records into a temp staging table and merge them into
+    raw.yolo_detections. Duplicate messages keep the last record, which is
+    what yolo_detect's append-only CSV relies on. When `objects` is given,
+    the per-box rows for those messages in raw.yolo_objects are replaced by
+    the boxes carrying the detection_id of that last record.
+    Runs inside the caller's transaction and must open it (see
+    load_ledger.RAW_WRITE_LOCK).
+    """
+    lock_raw_writes(cur)
+    cur.execute(STAGE_DDL)
+    copy_rows(cur, "stage_yolo_detections", YOLO_COLUMNS + (DETECTION_ID,), records)
+    cur.execute(MERGE_SQL)
+    merged = cur.rowcount
+    if objects is not None:
+        cur.execute(OBJECTS_STAGE_DDL)
+        copy_rows(cur, "stage_yolo_objects", OBJECT_COLUMNS + (DETECTION_ID,), objects)
+        cur.execute(OBJECTS_MERGE_SQL)
+    return merged
+
+
+def truncated_entry(path: Path, entry: LedgerEntry, end: int) -> LedgerEntry:
+    """`entry` covering only the first `end` bytes of `path`."""
+    return entry[0], end, entry[2], prefix_hashes(str(path), end, end)[1]
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description="Load YOLO detections CSV into raw.yolo_detections")
+    parser.add_argument(
+        "--path",
+        type=str,
+        default="data",
+        help="Base data directory (default: data)",
+    )
+    parser.add_argument(
+        "--full-reload",
+        action="store_true",
+        help="Reload the whole CSVs instead of only the rows appended since the last load",
+    )
+    args = parser.parse_args(argv)
+
+    csv_path = Path(args.path) / "yolo_detections.csv"
+    objects_path = Path(args.path) / "yolo_objects.csv"
+    if not csv_path.exists():
+        raise FileNotFoundError(f"Missing {csv_path}. Run python src/yolo_detect.py first.")
+    paths = [str(csv_path)] + ([str(objects_path)] if objects_path.exists() else [])
+
+    metrics = RunMetrics("load_yolo_to_postgres", args.path)
+    conn = psycopg2.connect(**get_db_params(), cursor_factory=metrics.cursor_factory())
+
+    with metrics.stage("plan"):
+        with conn:
+            with conn.cursor() as cur:
+                ensure_ledger(cur)
+                known = {} if args.full_reload else fetch_ledger(
+                    cur, [ledger_key(p, args.path) for p in paths]
+                )
+                prev = {p: known.get(ledger_key(p, args.path)) for p in paths}
+                if all(unchanged_by_stat(p, prev[p]) for p in paths):
+                    plans = None
+                else:
+                    # yolo_detect appends to both CSVs: load only the new tail of each
+                    plans = {p: plan_append(p, args.path, prev[p], args.full_reload) for p in paths}
+                    if any(start == 0 and prev[p] is not None for p, (start, _) in plans.items()):
+                        # a file was rewritten: reload both, boxes are replaced per detection
+                        plans = {p: plan_append(p, args.path, None) for p in paths}
+                    if str(objects_path) in plans:
+                        # planned after the detections, so it can only run ahead of them
+                        (det_start, det_entry), (obj_start, obj_entry) = (
+                            plans[str(csv_path)], plans[str(objects_path)]
+                        )
+                        cut = objects_end(
+                            objects_path, obj_start, obj_entry[1], csv_path, det_start, det_entry[1]
+                        )
+                        if cut < obj_entry[1]:
+                            plans[str(objects_path)] = (obj_start, truncated_entry(objects_path, obj_entry, cut))
+                    if all(start == entry[1] for start, entry in plans.values()):
+                        record_files(cur, [entry for _, entry in plans.values()], TARGET_TABLE)
+                        plans = None
+    if plans is None:
+        conn.close()
+        metrics.write()
+        print(f"{csv_path} and {objects_path} have no new rows since last load; nothing to do")
+        return
 
-    with conn:
-        with conn.cursor() as cur:
-            execute_values(cur, sql, rows, page_size=1000)
+    det_start, det_entry = plans[str(csv_path)]
+    with metrics.stage("load") as st:
+        with conn:
+            with conn.cursor() as cur:
+                objects = None
+                if str(objects_path) in plans:
+                    obj_start, obj_entry = plans[str(objects_path)]
+                    objects = iter_object_csv_records(objects_path, obj_start, obj_entry[1])
+                n = copy_and_merge_detections(
+                    cur,
+                    iter_csv_records(csv_path, det_start, det_entry[1]),
+                    objects,
+                )
+                record_files(cur, [entry for _, entry in plans.values()], TARGET_TABLE)
+        st.add(rows=n)
 
     conn.close()
-    print(f"Loaded {len(rows)} rows into raw.yolo_detections")
+    metrics.write()
+    print(f"Loaded {n} rows into raw.yolo_detections (boxes into raw.yolo_objects)")
 
 
 if __name__ == "__main__":
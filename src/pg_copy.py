@@ -0,0 +1,65 @@
+import io
+from datetime import datetime
+from typing import Any, Iterable, Iterator, Optional, Sequence
+
+# COPY ... (FORMAT csv, NULL '\N'): only an unquoted \N is NULL. Every
+# non-NULL text value is written quoted, so a message that is literally
+# "\N" (or empty) stays a string.
+COPY_NULL = "\\N"
+
+
+def _csv_field(value: Any) -> str:
+    if value is None:
+        return COPY_NULL
+    if isinstance(value, bool):
+        return "t" if value else "f"
+    if isinstance(value, (int, float)):
+        return str(value)
+    if isinstance(value, datetime):
+        value = value.isoformat()
+    return '"' + str(value).replace('"', '""') + '"'
+
+
+def _csv_line(row: Sequence[Any]) -> str:
+    return ",".join(_csv_field(v) for v in row) + "\n"
+
+
+class CsvRowStream(io.TextIOBase):
+    """
+    File-like object that renders rows to CSV lazily as COPY reads from it,
+    so only one buffer's worth of rows is ever held in memory.
+    """
+
+    def __init__(self, rows: Iterable[Sequence[Any]]) -> None:
+        self._rows: Iterator[Sequence[Any]] = iter(rows)
+        self._pending = ""
+        self.count = 0
+
+    def readable(self) -> bool:
+        return True
+
+    def read(self, size: Optional[int] = -1) -> str:
+        if size is None or size < 0:
+            size = 1 << 30
+        while len(self._pending) < size:
+            row = next(self._rows, None)
+            if row is None:
+                break
+            self._pending += _csv_line(row)
+            self.count += 1
+        out, self._pending = self._pending[:size], self._pending[size:]
+        return out
+
+
+def copy_rows(cur, table: str, columns: Sequence[str], rows: Iterable[Sequence[Any]]) -> int:
+    """
+    Stream rows into `table` with COPY FROM STDIN (CSV). Returns the number
+    of rows sent.
+    """
+    stream = CsvRowStream(rows)
+    sql = (
+        f"COPY {table} ({', '.join(columns)}) FROM STDIN "
+        f"WITH (FORMAT csv, NULL '{COPY_NULL}')"
+    )
+    cur.copy_expert(sql, stream, size=64 * 1024)
+    return stream.count
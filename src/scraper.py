@@ -4,8 +4,8 @@ import json
 import time
 import asyncio
 import argparse
-from datetime import datetime, timezone
-from typing import Any, Dict, List, Optional
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, List, Optional, Set, Tuple
 
 from dotenv import load_dotenv
 from loguru import logger
@@ -13,7 +13,20 @@ from telethon import TelegramClient
 from telethon.errors import FloodWaitError
 from telethon.tl.types import MessageMediaPhoto
 
-from datalake import write_channel_messages_json, write_manifest
+from datalake import (
+    ChannelMessagesParquetWriter,
+    ChannelMessagesWriter,
+    list_channel_message_files,
+    telegram_messages_partition_dir,
+    read_channel_checkpoint,
+    write_channel_checkpoint,
+    write_manifest,
+)
+from instrumentation import RunMetrics
+
+# A message whose photo failed to download holds the checkpoint back (so the
+# next run retries it) for this many runs, then it is given up on.
+MAX_DOWNLOAD_ATTEMPTS = 3
 
 
 def setup_logging(date_str: str) -> None:
@@ -27,6 +40,94 @@ def setup_logging(date_str: str) -> None:
     )
 
 
+class TokenBucket:
+    """
+    Shared rate limiter for all channels scraped on one TelegramClient.
+    `rate` tokens are added per second up to `capacity`; a FloodWaitError
+    pauses the whole bucket instead of a single channel.
+    """
+
+    def __init__(self, rate: float, capacity: Optional[float] = None) -> None:
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(rate, 1.0)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = asyncio.Lock()
+
+    def _refill(self, now: float) -> None:
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    async def acquire(self, tokens: float = 1.0) -> None:
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self._paused_until:
+                    await asyncio.sleep(self._paused_until - now)
+                    continue
+                if self.rate <= 0:
+                    return
+                self._refill(now)
+                if self._tokens >= tokens:
+                    self._tokens -= tokens
+                    return
+                await asyncio.sleep((tokens - self._tokens) / self.rate)
+
+    def pause(self, seconds: float) -> None:
+        now = time.monotonic()
+        self._paused_until = max(self._paused_until, now + seconds)
+        self._tokens = 0.0
+        self._updated = now
+
+
+def flood_wait_seconds(e: FloodWaitError) -> int:
+    return max(int(getattr(e, "seconds", 1) or 1), 1)
+
+
+async def download_worker(
+    client: TelegramClient,
+    queue: "asyncio.Queue[Optional[Tuple[Any, Dict[str, Any], str]]]",
+    rate_limiter: TokenBucket,
+    channel_name: str,
+    writers: List[Any],
+    failed: Set[int],
+) -> None:
+    """
+    Pull (media, row, target_path) jobs off the queue until a None sentinel.
+    Downloads are paced by `rate_limiter`, the downloads' own bucket, so
+    they do not compete with message iteration for its budget.
+    The row's image_path is set only once the file is on disk; failures are
+    recorded on the row as image_error and their ids added to `failed`. The
+    row is written when the download attempt finishes.
+    """
+    while True:
+        job = await queue.get()
+        try:
+            if job is None:
+                return
+            media, row, image_path = job
+            while True:
+                await rate_limiter.acquire()
+                try:
+                    await client.download_media(media, image_path)
+                    row["image_path"] = image_path
+                    break
+                except FloodWaitError as e:
+                    wait_seconds = flood_wait_seconds(e)
+                    logger.warning(f"FloodWaitError download channel={channel_name} sleep={wait_seconds}s")
+                    rate_limiter.pause(wait_seconds)
+                except Exception as e:
+                    logger.warning(f"Image download failed message_id={row['message_id']}: {e}")
+                    row["image_error"] = str(e)
+                    failed.add(row["message_id"])
+                    break
+            for writer in writers:
+                writer.write(row)
+        finally:
+            queue.task_done()
+
+
 def normalize_channel(channel: str) -> str:
     # Accept "https://t.me/xyz", "@xyz", or "xyz"
     channel = channel.strip()
@@ -43,65 +144,200 @@ async def scrape_channel(
     base_path: str,
     date_str: str,
     limit: int,
-    message_delay: float,
+    rate_limiter: TokenBucket,
+    download_limiter: Optional[TokenBucket] = None,
+    download_workers: int = 4,
+    download_queue_size: int = 100,
+    incremental: bool = True,
+    lookback_hours: float = 0.0,
+    compression: str = "none",
+    parquet: bool = False,
 ) -> int:
     """
     Scrape messages for one channel and store:
-      - JSON: data/raw/telegram_messages/YYYY-MM-DD/<channel>.json
+      - NDJSON: data/raw/telegram_messages/YYYY-MM-DD/<channel>.ndjson[.gz|.zst]
       - Images: data/raw/images/<channel>/<message_id>.jpg
+
+    With a channel checkpoint (data/raw/checkpoints/<channel>.json) messages
+    are read oldest-first from it, so when more than `limit` arrived since
+    the last run the rest are picked up next time. Without one the newest
+    `limit` messages are read. The checkpoint only advances to the last fully
+    processed message: a photo that failed to download keeps it just before
+    that message, for up to MAX_DOWNLOAD_ATTEMPTS runs.
+
+    On FloodWaitError the shared rate limiter is paused and iteration resumes
+    after the last message already read, so the channel is not restarted.
+
+    Photos are handed to a bounded queue drained by `download_workers`
+    tasks, so message iteration only blocks when the queue is full.
+    Downloads are paced by `download_limiter` (unlimited when None) rather
+    than the message budget.
+
+    Without `incremental` the checkpoint is neither read nor written.
+    `lookback_hours` spends whatever budget the new messages leave on
+    re-reading the last N hours before the checkpoint, to refresh
+    views/forwards. Images already on disk are never downloaded again.
+
+    Rows are streamed to the partition file as soon as they are complete,
+    so memory does not grow with the number of messages. With `parquet`, a
+    <channel>.parquet partition is written alongside the NDJSON one.
     """
     channel_name = normalize_channel(channel_username)
-    logger.info(f"Scraping channel={channel_name} limit={limit}")
 
-    entity = await client.get_entity(channel_username if channel_username.startswith("@") else f"@{channel_name}")
+    checkpoint: Dict[str, Any] = {}
+    if incremental:
+        checkpoint = read_channel_checkpoint(base_path, channel_name)
+    high_water = int(checkpoint.get("last_message_id") or 0)
+    prev_failures = {int(k): int(v) for k, v in (checkpoint.get("download_failures") or {}).items()}
+
+    logger.info(
+        f"Scraping channel={channel_name} limit={limit} since_message_id={high_water} "
+        f"lookback_hours={lookback_hours}"
+    )
+
+    while True:
+        await rate_limiter.acquire()
+        try:
+            entity = await client.get_entity(channel_username if channel_username.startswith("@") else f"@{channel_name}")
+            break
+        except FloodWaitError as e:
+            wait_seconds = flood_wait_seconds(e)
+            logger.warning(f"FloodWaitError channel={channel_name} sleep={wait_seconds}s")
+            rate_limiter.pause(wait_seconds)
 
     channel_image_dir = os.path.join(base_path, "raw", "images", channel_name)
     os.makedirs(channel_image_dir, exist_ok=True)
 
-    messages: List[Dict[str, Any]] = []
+    download_queue: "asyncio.Queue[Optional[Tuple[Any, Dict[str, Any], str]]]" = asyncio.Queue(
+        maxsize=max(download_queue_size, 1)
+    )
+    writers: List[Any] = [
+        ChannelMessagesWriter(
+            base_path=base_path,
+            date_str=date_str,
+            channel_name=channel_name,
+            compression=compression,
+        )
+    ]
+    if parquet:
+        writers.append(
+            ChannelMessagesParquetWriter(base_path=base_path, date_str=date_str, channel_name=channel_name)
+        )
+    failed: Set[int] = set()
+    if download_limiter is None:
+        download_limiter = TokenBucket(rate=0.0)
+    workers = [
+        asyncio.create_task(download_worker(client, download_queue, download_limiter, channel_name, writers, failed))
+        for _ in range(max(download_workers, 1))
+    ]
+
     count = 0
+    max_id = high_water
 
-    async for msg in client.iter_messages(entity, limit=limit):
+    async def handle(msg: Any) -> None:
+        nonlocal count, max_id
+        max_id = max(max_id, msg.id)
+        await rate_limiter.acquire()
         try:
             has_media = msg.media is not None
-            image_path: Optional[str] = None
-
-            # download only photos
-            if has_media and isinstance(msg.media, MessageMediaPhoto):
-                filename = f"{msg.id}.jpg"
-                image_path = os.path.join(channel_image_dir, filename)
-                try:
-                    await client.download_media(msg.media, image_path)
-                except Exception as e:
-                    logger.warning(f"Image download failed message_id={msg.id}: {e}")
-                    image_path = None
 
+            # image_path is filled in by a download worker
             row = {
                 "message_id": msg.id,
                 "channel_name": channel_name,
                 "message_date": msg.date.isoformat() if msg.date else None,
                 "message_text": msg.message or "",
                 "has_media": has_media,
-                "image_path": image_path,
+                "image_path": None,
                 "views": msg.views or 0,
                 "forwards": msg.forwards or 0,
             }
-            messages.append(row)
             count += 1
 
-            if message_delay > 0:
-                await asyncio.sleep(message_delay)
+            # download only photos
+            if has_media and isinstance(msg.media, MessageMediaPhoto):
+                image_path = os.path.join(channel_image_dir, f"{msg.id}.jpg")
+                if os.path.exists(image_path) and os.path.getsize(image_path) > 0:
+                    row["image_path"] = image_path
+                else:
+                    await download_queue.put((msg.media, row, image_path))
+                    return
+
+            for writer in writers:
+                writer.write(row)
 
         except Exception as e:
             logger.warning(f"Failed to parse message in {channel_name}: {e}")
+            failed.add(msg.id)
 
-    out_json = write_channel_messages_json(
-        base_path=base_path,
-        date_str=date_str,
-        channel_name=channel_name,
-        messages=messages,
-    )
-    logger.info(f"Saved channel JSON: {out_json} messages={count}")
+    async def read_pass(budget: int, reverse: bool, cutoff: Optional[datetime] = None, **kwargs: Any) -> int:
+        """
+        Read up to `budget` messages (oldest-first with `reverse`), stopping at
+        the first one older than `cutoff`. After a flood wait iteration resumes
+        past the last message read. Returns how many were read.
+        """
+        seen = 0
+        last_id = 0
+        while seen < budget:
+            try:
+                resume = {"offset_id": last_id} if last_id else {}
+                async for msg in client.iter_messages(
+                    entity, limit=budget - seen, reverse=reverse, **kwargs, **resume
+                ):
+                    if cutoff is not None and msg.date and msg.date < cutoff:
+                        return seen
+                    seen += 1
+                    last_id = msg.id
+                    await handle(msg)
+                return seen
+            except FloodWaitError as e:
+                wait_seconds = flood_wait_seconds(e)
+                logger.warning(
+                    f"FloodWaitError channel={channel_name} sleep={wait_seconds}s resume_after={last_id}"
+                )
+                rate_limiter.pause(wait_seconds)
+        return seen
+
+    try:
+        if high_water:
+            # new messages first, oldest-first from the checkpoint
+            seen = await read_pass(limit, reverse=True, min_id=high_water)
+            if lookback_hours > 0 and seen < limit:
+                # whatever budget is left refreshes the lookback window, newest-first
+                cutoff = datetime.now(timezone.utc) - timedelta(hours=lookback_hours)
+                await read_pass(limit - seen, reverse=False, cutoff=cutoff, max_id=high_water + 1)
+        else:
+            # no checkpoint (or --full-refresh): the newest `limit` messages
+            await read_pass(limit, reverse=False)
+
+        for _ in workers:
+            await download_queue.put(None)
+        await asyncio.gather(*workers)
+    except BaseException:
+        for w in workers:
+            w.cancel()
+        for writer in writers:
+            writer.abort()
+        raise
+
+    for writer in writers:
+        out_path = writer.close()
+        logger.info(f"Saved channel partition: {out_path} messages={count}")
+
+    if not incremental:
+        return count
+    # only failures past the old checkpoint hold it back; lookback failures
+    # are retried by the next lookback since their image is still missing
+    failures = {mid: prev_failures.get(mid, 0) + 1 for mid in failed if mid > high_water}
+    for mid, attempts in failures.items():
+        if attempts >= MAX_DOWNLOAD_ATTEMPTS:
+            logger.warning(f"Giving up on message_id={mid} channel={channel_name} after {attempts} attempts")
+    retry = {mid: n for mid, n in failures.items() if n < MAX_DOWNLOAD_ATTEMPTS}
+    # messages after the first retryable failure are read again next run;
+    # the loaders merge on (channel_name, message_id), so that is harmless
+    new_high_water = max(high_water, min(retry) - 1 if retry else max_id)
+    if new_high_water != high_water or retry != prev_failures:
+        write_channel_checkpoint(base_path, channel_name, new_high_water, download_failures=retry)
     return count
 
 
@@ -111,7 +347,20 @@ async def run(
     limit: int,
     date_str: str,
     message_delay: float,
-) -> None:
+    concurrency: int = 1,
+    rate: Optional[float] = None,
+    download_rate: float = 0.0,
+    download_workers: int = 4,
+    download_queue_size: int = 100,
+    incremental: bool = True,
+    lookback_hours: float = 0.0,
+    compression: str = "none",
+    parquet: bool = False,
+) -> Dict[str, int]:
+    """
+    Scrape `channels` into the `date_str` partition with one client and one
+    shared rate budget, and return message counts per channel.
+    """
     from pathlib import Path
     ENV_PATH = Path(__file__).resolve().parents[1] / ".env"
     load_dotenv(dotenv_path=ENV_PATH)
@@ -128,46 +377,78 @@ async def run(
 
     client = TelegramClient(session_name, int(api_id), api_hash)
 
+    # One budget shared by every channel; --message-delay maps to the same
+    # messages/second rate the old per-message sleep produced.
+    if rate is None:
+        rate = 1.0 / message_delay if message_delay > 0 else 0.0
+    rate_limiter = TokenBucket(rate=rate)
+    # photo downloads get their own budget (0 = bounded only by the workers)
+    download_limiter = TokenBucket(rate=download_rate)
+    semaphore = asyncio.Semaphore(max(concurrency, 1))
+
     channel_counts: Dict[str, int] = {}
+    metrics = RunMetrics("scraper", base_path, date_str)
+    partition_dir = telegram_messages_partition_dir(base_path, date_str)
 
-    async with client:
-        for ch in channels:
-            ch_norm = normalize_channel(ch)
-            try:
-                n = await scrape_channel(
-                    client=client,
-                    channel_username=ch,
-                    base_path=base_path,
-                    date_str=date_str,
-                    limit=limit,
-                    message_delay=message_delay,
-                )
-                channel_counts[ch_norm] = n
-            except FloodWaitError as e:
-                wait_seconds = max(int(getattr(e, "seconds", 1) or 1), 1)
-                logger.warning(f"FloodWaitError channel={ch_norm} sleep={wait_seconds}s")
-                await asyncio.sleep(wait_seconds)
-                # retry once after sleeping
-                n = await scrape_channel(
-                    client=client,
-                    channel_username=ch,
-                    base_path=base_path,
-                    date_str=date_str,
-                    limit=limit,
-                    message_delay=message_delay,
+    async def scrape_one(ch: str) -> None:
+        ch_norm = normalize_channel(ch)
+        async with semaphore:
+            with metrics.stage(f"scrape:{ch_norm}") as st:
+                try:
+                    channel_counts[ch_norm] = await scrape_channel(
+                        client=client,
+                        channel_username=ch,
+                        base_path=base_path,
+                        date_str=date_str,
+                        limit=limit,
+                        rate_limiter=rate_limiter,
+                        download_limiter=download_limiter,
+                        download_workers=download_workers,
+                        download_queue_size=download_queue_size,
+                        incremental=incremental,
+                        lookback_hours=lookback_hours,
+                        compression=compression,
+                        parquet=parquet,
+                    )
+                except Exception as e:
+                    logger.error(f"Channel failed channel={ch_norm}: {e}")
+                    channel_counts[ch_norm] = 0
+                st.add(
+                    rows=channel_counts[ch_norm],
+                    nbytes=sum(
+                        os.path.getsize(f) for f in list_channel_message_files(partition_dir)
+                        if os.path.basename(f).split(".")[0] == ch_norm
+                    ),
                 )
-                channel_counts[ch_norm] = n
-            except Exception as e:
-                logger.error(f"Channel failed channel={ch_norm}: {e}")
-                channel_counts[ch_norm] = 0
+
+    logger.info(
+        f"Scraping {len(channels)} channels concurrency={concurrency} rate={rate:.2f}/s "
+        f"download_rate={download_rate:.2f}/s"
+    )
+
+    try:
+        async with client:
+            await asyncio.gather(*(scrape_one(ch) for ch in channels))
+    finally:
+        metrics.write()
 
     write_manifest(
         base_path=base_path,
         date_str=date_str,
         channel_message_counts=channel_counts,
-        extra={"channels_input": channels, "limit": limit},
+        extra={
+            "channels_input": channels,
+            "limit": limit,
+            "concurrency": concurrency,
+            "incremental": incremental,
+            "lookback_hours": lookback_hours,
+            "compression": compression,
+            "format": "ndjson",
+            "parquet": parquet,
+        },
     )
     logger.info(f"Done. Total messages={sum(channel_counts.values())}")
+    return channel_counts
 
 
 if __name__ == "__main__":
@@ -202,6 +483,59 @@ if __name__ == "__main__":
         default=0.5,
         help="Delay between messages to reduce rate limits (seconds). Default=0.5",
     )
+    parser.add_argument(
+        "--concurrency",
+        type=int,
+        default=1,
+        help="Number of channels scraped concurrently on one client (default: 1)",
+    )
+    parser.add_argument(
+        "--rate",
+        type=float,
+        default=None,
+        help="Shared messages/second budget across all channels. Default=1/message-delay",
+    )
+    parser.add_argument(
+        "--download-rate",
+        type=float,
+        default=0.0,
+        help="Shared photo downloads/second budget, separate from --rate. Default=0 (unlimited; "
+             "--download-workers bounds concurrency)",
+    )
+    parser.add_argument(
+        "--download-workers",
+        type=int,
+        default=4,
+        help="Concurrent photo downloads per channel (default: 4)",
+    )
+    parser.add_argument(
+        "--download-queue-size",
+        type=int,
+        default=100,
+        help="Max photos waiting for download per channel before iteration blocks (default: 100)",
+    )
+    parser.add_argument(
+        "--full-refresh",
+        action="store_true",
+        help="Ignore per-channel checkpoints and scrape from the newest message",
+    )
+    parser.add_argument(
+        "--lookback-hours",
+        type=float,
+        default=0.0,
+        help="Re-read messages from the last N hours to refresh views/forwards (default: 0)",
+    )
+    parser.add_argument(
+        "--compression",
+        choices=["none", "gzip", "zstd"],
+        default="none",
+        help="Compression for channel NDJSON partitions (default: none)",
+    )
+    parser.add_argument(
+        "--parquet",
+        action="store_true",
+        help="Also write <channel>.parquet partitions (requires pyarrow)",
+    )
 
     args = parser.parse_args()
 
@@ -212,5 +546,14 @@ if __name__ == "__main__":
             limit=args.limit,
             date_str=args.date,
             message_delay=args.message_delay,
+            concurrency=args.concurrency,
+            rate=args.rate,
+            download_rate=args.download_rate,
+            download_workers=args.download_workers,
+            download_queue_size=args.download_queue_size,
+            incremental=not args.full_refresh,
+            lookback_hours=args.lookback_hours,
+            compression=args.compression,
+            parquet=args.parquet,
         )
     )
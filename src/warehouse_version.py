@@ -0,0 +1,57 @@
+import os
+from pathlib import Path
+from typing import Any, Dict
+
+from dotenv import load_dotenv
+import psycopg2
+
+# Single-row table the API polls to invalidate its response cache; the
+# pipeline bumps it after every dbt run.
+VERSION_DDL = """
+    CREATE SCHEMA IF NOT EXISTS analytics;
+    CREATE TABLE IF NOT EXISTS analytics.warehouse_version (
+        id          INT PRIMARY KEY DEFAULT 1 CHECK (id = 1),
+        version     BIGINT NOT NULL,
+        updated_at  TIMESTAMPTZ NOT NULL DEFAULT NOW()
+    );
+"""
+
+BUMP_SQL = """
+    INSERT INTO analytics.warehouse_version (id, version) VALUES (1, 1)
+    ON CONFLICT (id) DO UPDATE SET
+        version = analytics.warehouse_version.version + 1,
+        updated_at = NOW()
+    RETURNING version;
+"""
+
+
+def get_db_params() -> Dict[str, Any]:
+    env_path = Path(__file__).resolve().parents[1] / ".env"
+    load_dotenv(dotenv_path=env_path, override=True)
+
+    return {
+        "host": os.getenv("DB_HOST", "127.0.0.1"),
+        "port": int(os.getenv("DB_PORT", "5433")),
+        "dbname": os.getenv("DB_NAME", "med_warehouse"),
+        "user": os.getenv("DB_USER", "med_user"),
+        "password": os.getenv("DB_PASSWORD", "med_password"),
+    }
+
+
+def bump_warehouse_version(cur) -> int:
+    cur.execute(VERSION_DDL)
+    cur.execute(BUMP_SQL)
+    return cur.fetchone()[0]
+
+
+def main() -> None:
+    conn = psycopg2.connect(**get_db_params())
+    with conn:
+        with conn.cursor() as cur:
+            version = bump_warehouse_version(cur)
+    conn.close()
+    print(f"Warehouse version is now {version}")
+
+
+if __name__ == "__main__":
+    main()
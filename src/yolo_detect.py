@@ -1,11 +1,67 @@
 from pathlib import Path
+import os
 import csv
+import json
+import time
+import uuid
+import argparse
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from collections import deque
+from typing import Any, Callable, Deque, Dict, Iterator, List, Optional, Sequence, Tuple
+
+import cv2
+import psycopg2
 from ultralytics import YOLO
 
+from datalake import iter_channel_messages, list_channel_message_files, telegram_messages_partition_dir
+from instrumentation import RunMetrics
+from detection_cache import DEFAULT_CACHE_PATH, Detection, DetectionCache, model_version
+from load_yolo_to_postgres import copy_and_merge_detections, detection_record, get_db_params, object_record
+
 IMAGE_DIR = Path("data/raw/images")
 OUTPUT_CSV = Path("data/yolo_detections.csv")
+OBJECTS_CSV = Path("data/yolo_objects.csv")
+CSV_HEADER = [
+    "message_id",
+    "channel_name",
+    "detected_objects",
+    "confidence_score",
+    "image_category",
+    "image_path",
+    "detection_id",
+]
+OBJECTS_CSV_HEADER = [
+    "message_id",
+    "channel_name",
+    "box_index",
+    "class_id",
+    "class_name",
+    "confidence",
+    "x1",
+    "y1",
+    "x2",
+    "y2",
+    "detection_id",
+]
+
+# Detection rows are the first six CSV_HEADER columns followed by the list of boxes:
+# [class_id, class_name, confidence, x1, y1, x2, y2] per box.
+BOXES = 6
+
+DEFAULT_MODEL = "yolov8n.pt"
+PROGRESS_EVERY = 50
+# images per process-pool task, in inference batches
+CHUNK_BATCHES = 8
 
-MODEL = YOLO("yolov8n.pt")
+# loaded lazily so each worker process builds its own copy
+_MODEL: Optional[YOLO] = None
+
+
+def load_model(weights: str = DEFAULT_MODEL) -> YOLO:
+    global _MODEL
+    if _MODEL is None:
+        _MODEL = YOLO(weights)
+    return _MODEL
 
 
 def classify_image(detected: set[str]) -> str:
@@ -24,55 +80,442 @@ def classify_image(detected: set[str]) -> str:
     return "other"
 
 
-def main() -> None:
-    rows = []
-    image_paths = list(IMAGE_DIR.rglob("*.jpg"))
+def read_image(img_path: Path) -> Tuple[Path, Any]:
+    # cv2 returns None for unreadable/corrupt files
+    return img_path, cv2.imread(str(img_path))
+
+
+def iter_decoded_batches(
+    image_paths: Sequence[Path],
+    batch_size: int,
+    prefetch: int,
+    threads: int,
+) -> Iterator[List[Tuple[Path, Any]]]:
+    """
+    Decode images on a thread pool, keeping up to `prefetch` batches in
+    flight so decoding overlaps with inference on the current batch.
+    """
+    window = max(batch_size * max(prefetch, 1), batch_size)
+    with ThreadPoolExecutor(max_workers=max(threads, 1)) as pool:
+        pending: Deque[Future] = deque()
+        paths = iter(image_paths)
+
+        def fill() -> None:
+            while len(pending) < window:
+                p = next(paths, None)
+                if p is None:
+                    return
+                pending.append(pool.submit(read_image, p))
+
+        fill()
+        while pending:
+            batch = [pending.popleft().result() for _ in range(min(batch_size, len(pending)))]
+            fill()
+            yield batch
+
+
+def extract_detections(result: Any, names: Dict[int, str]) -> Tuple[set[str], float, List[List[Any]]]:
+    """
+    Vectorized box extraction: unique class ids and max confidence are
+    computed on the tensors instead of iterating over result.boxes, and the
+    per-box data comes out of boxes.data ([x1, y1, x2, y2, conf, cls]) in a
+    single tolist() call.
+    """
+    boxes = result.boxes
+    if boxes is None or len(boxes) == 0:
+        return set(), 0.0, []
+    class_ids = boxes.cls.int().unique().tolist()
+    max_conf = float(boxes.conf.max())
+    objects = [
+        [int(c), names[int(c)], round(conf, 4), round(x1, 1), round(y1, 1), round(x2, 1), round(y2, 1)]
+        for x1, y1, x2, y2, conf, c in boxes.data[:, :6].tolist()
+    ]
+    return {names[c] for c in class_ids}, max_conf, objects
+
+
+def image_key(img_path: Path) -> str:
+    return str(img_path).replace("\\", "/")
+
+
+def detection_row(
+    img_path: Path, detected_classes: set[str], max_conf: float, objects: List[List[Any]]
+) -> List[Any]:
+    return [
+        img_path.stem,
+        img_path.parent.name,
+        ",".join(sorted(detected_classes)),
+        round(max_conf, 3),
+        classify_image(detected_classes),
+        image_key(img_path),
+        objects,
+    ]
+
+
+def cached_row(img_path: Path, detection: Detection) -> List[Any]:
+    detected_objects, conf, category, objects_json = detection
+    return [
+        img_path.stem,
+        img_path.parent.name,
+        detected_objects,
+        conf,
+        category,
+        image_key(img_path),
+        json.loads(objects_json),
+    ]
+
+
+def csv_header(path: Path) -> Optional[List[str]]:
+    """First row of a CSV, or None if the file is missing or empty."""
+    if not path.exists():
+        return None
+    with open(path, newline="", encoding="utf-8") as f:
+        return next(csv.reader(f), None)
 
-    for i, img_path in enumerate(image_paths, start=1):
-        channel = img_path.parent.name
-        message_id = img_path.stem
 
-        result = MODEL(img_path, verbose=False)[0]
+def object_rows(row: List[Any]) -> List[List[Any]]:
+    """One row per box for yolo_objects.csv / raw.yolo_objects."""
+    return [[row[0], row[1], i, *obj] for i, obj in enumerate(row[BOXES])]
 
-        detected_classes = set()
-        max_conf = 0.0
 
-        if result.boxes is not None and len(result.boxes) > 0:
-            for box in result.boxes:
-                cls_name = MODEL.names[int(box.cls)]
-                conf = float(box.conf)
-                detected_classes.add(cls_name)
-                max_conf = max(max_conf, conf)
+def iter_detections(
+    image_paths: Sequence[Path],
+    weights: str = DEFAULT_MODEL,
+    batch_size: int = 16,
+    imgsz: int = 640,
+    prefetch: int = 2,
+    threads: int = 4,
+    label: str = "",
+) -> Iterator[List[List[Any]]]:
+    """Yield detection rows one inference batch at a time."""
+    model = load_model(weights)
+    names = model.names
 
-        category = classify_image(detected_classes)
+    started = time.perf_counter()
+    done = 0
+    next_log = PROGRESS_EVERY
+    for batch in iter_decoded_batches(image_paths, batch_size, prefetch, threads):
+        decoded = [(p, img) for p, img in batch if img is not None]
+        for p, img in batch:
+            if img is None:
+                print(f"{label}Skipping unreadable image {p}")
 
-        rows.append([
-            message_id,
-            channel,
-            ",".join(sorted(detected_classes)),
-            round(max_conf, 3),
-            category,
-            str(img_path).replace("\\", "/"),
-        ])
+        rows: List[List[Any]] = []
+        if decoded:
+            results = model.predict([img for _, img in decoded], imgsz=imgsz, verbose=False)
+            for (img_path, _), result in zip(decoded, results):
+                detected_classes, max_conf, objects = extract_detections(result, names)
+                rows.append(detection_row(img_path, detected_classes, max_conf, objects))
 
+        done += len(batch)
         # progress log every 50 images
-        if i % 50 == 0:
-            print(f"Processed {i}/{len(image_paths)} images...")
-
-    OUTPUT_CSV.parent.mkdir(parents=True, exist_ok=True)
-    with open(OUTPUT_CSV, "w", newline="", encoding="utf-8") as f:
-        writer = csv.writer(f)
-        writer.writerow([
-            "message_id",
-            "channel_name",
-            "detected_objects",
-            "confidence_score",
-            "image_category",
-            "image_path",
-        ])
-        writer.writerows(rows)
-
-    print(f"Saved {len(rows)} rows to {OUTPUT_CSV}")
+        if done >= next_log or done == len(image_paths):
+            rate = done / max(time.perf_counter() - started, 1e-9)
+            print(f"{label}Processed {done}/{len(image_paths)} images... {rate:.1f} img/s")
+            next_log = done + PROGRESS_EVERY
+
+        if rows:
+            yield rows
+
+
+def _init_shard_worker(torch_threads: int) -> None:
+    import torch
+
+    torch.set_num_threads(torch_threads)
+
+
+def _detect_chunk(
+    chunk_id: int,
+    image_paths: List[Path],
+    weights: str,
+    batch_size: int,
+    imgsz: int,
+    prefetch: int,
+    threads: int,
+) -> List[List[Any]]:
+    rows: List[List[Any]] = []
+    for batch_rows in iter_detections(
+        image_paths, weights, batch_size, imgsz, prefetch, threads, label=f"[chunk {chunk_id}] "
+    ):
+        rows.extend(batch_rows)
+    return rows
+
+
+def run_detection(
+    image_paths: List[Path],
+    weights: str,
+    batch_size: int,
+    imgsz: int,
+    prefetch: int,
+    threads: int,
+    workers: int,
+) -> Iterator[List[List[Any]]]:
+    """
+    Yield detection rows in batches as they complete. With workers > 1 the
+    images are split into chunks that are sharded across processes; each
+    chunk's rows are yielded as soon as that chunk finishes.
+    """
+    if workers <= 1 or len(image_paths) < 2:
+        yield from iter_detections(image_paths, weights, batch_size, imgsz, prefetch, threads)
+        return
+
+    # split the CPU between shards so torch intra-op threads don't oversubscribe
+    torch_threads = max((os.cpu_count() or 1) // workers, 1)
+    chunk_size = batch_size * CHUNK_BATCHES
+    chunks = [image_paths[i:i + chunk_size] for i in range(0, len(image_paths), chunk_size)]
+    with ProcessPoolExecutor(
+        max_workers=workers, initializer=_init_shard_worker, initargs=(torch_threads,)
+    ) as pool:
+        futures = [
+            pool.submit(_detect_chunk, i, chunk, weights, batch_size, imgsz, prefetch, threads)
+            for i, chunk in enumerate(chunks)
+        ]
+        for fut in as_completed(futures):
+            rows = fut.result()
+            if rows:
+                yield rows
+
+
+class CsvSink:
+    """
+    Writes detection rows to data/yolo_detections.csv and their boxes to
+    data/yolo_objects.csv. Existing files are appended to
+    (load_yolo_to_postgres keeps the last rows per message) unless their
+    header is out of date. Each detection gets a detection_id, repeated on
+    its boxes, so the loader can tell a message's detections apart.
+    `on_commit` gets the image keys of rows once they are flushed to the files.
+    """
+
+    def __init__(
+        self,
+        path: Path = OUTPUT_CSV,
+        objects_path: Path = OBJECTS_CSV,
+        append: bool = True,
+        on_commit: Optional[Callable[[List[str]], None]] = None,
+    ) -> None:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self.on_commit = on_commit
+        self.path = path
+        self.objects_path = objects_path
+        self.append = (
+            append
+            and csv_header(path) == CSV_HEADER
+            and csv_header(objects_path) == OBJECTS_CSV_HEADER
+        )
+        mode = "a" if self.append else "w"
+        self._f = open(path, mode, newline="", encoding="utf-8")
+        self._objects_f = open(objects_path, mode, newline="", encoding="utf-8")
+        self._writer = csv.writer(self._f)
+        self._objects_writer = csv.writer(self._objects_f)
+        if not self.append:
+            self._writer.writerow(CSV_HEADER)
+            self._objects_writer.writerow(OBJECTS_CSV_HEADER)
+        self._run_id = uuid.uuid4().hex[:12]
+        self.count = 0
+
+    def write(self, rows: List[List[Any]]) -> None:
+        ids = [f"{self._run_id}-{self.count + i}" for i in range(len(rows))]
+        # objects first: the loader treats the detections CSV as the commit point
+        for row, detection_id in zip(rows, ids):
+            self._objects_writer.writerows(obj + [detection_id] for obj in object_rows(row))
+        self._objects_f.flush()
+        self._writer.writerows(row[:BOXES] + [detection_id] for row, detection_id in zip(rows, ids))
+        self._f.flush()
+        self.count += len(rows)
+        if self.on_commit is not None:
+            self.on_commit([row[5] for row in rows])
+
+    def close(self) -> None:
+        self._objects_f.close()
+        self._f.close()
+        print(f"{'Appended' if self.append else 'Saved'} {self.count} rows to {self.path} and {self.objects_path}")
+
+
+class PostgresSink:
+    """
+    Streams detection rows straight into raw.yolo_detections (and their
+    boxes into raw.yolo_objects): rows are buffered up to `flush_size`, then
+    COPYed into staging tables and merged in their own transaction, so
+    finished work survives a crash. `on_commit` gets the image keys of each
+    merged batch after its transaction commits.
+    """
+
+    def __init__(
+        self,
+        flush_size: int = 500,
+        cursor_factory: Any = None,
+        on_commit: Optional[Callable[[List[str]], None]] = None,
+    ) -> None:
+        self.flush_size = flush_size
+        self.on_commit = on_commit
+        self._conn = psycopg2.connect(**get_db_params(), cursor_factory=cursor_factory)
+        self._buffer: List[Tuple] = []
+        self._objects: List[Tuple] = []
+        self._keys: List[str] = []
+        self.count = 0
+
+    def write(self, rows: List[List[Any]]) -> None:
+        for row in rows:
+            # unique within one COPY + merge, which is all the merge compares
+            detection_id = str(len(self._buffer))
+            self._keys.append(row[5])
+            self._buffer.append(detection_record(*row[:BOXES], detection_id))
+            self._objects.extend(object_record(*obj, detection_id) for obj in object_rows(row))
+        if len(self._buffer) >= self.flush_size:
+            self._flush()
+
+    def _flush(self) -> None:
+        if not self._buffer:
+            return
+        with self._conn:
+            with self._conn.cursor() as cur:
+                copy_and_merge_detections(cur, self._buffer, self._objects)
+        self.count += len(self._buffer)
+        if self.on_commit is not None:
+            self.on_commit(self._keys)
+        self._buffer = []
+        self._objects = []
+        self._keys = []
+
+    def close(self) -> None:
+        self._flush()
+        self._conn.close()
+        print(f"Merged {self.count} rows into raw.yolo_detections and raw.yolo_objects")
+
+
+def partition_image_paths(base_path: str, date_str: str) -> set[Path]:
+    """Images referenced by the messages of one data-lake partition."""
+    paths: set[Path] = set()
+    for f in list_channel_message_files(telegram_messages_partition_dir(base_path, date_str)):
+        for m in iter_channel_messages(f):
+            if m.get("image_path"):
+                paths.add(Path(m["image_path"]).resolve())
+    return paths
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description="YOLOv8 enrichment for downloaded Telegram images")
+    parser.add_argument("--model", type=str, default=DEFAULT_MODEL, help=f"YOLO weights (default: {DEFAULT_MODEL})")
+    parser.add_argument("--batch-size", type=int, default=16, help="Images per inference batch (default: 16)")
+    parser.add_argument("--imgsz", type=int, default=640, help="Inference image size (default: 640)")
+    parser.add_argument("--prefetch", type=int, default=2, help="Decoded batches kept in flight (default: 2)")
+    parser.add_argument("--threads", type=int, default=4, help="Image decode threads per process (default: 4)")
+    parser.add_argument("--workers", type=int, default=1, help="Inference processes; images are sharded across them (default: 1)")
+    parser.add_argument("--cache", type=Path, default=DEFAULT_CACHE_PATH, help=f"Detection cache (default: {DEFAULT_CACHE_PATH})")
+    parser.add_argument("--no-cache", action="store_true", help="Ignore the detection cache and rewrite the CSV from scratch")
+    parser.add_argument(
+        "--sink",
+        nargs="+",
+        choices=["csv", "postgres"],
+        default=["csv"],
+        help="Where detections go: csv (data/yolo_detections.csv) and/or postgres (raw.yolo_detections). Default: csv",
+    )
+    parser.add_argument("--flush-size", type=int, default=500, help="Rows per COPY+merge for the postgres sink (default: 500)")
+    parser.add_argument("--date", type=str, default=None, help="Only images of messages in this partition (YYYY-MM-DD)")
+    args = parser.parse_args(argv)
+
+    metrics = RunMetrics("yolo_detect", str(IMAGE_DIR.parents[1]), args.date)
+
+    image_paths = sorted(IMAGE_DIR.rglob("*.jpg"))
+    if args.date:
+        wanted = partition_image_paths(str(IMAGE_DIR.parents[1]), args.date)
+        image_paths = [p for p in image_paths if p.resolve() in wanted]
+
+    # Only images whose content (for this model) has not been seen are inferred;
+    # identical images in several channels are inferred once.
+    cache: Optional[DetectionCache] = None
+    hashes: Dict[Path, str] = {}
+    cached: Dict[str, Detection] = {}
+    to_infer = image_paths
+    if not args.no_cache:
+        with metrics.stage("cache_lookup") as st:
+            cache = DetectionCache(args.cache, Path(args.model).name, model_version(args.model))
+            hashes = cache.content_hashes(image_paths)
+            cached = cache.get_many(hashes.values())
+            pending: Dict[str, Path] = {}
+            for p in image_paths:
+                if hashes[p] not in cached:
+                    pending.setdefault(hashes[p], p)
+            to_infer = list(pending.values())
+            st.add(rows=len(image_paths))
+        print(f"Detection cache: {len(image_paths) - len(to_infer)} cached, {len(to_infer)} to infer")
+
+    # A path counts as exported only once its sink has committed the row; a
+    # crash before that leaves it to be re-sent from the cache next run.
+    hash_by_key = {image_key(p): h for p, h in hashes.items()}
+
+    def committed(sink_name: str) -> Optional[Callable[[List[str]], None]]:
+        if cache is None:
+            return None
+        return lambda keys: cache.mark_exported(sink_name, [(k, hash_by_key[k]) for k in keys])
+
+    sinks: Dict[str, Any] = {}
+    if "csv" in args.sink:
+        csv_sink = CsvSink(OUTPUT_CSV, OBJECTS_CSV, append=cache is not None, on_commit=committed("csv"))
+        if cache is not None and not csv_sink.append:
+            # the CSV is written from scratch: every cached result goes into it again
+            cache.clear_exports("csv")
+        sinks["csv"] = csv_sink
+    if "postgres" in args.sink:
+        sinks["postgres"] = PostgresSink(
+            flush_size=args.flush_size,
+            cursor_factory=metrics.cursor_factory(),
+            on_commit=committed("postgres"),
+        )
+
+    # Cache hits whose path a sink has no row for yet (a repost of a known
+    # image, a new sink, a rewritten CSV, a crash before the last flush) are
+    # written from the cache.
+    if cache is not None and cached:
+        hits = [p for p in image_paths if hashes[p] in cached]
+        for name, sink in sinks.items():
+            exported = cache.exported(name, [image_key(p) for p in hits])
+            rows = [cached_row(p, cached[hashes[p]]) for p in hits if exported.get(image_key(p)) != hashes[p]]
+            if rows:
+                print(f"{name}: {len(rows)} cached detections not exported yet")
+                sink.write(rows)
+
+    # paths sharing content with an inferred image get the same result
+    paths_by_hash: Dict[str, List[Path]] = {}
+    for p in image_paths:
+        paths_by_hash.setdefault(hashes.get(p, ""), []).append(p)
+    by_key = {image_key(p): p for p in to_infer}
+
+    csv_bytes_before = sum(p.stat().st_size for p in (OUTPUT_CSV, OBJECTS_CSV) if p.exists())
+    started = time.perf_counter()
+    try:
+        with metrics.stage("detect") as st:
+            try:
+                for rows in run_detection(
+                    to_infer,
+                    weights=args.model,
+                    batch_size=args.batch_size,
+                    imgsz=args.imgsz,
+                    prefetch=args.prefetch,
+                    threads=args.threads,
+                    workers=args.workers,
+                ):
+                    if cache is not None:
+                        fresh = {hashes[by_key[r[5]]]: (r[2], r[3], r[4], json.dumps(r[BOXES])) for r in rows}
+                        # safe before the sinks commit: unexported paths are re-sent next run
+                        cache.put_many(fresh.items())
+                        rows = [cached_row(p, det) for h, det in fresh.items() for p in paths_by_hash[h]]
+                    for sink in sinks.values():
+                        sink.write(rows)
+                    st.add(rows=len(rows))
+            finally:
+                for sink in sinks.values():
+                    sink.close()
+                if cache is not None:
+                    cache.close()
+            if "csv" in args.sink:
+                csv_bytes = sum(p.stat().st_size for p in (OUTPUT_CSV, OBJECTS_CSV) if p.exists())
+                # appended bytes, or the whole file when it was rewritten
+                st.add(nbytes=csv_bytes - csv_bytes_before if csv_bytes >= csv_bytes_before else csv_bytes)
+    finally:
+        metrics.write()
+    elapsed = time.perf_counter() - started
+
+    print(f"Inference: {len(to_infer)} images in {elapsed:.1f}s ({len(to_infer) / max(elapsed, 1e-9):.1f} img/s)")
 
 
 if __name__ == "__main__":